@@ -17,5 +17,35 @@ command_suite = (
             'ria-export-archive',
             'ria_export_archive'
         ),
+        (
+            'ria_remote.rebuild_index',
+            'RebuildStoreIndex',
+            'ria-rebuild-index',
+            'ria_rebuild_index'
+        ),
+        (
+            'ria_remote.pool_report',
+            'PoolReport',
+            'ria-pool-report',
+            'ria_pool_report'
+        ),
+        (
+            'ria_remote.pack_store',
+            'PackStore',
+            'ria-pack-store',
+            'ria_pack_store'
+        ),
+        (
+            'ria_remote.pack_dataset',
+            'PackDataset',
+            'ria-pack-dataset',
+            'ria_pack_dataset'
+        ),
+        (
+            'ria_remote.repack',
+            'RepackArchive',
+            'ria-repack-archive',
+            'ria_repack_archive'
+        ),
     ]
 )
@@ -0,0 +1,128 @@
+"""Bloom filter summarizing the keys held by a dataset in a RIA store
+
+A Bloom filter answers "is this key possibly present?" with no false
+negatives and a tunable rate of false positives. A RIA remote can load a
+dataset's filter once per session and answer checkpresent for keys that
+are definitely not in any archive without querying archives. The object
+tree is still checked, since keys can be stored there after the filter
+was loaded, or by clients that don't maintain the journal.
+
+Keys can't be removed from a Bloom filter. Keys stored after the filter
+was written are appended to a journal file next to it. Both are
+regenerated by `ria-rebuild-index`.
+
+File layout (all integers are little-endian)::
+
+  magic           8 bytes   b'RIABLOOM'
+  nhashes         uint32    number of bit positions per key
+  nbits           uint64    size of the bit array
+  bits            nbits / 8 bytes
+"""
+
+from hashlib import md5
+import math
+import os
+import struct
+
+# name of a dataset's filter file, placed in a dataset's directory in a store
+BLOOM_FILTER_FILENAME = 'ria-bloom-filter'
+# keys added after the filter was written, one per line
+BLOOM_JOURNAL_FILENAME = 'ria-bloom-filter.journal'
+
+_MAGIC = b'RIABLOOM'
+_HEADER = struct.Struct('<8sIQ')
+
+
+class BloomFilter(object):
+
+    def __init__(self, nbits, nhashes, bits=None):
+        # round up to full bytes
+        self.nbits = (max(nbits, 8) + 7) // 8 * 8
+        self.nhashes = nhashes
+        self.bits = bytearray(self.nbits // 8) if bits is None \
+            else bytearray(bits)
+        if len(self.bits) * 8 != self.nbits:
+            raise ValueError("Bloom filter size mismatch")
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate=0.01):
+        """Create an empty filter sized for a number of keys
+
+        Parameters
+        ----------
+        capacity : int
+          Expected number of keys.
+        fp_rate : float
+          False positive rate at the expected number of keys.
+        """
+        capacity = max(capacity, 1)
+        nbits = int(math.ceil(
+            -capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        nhashes = max(1, int(round(nbits / capacity * math.log(2))))
+        return cls(nbits, nhashes)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < _HEADER.size:
+            raise ValueError("Invalid Bloom filter")
+        magic, nhashes, nbits = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError("Invalid Bloom filter")
+        return cls(nbits, nhashes, data[_HEADER.size:])
+
+    def to_bytes(self):
+        return _HEADER.pack(_MAGIC, self.nhashes, self.nbits) \
+            + bytes(self.bits)
+
+    def _positions(self, key):
+        digest = md5(key.encode('utf-8')).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        # double hashing, an odd step visits distinct positions
+        h2 |= 1
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(key))
+
+
+def build_bloom_filter(keys, headroom=2, fp_rate=0.01):
+    """Create a filter for a collection of keys
+
+    Parameters
+    ----------
+    keys : collection
+    headroom : int
+      The filter is sized for this many times the given number of keys,
+      to stay effective while further keys are added.
+    fp_rate : float
+    """
+    bf = BloomFilter.for_capacity(len(keys) * headroom, fp_rate)
+    bf.update(keys)
+    return bf
+
+
+def read_bloom_filter(path):
+    with open(str(path), 'rb') as f:
+        return BloomFilter.from_bytes(f.read())
+
+
+def write_bloom_filter(path, bf):
+    """Write a filter file, atomically replacing any existing one"""
+    tmp_path = path.with_name(path.name + '.tmp{}'.format(os.getpid()))
+    try:
+        with open(str(tmp_path), 'wb') as f:
+            f.write(bf.to_bytes())
+        os.replace(str(tmp_path), str(path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,59 @@
+"""Classification of keys by whether their content is worth compressing
+
+Keys of git-annex' hashing backends with an 'E' suffix (e.g. MD5E) carry the
+file name extension of the annexed file, which identifies many formats that
+are compressed already. The content of any other key is classified by the
+entropy of a sample of it.
+"""
+
+from collections import Counter
+import math
+
+# extensions of file formats that are compressed already
+COMPRESSED_EXTENSIONS = frozenset((
+    '7z', 'avi', 'bz2', 'flac', 'gif', 'gz', 'heic', 'jp2', 'jpeg', 'jpg',
+    'lz4', 'lzma', 'm4a', 'mkv', 'mov', 'mp3', 'mp4', 'npz', 'ogg', 'png',
+    'rar', 'tgz', 'webm', 'webp', 'xz', 'zip', 'zst',
+))
+
+# number of bytes of a key's content that is sampled
+SAMPLE_SIZE = 1 << 16
+
+# entropy of a sample, in bits per byte, from which on content is considered
+# incompressible
+ENTROPY_THRESHOLD = 7.5
+
+
+def key_extension(key):
+    """Returns the (last) file name extension recorded in a key, or None"""
+    if not key.split('-', 1)[0].endswith('E'):
+        return None
+    name = key.split('--', 1)[-1]
+    return name.rsplit('.', 1)[1].lower() if '.' in name else None
+
+
+def byte_entropy(data):
+    """Returns the Shannon entropy of bytes, in bits per byte"""
+    total = len(data)
+    return -sum(
+        count / total * math.log2(count / total)
+        for count in Counter(data).values())
+
+
+def is_compressible(keypath):
+    """Whether compressing a key is likely to save a relevant amount of space
+
+    Parameters
+    ----------
+    keypath : Path
+      Key file, named after the key.
+    """
+    if key_extension(keypath.name) in COMPRESSED_EXTENSIONS:
+        return False
+    with open(str(keypath), 'rb') as f:
+        # file headers are often less random than the rest of a file, hence
+        # sample the middle
+        size = f.seek(0, 2)
+        f.seek(max(0, (size - SAMPLE_SIZE) // 2))
+        sample = f.read(SAMPLE_SIZE)
+    return byte_entropy(sample) < ENTROPY_THRESHOLD
@@ -11,16 +11,19 @@
 __docformat__ = 'restructuredtext'
 
 
+from contextlib import contextmanager
 import logging
 import os
 import os.path as op
 from hashlib import md5
+from itertools import chain
+import shutil
 import subprocess
+import tarfile
+import tempfile
+import zipfile
 from argparse import REMAINDER
 
-from datalad.utils import (
-    rmtree,
-)
 from datalad.interface.base import (
     Interface,
     build_doc,
@@ -31,7 +34,10 @@ from datalad.interface.results import (
 from datalad.interface.utils import eval_results
 from datalad.support.param import Parameter
 from datalad.support.constraints import (
+    EnsureChoice,
+    EnsureInt,
     EnsureNone,
+    EnsureRange,
     EnsureStr,
 )
 from datalad.distribution.dataset import (
@@ -44,25 +50,122 @@ from datalad.log import log_progress
 from datalad.dochelpers import (
     exc_str,
 )
+from ria_remote.bloom import (
+    BLOOM_FILTER_FILENAME,
+    read_bloom_filter,
+    write_bloom_filter,
+)
+from ria_remote.compression import is_compressible
+from ria_remote.keyindex import (
+    KEY_INDEX_FILENAME,
+    KeyIndex,
+    update_key_index,
+)
+from ria_remote.segments import (
+    SEGMENT_INDEX_FILENAME,
+    index_segment,
+    next_segment,
+    segment_number,
+)
+from ria_remote.store_index import (
+    STORE_INDEX_FILENAME,
+    StoreIndex,
+)
+from ria_remote.tarindex import (
+    tar_index_path,
+    write_tar_index,
+)
+from ria_remote.utils import (
+    ARCHIVE_SUFFIXES,
+    SHARD_CONFIG_FILENAME,
+    format_shard_config,
+    get_shard_name,
+    iter_archive_members,
+    iter_loose_keys,
+    parse_shard_config,
+)
 
 lgr = logging.getLogger('ria_remote.export_archive')
 
+# 7z options by compression profile
+COMPRESSION_PROFILES = {
+    # uncompressed, RIA remotes read keys by byte range
+    'store': ['-mx0'],
+    # solid blocks of at most 16 MB: reading a key decompresses no more than
+    # that. Small files share blocks, larger files have blocks of their own.
+    'random-access': ['-mx5', '-ms=16m', '-mmt=on'],
+    # every file in a block of its own
+    'non-solid': ['-mx5', '-ms=off', '-mmt=on'],
+    # smallest archives, but reading a key can require decompressing
+    # everything before it
+    'compact': ['-mx9', '-ms=on', '-mmt=on'],
+}
+
 
 @build_doc
 class ExportArchive(Interface):
     """Export an archive of a local annex object store for the RIA remote.
 
-    Keys in the local annex object store are reorganized in a temporary
-    directory (using links to avoid storage duplication) to use the
-    'hashdirlower' setup used by git-annex for bare repositories and
-    the directory-type special remote. This alternative object store is
-    then moved into a 7zip archive that is suitable for use in a
-    RIA remote dataset store. Placing such an archive into::
+    Keys in the local annex object store are written into a 7zip archive
+    that is suitable for use in a RIA remote dataset store, under the same
+    paths they have in the object store. Keys are passed to 7z in a list
+    file, such that no copy or link of the object store is needed. Placing
+    such an archive into::
 
       <dataset location>/archives/archive.7z
 
     Enables the RIA special remote to locate and retrieve all key contained
-    in the archive.
+    in the archive. If the archive is exported directly into a RIA store, the
+    keys in the archive are recorded in the dataset's key index, and in the
+    store-wide key index if the store has one.
+
+    Alternatively, keys can be exported into a ZIP archive
+    ('archives/archive.zip'), or an uncompressed tar archive
+    ('archives/archive.tar'), which are written directly from the local
+    annex object store. A tar archive is accompanied by an index of the
+    positions of its members ('archives/archive.tar.index'), which lets
+    the RIA remote read keys from it without the need for any external
+    tool.
+
+    With --incremental, keys are not added to a single archive. Instead,
+    only keys that are not yet in any archive in the target directory are
+    written into a new archive segment ('archives/archive-0001.7z',
+    'archives/archive-0002.7z', ...), and existing archives are left as
+    they are. A merged index ('archives/segments.index') records which
+    segment holds which key, and lets the RIA remote locate keys in
+    segments.
+
+    With --shard-prefix, keys are distributed into a number of archives by
+    the hash of a key ('archives/00.7z' ... 'archives/ff.7z'). The RIA
+    remote computes the shard that holds a key from the key itself. An
+    update only touches the shards that lack keys, and reads are spread
+    across files. RIA remotes only use the shards once all of them were
+    exported successfully, until then they read the previous archive. From
+    then on, they no longer read the previous archive, hence a dataset is
+    only sharded if all keys of that archive are exported again.
+
+    By default, archives are uncompressed. Compression profiles trade the
+    size of an archive for the time it takes to read a single key from it:
+
+    - 'store': no compression (the default). Keys are read directly from
+      their position in the archive.
+    - 'random-access': compression in solid blocks of at most 16 MB, such
+      that reading a key never requires decompressing more than that.
+    - 'non-solid': every key is compressed on its own.
+    - 'compact': a single solid block, yielding the smallest archives.
+      Reading a key can require decompressing the entire archive.
+
+    With --content-aware, only keys that are likely to compress are
+    compressed. Keys of formats that are compressed already (judging from
+    the file name extension in the key, e.g. '.nii.gz' or '.jpg'), or with
+    random-looking content, are stored uncompressed in the same archive,
+    and remain readable without decompression. Tar archives are never
+    compressed.
+
+    Compression uses multiple threads. The
+    ``tools/benchmark-archive-profiles`` script in the source repository
+    reports archive size and per-key read latency of each profile for a
+    sample of data.
     """
     _params_ = dict(
         dataset=Parameter(
@@ -74,15 +177,52 @@ class ExportArchive(Interface):
         target=Parameter(
             args=("target",),
             metavar="TARGET",
-            doc="""if an existing directory, an 'archive.7z' is placed into
-            it, otherwise this is the path to the target archive""",
+            doc="""if an existing directory, an 'archive.7z' (or
+            'archive.zip', 'archive.tar') is placed into it, otherwise this
+            is the path to the target archive""",
             constraints=EnsureStr() | EnsureNone()),
+        archive_format=Parameter(
+            args=("--format",),
+            dest="archive_format",
+            doc="""archive format. If not given, a ZIP or tar archive is
+            created for a target with a '.zip' or '.tar' extension,
+            respectively, and a 7z archive otherwise. ZIP and tar archives
+            are created without the need for an external tool. ZIP archives
+            can be read by the RIA remote without one, if it has local
+            access to the archive, tar archives in any case.""",
+            constraints=EnsureChoice('7z', 'zip', 'tar') | EnsureNone()),
+        incremental=Parameter(
+            args=("--incremental",),
+            action="store_true",
+            doc="""write keys that are not in any archive in the TARGET
+            directory yet into a new archive segment"""),
+        shard_prefix=Parameter(
+            args=("--shard-prefix",),
+            metavar="NCHARS",
+            doc="""distribute keys into archive shards in the TARGET
+            directory, named after the first NCHARS hex digits of the MD5
+            hash of a key (e.g. 'ab.7z' for 2), i.e. up to 16^NCHARS
+            archives. NCHARS must be between 1 and 4.""",
+            constraints=EnsureInt() & EnsureRange(1, 4) | EnsureNone()),
+        profile=Parameter(
+            args=("--profile",),
+            doc="""compression profile, see above. Defaults to 'store', or
+            'random-access' with --content-aware""",
+            constraints=EnsureChoice(*sorted(COMPRESSION_PROFILES))
+            | EnsureNone()),
+        content_aware=Parameter(
+            args=("--content-aware",),
+            action="store_true",
+            doc="""only compress keys whose content is likely to compress,
+            and store all others uncompressed, see above"""),
         opts=Parameter(
             args=("opts",),
             nargs=REMAINDER,
             metavar="...",
-            doc="""list of options for 7z to replace the default '-mx0' to
-            generate an uncompressed archive"""),
+            doc="""list of options for 7z, which take precedence over those
+            of the compression profile. For ZIP archives, any compression
+            level other than '-mx0' yields deflated members. Tar archives
+            are never compressed"""),
     )
 
     @staticmethod
@@ -91,6 +231,11 @@ class ExportArchive(Interface):
     def __call__(
             target,
             dataset=None,
+            archive_format=None,
+            incremental=False,
+            shard_prefix=None,
+            profile=None,
+            content_aware=False,
             opts=None):
         # only non-bare repos have hashdirmixed, so require one
         ds = require_dataset(
@@ -104,56 +249,308 @@ class ExportArchive(Interface):
 
         annex_objs = ds_repo.dot_git / 'annex' / 'objects'
 
-        archive = resolve_path(target, dataset)
-        if archive.is_dir():
-            archive = archive / 'archive.7z'
-        else:
-            archive.parent.mkdir(exist_ok=True, parents=True)
-
-        if not opts:
-            # uncompressed by default
-            opts = ['-mx0']
-
         res_kwargs = dict(
             action="export-ria-archive",
             logger=lgr,
         )
 
-        if not annex_objs.is_dir():
+        archive = resolve_path(target, dataset)
+        if archive_format is None:
+            archive_format = archive.suffix[1:] \
+                if archive.suffix in ('.zip', '.tar') else '7z'
+        if (incremental or shard_prefix) and not archive.is_dir():
             yield get_status_dict(
                 ds=ds,
-                status='notneeded',
-                message='no annex keys present',
+                status='impossible',
+                message=(
+                    '%s export requires an existing target directory: %s',
+                    'incremental' if incremental else 'sharded',
+                    str(archive)),
                 **res_kwargs,
             )
             return
+        if incremental and shard_prefix:
+            yield get_status_dict(
+                ds=ds,
+                status='impossible',
+                message='sharded archives cannot be exported incrementally',
+                **res_kwargs,
+            )
+            return
+        if shard_prefix:
+            shard_config = archive / SHARD_CONFIG_FILENAME
+            if shard_config.exists() \
+                    and parse_shard_config(shard_config.read_text()) \
+                    != (shard_prefix, archive_format):
+                yield get_status_dict(
+                    ds=ds,
+                    status='impossible',
+                    message=(
+                        'archives are sharded differently already: %s',
+                        str(shard_config)),
+                    **res_kwargs,
+                )
+                return
+        elif incremental:
+            archive = next_segment(archive, archive_format)
+        elif archive.is_dir():
+            archive = archive / 'archive.{}'.format(archive_format)
+        else:
+            archive.parent.mkdir(exist_ok=True, parents=True)
+
+        if profile is None:
+            profile = 'random-access' if content_aware else 'store'
+        # later options override earlier ones
+        opts = COMPRESSION_PROFILES[profile] + (opts or [])
 
-        exportdir = ds_repo.dot_git / 'datalad' / 'tmp' / 'ria_archive'
-        if exportdir.exists():
+        if not annex_objs.is_dir():
             yield get_status_dict(
                 ds=ds,
-                status='error',
-                message=(
-                    'export directory already exists, please remove first: %s',
-                    str(exportdir)),
+                status='notneeded',
+                message='no annex keys present',
                 **res_kwargs,
             )
             return
 
-        keypaths = [
-            k for k in annex_objs.glob(op.join('**', '*'))
-            if k.is_file()
-        ]
+        # keys are walked lazily, and never held in memory all at once,
+        # unless they need to be distributed into shards
+        keypaths = (
+            annex_objs / relpath
+            for relpath, _ in iter_loose_keys(annex_objs))
+        if incremental:
+            keypaths = _select_unarchived(archive.parent, keypaths)
+            first = next(keypaths, None)
+            if first is None:
+                yield get_status_dict(
+                    ds=ds,
+                    status='notneeded',
+                    message='all keys are archived already',
+                    **res_kwargs,
+                )
+                return
+            keypaths = chain([first], keypaths)
+        if shard_prefix:
+            keypaths = list(keypaths)
+            stranded = [] if shard_config.exists() \
+                else _select_stranded(archive, keypaths)
+            if stranded:
+                yield get_status_dict(
+                    ds=ds,
+                    status='impossible',
+                    message=(
+                        '%i keys in the previous archive are not in the '
+                        'annex, they would be unreachable once sharded '
+                        '(e.g. %s). Get them first',
+                        len(stranded), stranded[0]),
+                    **res_kwargs,
+                )
+                return
+            targets = _select_shards(
+                archive, keypaths, shard_prefix, archive_format)
+            if not targets:
+                if not shard_config.exists():
+                    # a previous export failed after all shards were written
+                    shard_config.write_text(
+                        format_shard_config(shard_prefix, archive_format))
+                yield get_status_dict(
+                    ds=ds,
+                    status='notneeded',
+                    message='all keys are archived already',
+                    **res_kwargs,
+                )
+                return
+        else:
+            targets = [(archive, keypaths)]
 
         log_progress(
             lgr.info,
             'riaarchiveexport',
             'Start RIA archive export %s', ds,
-            total=len(keypaths),
+            # unknown, unless keys were distributed into shards
+            total=sum(len(t[1]) for t in targets) if shard_prefix else None,
             label='RIA archive export',
             unit=' Keys',
         )
+        failed = False
+        try:
+            for archive, archive_keypaths in targets:
+                try:
+                    if content_aware and archive_format != 'tar':
+                        # incompressible keys are stored in blocks (or ZIP
+                        # members) of their own, such that they can be read
+                        # by byte range
+                        stored, compressed = _split_compressible(
+                            archive_keypaths)
+                        for part, part_opts in ((stored, opts + ['-mx0']),
+                                                (compressed, opts)):
+                            if part:
+                                _export_keys(archive_format, archive,
+                                             annex_objs, part, part_opts)
+                    else:
+                        _export_keys(archive_format, archive, annex_objs,
+                                     archive_keypaths, opts)
+                    if incremental:
+                        index_segment(archive)
+                    store_indexed = _update_store_indices(archive, ds.id)
+                except Exception as e:
+                    failed = True
+                    yield get_status_dict(
+                        path=str(archive),
+                        type='file',
+                        status='error',
+                        message=('%s export failed: %s',
+                                 archive_format, exc_str(e)),
+                        **res_kwargs)
+                    continue
+                yield get_status_dict(
+                    path=str(archive),
+                    type='file',
+                    status='ok',
+                    **res_kwargs)
+                if not store_indexed:
+                    yield get_status_dict(
+                        path=str(archive),
+                        type='file',
+                        status='impossible',
+                        message='the dataset directory is not at the base '
+                                'path of a RIA store, the store index was '
+                                'not updated. Export via the dataset\'s '
+                                'link at the base path of its store, or run '
+                                'ria-rebuild-index',
+                        **res_kwargs)
+            if shard_prefix and failed:
+                yield get_status_dict(
+                    ds=ds,
+                    path=str(shard_config),
+                    status='error',
+                    message='not all shards were exported, RIA remotes '
+                            'keep reading the previous archive',
+                    **res_kwargs)
+            elif shard_prefix:
+                # only now RIA remotes look for keys in shards, all of them
+                # are complete
+                shard_config.write_text(
+                    format_shard_config(shard_prefix, archive_format))
+        finally:
+            log_progress(
+                lgr.info,
+                'riaarchiveexport',
+                'Finished RIA archive export from %s', ds
+            )
+
+
+def _select_stranded(archive_dir, keypaths):
+    """Returns the keys of a dataset's archive that are not to be exported
+
+    Once a dataset's archives are sharded, RIA remotes don't read its
+    previous (unsegmented) archive anymore.
+    """
+    exported = set(k.name for k in keypaths)
+    stranded = []
+    for suffix in ARCHIVE_SUFFIXES:
+        previous = archive_dir / 'archive{}'.format(suffix)
+        if previous.exists():
+            stranded.extend(
+                op.basename(member)
+                for member, _ in iter_archive_members(previous)
+                if op.basename(member) not in exported)
+    return stranded
+
+
+def _select_shards(archive_dir, keypaths, prefix_length, archive_format):
+    """Distribute keys into archive shards
+
+    Returns
+    -------
+    list
+      (archive, keypaths) for all shards that lack any of their keys. Shards
+      that have all their keys already are left alone.
+    """
+    shards = dict()
+    for keypath in keypaths:
+        shards.setdefault(
+            get_shard_name(keypath.name, prefix_length, archive_format),
+            []).append(keypath)
+    targets = []
+    for name, shard_keypaths in sorted(shards.items()):
+        archive = archive_dir / name
+        if archive.exists():
+            present = set(
+                op.basename(member)
+                for member, _ in iter_archive_members(archive))
+            if all(k.name in present for k in shard_keypaths):
+                continue
+        targets.append((archive, shard_keypaths))
+    return targets
+
+
+def _select_unarchived(archive_dir, keypaths):
+    """Yield the key paths of keys that are in no archive in a directory
+
+    Segments are looked up in the merged index, only other archives (and
+    segments missing from the index) are listed.
+    """
+    index_path = archive_dir / SEGMENT_INDEX_FILENAME
+    index = KeyIndex(index_path) if index_path.exists() else None
+    indexed = index.locations if index is not None else {}
+    archived = set()
+    for archive in archive_dir.iterdir():
+        if archive.suffix not in ARCHIVE_SUFFIXES \
+                or (segment_number(archive.name) is not None
+                    and archive.name in indexed):
+            continue
+        archived.update(
+            op.basename(member)
+            for member, _ in iter_archive_members(archive))
+    try:
+        for k in keypaths:
+            if k.name not in archived \
+                    and not (index is not None and k.name in index):
+                yield k
+    finally:
+        if index is not None:
+            index.close()
+
 
+def _split_compressible(keypaths):
+    """Returns lists of the incompressible and the compressible keys"""
+    stored = []
+    compressed = []
+    for keypath in keypaths:
+        (compressed if is_compressible(keypath) else stored).append(keypath)
+    return stored, compressed
+
+
+def _export_keys(archive_format, archive, annex_objs, keypaths, opts):
+    """Add keys to an archive of any format"""
+    if archive_format == 'zip':
+        _export_zip(archive, keypaths, opts)
+    elif archive_format == 'tar':
+        _export_tar(archive, keypaths)
+    else:
+        _export_7z(archive, annex_objs, keypaths, opts)
+
+
+def _export_7z(archive, annex_objs, keypaths, opts):
+    """Add keys to a 7z archive
+
+    7z is run in `annex_objs` and reads the paths of the keys, relative to
+    it, from a list file. Hence members get the same paths as in the object
+    store, without organizing keys in a directory of their own first.
+
+    Parameters
+    ----------
+    archive : Path
+    annex_objs : Path
+      Annex object store the keys are in.
+    keypaths : iterable
+      Paths of key files in `annex_objs`.
+    opts : list
+      7z options.
+    """
+    with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', prefix='ria_archive',
+            suffix='.lst') as listfile:
         for keypath in keypaths:
             key = keypath.name
             hashdir = op.join(keypath.parts[-4], keypath.parts[-3])
@@ -163,32 +560,172 @@ class ExportArchive(Interface):
                 'Export key %s to %s', key, hashdir,
                 update=1,
                 increment=True)
-            keydir = exportdir / hashdir / key
-            keydir.mkdir(parents=True, exist_ok=True)
-            os.link(str(keypath), str(keydir / key))
-
-        log_progress(
-            lgr.info,
-            'riaarchiveexport',
-            'Finished RIA archive export from %s', ds
+            listfile.write(
+                '/'.join((keypath.parts[-4], keypath.parts[-3], key, key))
+                + '\n')
+        listfile.flush()
+        subprocess.run(
+            # list file in UTF-8, no wildcard matching of its paths
+            ['7z', 'u', '-scsUTF-8', '-spd', str(archive),
+             '@' + listfile.name] + opts,
+            cwd=str(annex_objs),
+            check=True,
         )
-        try:
-            subprocess.run(
-                ['7z', 'u', str(archive), '.'] + opts,
-                cwd=str(exportdir),
-            )
-            yield get_status_dict(
-                path=str(archive),
-                type='file',
-                status='ok',
-                **res_kwargs)
-        except Exception as e:
-            yield get_status_dict(
-                path=str(archive),
-                type='file',
-                status='error',
-                message=('7z failed: %s', exc_str(e)),
-                **res_kwargs)
-            return
-        finally:
-            rmtree(str(exportdir))
+
+
+@contextmanager
+def _replacing(archive):
+    """Provide a copy of an archive to update, that then replaces it
+
+    Like `7z u` does, archives are never modified in place: an interrupted
+    update leaves them intact, and readers never see them change. The copy
+    has the name of the archive, in a temporary directory next to it. A tar
+    index written for the copy replaces the archive's index, right after the
+    archive (the index records a stamp of the archive it describes, hence
+    readers never use a mismatched pair).
+    """
+    tmpdir = tempfile.mkdtemp(prefix='.ria-export-', dir=str(archive.parent))
+    try:
+        copy = archive.parent / op.basename(tmpdir) / archive.name
+        if archive.exists():
+            shutil.copyfile(str(archive), str(copy))
+        yield copy
+        os.replace(str(copy), str(archive))
+        if tar_index_path(copy).exists():
+            os.replace(str(tar_index_path(copy)), str(tar_index_path(archive)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _export_zip(archive, keypaths, opts):
+    """Add keys to a ZIP archive
+
+    Like `7z u`, keys that are already in an existing archive are kept
+    as they are, and the archive is replaced rather than modified.
+
+    Parameters
+    ----------
+    archive : Path
+    keypaths : iterable
+      Paths of key files in an annex object tree.
+    opts : list
+      7z options. Only the compression level is considered: '-mx0' yields
+      uncompressed members, any other level deflated members.
+    """
+    levels = [o.replace('=', '') for o in opts if o.startswith('-mx')]
+    compression = zipfile.ZIP_DEFLATED \
+        if levels and levels[-1] != '-mx0' else zipfile.ZIP_STORED
+    with _replacing(archive) as copy, zipfile.ZipFile(
+            str(copy),
+            mode='a' if copy.exists() else 'w',
+            compression=compression,
+            allowZip64=True) as zf:
+        present = set(zf.namelist())
+        for keypath in keypaths:
+            key = keypath.name
+            hashdir = op.join(keypath.parts[-4], keypath.parts[-3])
+            log_progress(
+                lgr.info,
+                'riaarchiveexport',
+                'Export key %s to %s', key, hashdir,
+                update=1,
+                increment=True)
+            member = '/'.join((keypath.parts[-4], keypath.parts[-3], key, key))
+            if member not in present:
+                zf.write(str(keypath), arcname=member)
+
+
+def _export_tar(archive, keypaths):
+    """Add keys to an uncompressed tar archive, and index it
+
+    Like `7z u`, keys that are already in an existing archive are kept
+    as they are, and the archive is replaced rather than modified.
+
+    Parameters
+    ----------
+    archive : Path
+    keypaths : iterable
+      Paths of key files in an annex object tree.
+    """
+    with _replacing(archive) as copy:
+        _append_tar(copy, keypaths)
+        write_tar_index(copy)
+
+
+def _append_tar(archive, keypaths):
+    """Add keys to a tar archive in place, or create it"""
+    with tarfile.open(
+            str(archive),
+            mode='a' if archive.exists() else 'w',
+            format=tarfile.PAX_FORMAT,
+            dereference=True) as tf:
+        present = set(tf.getnames())
+        for keypath in keypaths:
+            key = keypath.name
+            hashdir = op.join(keypath.parts[-4], keypath.parts[-3])
+            log_progress(
+                lgr.info,
+                'riaarchiveexport',
+                'Export key %s to %s', key, hashdir,
+                update=1,
+                increment=True)
+            member = '/'.join((keypath.parts[-4], keypath.parts[-3], key, key))
+            if member not in present:
+                tf.add(str(keypath), arcname=member, recursive=False)
+
+
+def _update_store_indices(archive, dsid):
+    """Record the members of an archive in the indices of a store
+
+    Nothing is done, unless `archive` is placed at
+    <dsid[:3]>/<dsid[3:]>/archives/<name> beneath the base path of a RIA
+    store, or in a dataset directory of a store (which can be in a root of
+    the store other than its base path). The dataset's key index is written
+    in any case, the store-wide key index and the dataset's Bloom filter
+    only if they exist.
+
+    Returns
+    -------
+    bool
+      False, if the store-wide key index could not be updated, because the
+      archive is in a dataset directory that isn't beneath the base path of
+      its store.
+    """
+    if len(archive.parts) < 5 or archive.parent.name != 'archives':
+        return True
+    dsdir = archive.parent.parent
+    base_path = dsdir.parent.parent
+    at_base_path = (base_path / 'ria-layout-version').exists()
+    if dsdir.parent.name + dsdir.name != dsid \
+            or not (at_base_path or (dsdir / 'ria-layout-version').exists()):
+        return True
+    location = 'archives/{}'.format(archive.name)
+    # updates keep members of previous exports to the same archive,
+    # hence record what is actually in there
+    members = list(iter_archive_members(archive))
+    update_key_index(
+        dsdir / KEY_INDEX_FILENAME,
+        location,
+        [(op.basename(member), 0, size) for member, size in members],
+        stamp=archive.stat().st_size)
+    bloom_filter_path = dsdir / BLOOM_FILTER_FILENAME
+    if bloom_filter_path.exists():
+        bloom_filter = read_bloom_filter(bloom_filter_path)
+        bloom_filter.update(op.basename(member) for member, _ in members)
+        write_bloom_filter(bloom_filter_path, bloom_filter)
+    if not at_base_path:
+        # the store might have an index, but we can't tell where it is
+        return False
+    if not (base_path / STORE_INDEX_FILENAME).exists():
+        return True
+    index = StoreIndex(base_path / STORE_INDEX_FILENAME)
+    try:
+        index.create_tables()
+        index.replace(
+            dsid,
+            [(op.basename(member), location, member, size)
+             for member, size in members],
+            location=location)
+    finally:
+        index.close()
+    return True
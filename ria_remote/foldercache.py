@@ -0,0 +1,133 @@
+"""Session cache of the unpacked data of compressed 7z folders
+
+With solid compression, many archive members share a folder, and the
+content of a member can only be obtained by unpacking its folder from the
+start. Retrieving the members of a folder one by one would unpack the
+folder over and over again. Instead, the unpacked data of a folder is kept
+in a temporary file, together with the decompressor that produced it, and
+both are reused for later members of the same folder: members preceding
+the furthest one retrieved so far are read from the file, and unpacking
+continues where it stopped for members beyond it.
+
+The cache is bounded by the total size of the unpacked data it holds.
+Folders that were used least recently are evicted first, and folders that
+are larger than the whole cache aren't cached at all.
+"""
+
+from collections import OrderedDict
+import os
+import tempfile
+
+from ria_remote.sevenzip import (
+    SevenZipError,
+    iter_unpacked,
+    unpack_member,
+)
+
+# default bound of the unpacked data held by a cache, in bytes
+FOLDER_CACHE_SIZE = 1 << 30
+
+
+class _Entry(object):
+    """Unpacked data of a folder, as far as it was unpacked"""
+
+    def __init__(self, dirname, folder, read):
+        self.file = tempfile.TemporaryFile(dir=dirname)
+        self.size = 0
+        # None, once the folder is completely unpacked
+        self.chunks = iter_unpacked(folder, read)
+
+    def extend(self, size):
+        """Unpack the folder until at least `size` bytes are available"""
+        while self.size < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                raise SevenZipError("Truncated 7z folder")
+            os.pwrite(self.file.fileno(), chunk, self.size)
+            self.size += len(chunk)
+
+    def copy(self, offset, length, out):
+        """Write a part of the unpacked data to a file object"""
+        while length > 0:
+            chunk = os.pread(self.file.fileno(), min(length, 1 << 20), offset)
+            if not chunk:
+                raise SevenZipError("Truncated 7z folder")
+            out.write(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+
+    def close(self):
+        self.file.close()
+        self.chunks = None
+
+
+class FolderCache(object):
+    """LRU cache of unpacked 7z folders, spilled to a temporary directory"""
+
+    def __init__(self, max_size=FOLDER_CACHE_SIZE, dirname=None):
+        """
+        Parameters
+        ----------
+        max_size : int
+          Bound of the total size of the unpacked data held, in bytes. With
+          0, nothing is cached.
+        dirname : str, optional
+          Directory to hold the unpacked data in. By default, the system's
+          temporary directory.
+        """
+        self.max_size = max_size
+        self.dirname = dirname
+        # entries by key, least recently used first
+        self._entries = OrderedDict()
+        self.size = 0
+
+    def get_member(self, key, folder, member, read, out):
+        """Write the content of a member of a folder to a file object
+
+        Parameters
+        ----------
+        key : hashable
+          Identifies the folder, e.g. archive path, modification stamp, and
+          folder index.
+        folder : Folder
+        member : Member
+        read : callable
+          Reads the archive, see `sevenzip.iter_unpacked()`.
+        out : file object
+        """
+        if folder.size > self.max_size:
+            # can't be held
+            unpack_member(folder, member, read, out)
+            return
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            entry = _Entry(self.dirname, folder, read)
+        cached = entry.size
+        try:
+            entry.extend(member.offset + member.size)
+            entry.copy(member.offset, member.size, out)
+        except Exception:
+            self.size -= cached
+            entry.close()
+            raise
+        self.size += entry.size - cached
+        if entry.size >= folder.size:
+            # release the decompressor
+            entry.chunks = None
+        self._entries[key] = entry
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is within bounds
+        """
+        while self.size > self.max_size and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            entry.close()
+
+    def clear(self):
+        for entry in self._entries.values():
+            entry.close()
+        self._entries.clear()
+        self.size = 0
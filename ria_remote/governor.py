@@ -0,0 +1,178 @@
+"""Limits of the transfers of all RIA remotes on a machine to a store host
+
+Every git-annex-remote-ria process runs its transfers independently, and
+many parallel jobs of many users can overwhelm a store host. A governor
+coordinates the processes on a machine via files in a state directory per
+store host:
+
+- Concurrency: a transfer holds one of a number of slot files, locked with
+  `flock()`. Locks are released by the kernel when a process dies, hence
+  they never go stale.
+
+- Bandwidth: transfers reserve time on a shared clock, in proportion to
+  their size, and start once their reservation is due. This limits the
+  average aggregate rate of transfers, not the rate within a transfer.
+
+- Adaptation: the number of slots in use floats between one and the
+  configured maximum. After each transfer, the aggregate throughput is
+  estimated as the transfer's rate times the number of active transfers.
+  While the estimate is close to the best one seen recently, and all slots
+  are busy, another slot is opened. Once the estimate drops well below the
+  best, the store is considered overloaded and slots are closed
+  multiplicatively.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import time
+from pathlib import Path
+
+from ria_remote.utils import get_cache_dir
+
+# seconds between attempts to obtain a slot
+POLL_INTERVAL = 0.2
+
+# transfers of fewer bytes are dominated by latency, and aren't used to
+# estimate the throughput
+MIN_SAMPLE_SIZE = 1 << 20
+
+# weight of a new sample in the moving average of the aggregate throughput
+SAMPLE_WEIGHT = 0.2
+
+# factor by which the best throughput seen is reduced with every sample,
+# such that it follows changing conditions
+BEST_DECAY = 0.99
+
+# fraction of the best throughput below which slots are closed, and the
+# factor by which they are reduced then
+BACKOFF_THRESHOLD = 0.7
+BACKOFF_FACTOR = 0.75
+
+
+def get_state_dir(host):
+    """Returns the default state directory of the governor of a store host"""
+    return get_cache_dir() / 'governor' / host
+
+
+class Governor(object):
+    """Transfer limits for a store host, shared by the processes on a machine
+    """
+
+    def __init__(self, path, max_transfers=None, max_bandwidth=None):
+        """
+        Parameters
+        ----------
+        path : Path
+          State directory, created as needed.
+        max_transfers : int, optional
+          Maximum number of concurrent transfers.
+        max_bandwidth : int, optional
+          Maximum aggregate rate of transfers, in bytes per second.
+        """
+        self.path = Path(path)
+        self.max_transfers = max_transfers
+        self.max_bandwidth = max_bandwidth
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _state(self):
+        """Yields the shared state as a dict, saved and unlocked afterwards"""
+        with open(str(self.path / 'state'), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def _slot_path(self, i):
+        return str(self.path / 'slot-{}'.format(i))
+
+    def get_limit(self):
+        """Returns the number of slots that are currently open"""
+        with self._state() as state:
+            return min(state.get('limit', self.max_transfers),
+                       self.max_transfers)
+
+    def _acquire_slot(self):
+        """Returns the open file of a locked slot, once one is free"""
+        while True:
+            for i in range(self.get_limit()):
+                f = open(self._slot_path(i), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except BlockingIOError:
+                    f.close()
+            time.sleep(POLL_INTERVAL)
+
+    def count_active(self):
+        """Returns the number of slots that are held"""
+        active = 0
+        for i in range(self.max_transfers):
+            if not os.path.exists(self._slot_path(i)):
+                continue
+            with open(self._slot_path(i), 'a') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    active += 1
+        return active
+
+    def _reserve(self, nbytes):
+        """Wait until a transfer of `nbytes` fits the bandwidth limit"""
+        with self._state() as state:
+            now = time.time()
+            start = max(now, state.get('next_free', 0))
+            state['next_free'] = start + nbytes / self.max_bandwidth
+        if start > now:
+            time.sleep(start - now)
+
+    def _adapt(self, nbytes, duration):
+        """Adjust the number of open slots to the outcome of a transfer"""
+        if nbytes < MIN_SAMPLE_SIZE or duration <= 0:
+            return
+        active = self.count_active()
+        sample = nbytes / duration * active
+        with self._state() as state:
+            limit = min(state.get('limit', self.max_transfers),
+                        self.max_transfers)
+            average = state.get('average')
+            average = sample if average is None \
+                else (1 - SAMPLE_WEIGHT) * average + SAMPLE_WEIGHT * sample
+            best = max(state.get('best', 0) * BEST_DECAY, average)
+            if average < BACKOFF_THRESHOLD * best:
+                limit = max(1, int(limit * BACKOFF_FACTOR))
+                # start over, rather than backing off repeatedly on account
+                # of the same congestion
+                average = best = None
+            elif active >= limit:
+                limit = min(self.max_transfers, limit + 1)
+            state.update(limit=limit, average=average, best=best or 0)
+
+    @contextmanager
+    def transfer(self, nbytes=None):
+        """Context of a transfer, started once it is within the limits
+
+        Parameters
+        ----------
+        nbytes : int, optional
+          Size of the transfer, if known.
+        """
+        slot = self._acquire_slot() if self.max_transfers else None
+        try:
+            if self.max_bandwidth and nbytes:
+                self._reserve(nbytes)
+            start = time.time()
+            yield
+            if slot is not None and nbytes:
+                self._adapt(nbytes, time.time() - start)
+        finally:
+            if slot is not None:
+                slot.close()
@@ -0,0 +1,299 @@
+"""Compact on-disk index of the keys of a dataset in a RIA store
+
+An index is a binary file with fixed-width records sorted by an MD5 digest
+of the key, that is opened via `mmap` and searched by bisection. Hence,
+lookups take O(log n) and no process needs to load the index into memory.
+Several processes reading the same index share its pages via the page cache.
+
+File layout (all integers are little-endian)::
+
+  magic           8 bytes   b'RIAKIDX1'
+  count           uint64    number of records
+  nlocations      uint64    number of locations
+  fanout          256 x uint64
+                            number of records with a digest whose first
+                            byte is less or equal than the table position
+  digests         count x 16 bytes, sorted
+  records         count x (uint32 location, uint32 reserved,
+                           uint64 offset, uint64 size)
+                            in the order of the digests. A key that is
+                            kept in several locations has several records.
+  locations       nlocations x (uint64 stamp, uint32 length, name)
+
+A location is where keys are kept, like an archive ('archives/archive.7z').
+The stamp of a location allows for detecting whether it changed since the
+index was written (for archives their size is used). Offset and size
+describe the position of a key's content within a location, where this is
+known (0 otherwise).
+
+The key index of a dataset in a store only describes its archives, which
+change only when they are written as a whole. The annex object tree isn't
+indexed: RIA remotes store and remove loose keys without updating the
+index.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from hashlib import md5
+import heapq
+import mmap
+import os
+import struct
+
+# name of a dataset's index file, placed in a dataset's directory in a store
+KEY_INDEX_FILENAME = 'ria-key-index'
+
+_MAGIC = b'RIAKIDX1'
+_HEADER = struct.Struct('<8sQQ')
+_FANOUT = struct.Struct('<256Q')
+_DIGEST_SIZE = 16
+_RECORD = struct.Struct('<IIQQ')
+_LOCATION = struct.Struct('<QI')
+
+KeyIndexEntry = namedtuple('KeyIndexEntry', ['location', 'offset', 'size'])
+
+
+def key_digest(key):
+    return md5(key.encode('utf-8')).digest()
+
+
+def write_key_index(path, records, stamps=None):
+    """Write an index file
+
+    The file is written to a temporary location next to `path` first and
+    then atomically moved into place.
+
+    Parameters
+    ----------
+    path : Path
+    records : iterable
+      (key, location, offset, size) tuples. A key can be recorded for
+      any number of locations.
+    stamps : dict, optional
+      Mapping of location names to their stamps. Locations without a
+      stamp get 0.
+    """
+    _write(
+        path,
+        ((key_digest(key), location, offset, size)
+         for key, location, offset, size in records),
+        stamps)
+
+
+def update_key_index(path, location, records, stamp=0):
+    """Replace the records of one location in an index file
+
+    The records of other locations are streamed from the existing index and
+    merged with the new ones, without loading the index into memory.
+
+    Parameters
+    ----------
+    path : Path
+      If there is no index file yet, it is created.
+    location : str
+    records : iterable
+      (key, offset, size) tuples.
+    stamp : int, optional
+    """
+    new = sorted(set(
+        (key_digest(key), offset or 0, size or 0)
+        for key, offset, size in records))
+    if not path.exists():
+        _write(
+            path,
+            ((digest, location, offset, size)
+             for digest, offset, size in new),
+            {location: stamp})
+        return
+    with _replacing(path) as tmp_path, KeyIndex(path) as index:
+        # keep the numbering of the present locations, records of other
+        # locations can be copied as they are then
+        locations = list(index._locations)
+        stamps = index.locations
+        if location not in stamps:
+            locations.append(location)
+        stamps[location] = stamp
+        loc = locations.index(location)
+
+        def merged():
+            last = None
+            for r in heapq.merge(
+                    (r for r in index._iter_records() if r[1] != loc),
+                    ((digest, loc, offset, size)
+                     for digest, offset, size in new)):
+                if r != last:
+                    yield r
+                last = r
+
+        _write_sorted(tmp_path, merged, locations, stamps)
+
+
+def _write(path, entries, stamps):
+    stamps = dict(stamps or {})
+    locations = []
+    numbers = {}
+    records = set()
+    for digest, location, offset, size in entries:
+        if location not in numbers:
+            numbers[location] = len(locations)
+            locations.append(location)
+        records.add((digest, numbers[location], offset or 0, size or 0))
+    # locations that hold no keys (anymore) are still known to be indexed
+    for location in stamps:
+        if location not in numbers:
+            numbers[location] = len(locations)
+            locations.append(location)
+
+    records = sorted(records)
+    with _replacing(path) as tmp_path:
+        _write_sorted(tmp_path, lambda: iter(records), locations, stamps)
+
+
+@contextmanager
+def _replacing(path):
+    """Yield a temporary path next to `path`, moved into place on success"""
+    tmp_path = path.with_name(path.name + '.tmp{}'.format(os.getpid()))
+    try:
+        yield tmp_path
+        os.replace(str(tmp_path), str(path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _write_sorted(path, records, locations, stamps):
+    """Write an index file from sorted, unique records
+
+    Parameters
+    ----------
+    path : Path
+    records : callable
+      Returns an iterator over (digest, location number, offset, size)
+      tuples, in order. It is called once for every section of the file,
+      so that the records never need to be held in memory.
+    locations : list
+      Location names, by their number.
+    stamps : dict
+    """
+    count = 0
+    fanout = [0] * 256
+    for r in records():
+        count += 1
+        fanout[r[0][0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    with open(str(path), 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, count, len(locations)))
+        f.write(_FANOUT.pack(*fanout))
+        for r in records():
+            f.write(r[0])
+        for digest, location, offset, size in records():
+            f.write(_RECORD.pack(location, 0, offset, size))
+        for name in locations:
+            encoded = name.encode('utf-8')
+            f.write(_LOCATION.pack(stamps.get(name, 0), len(encoded)))
+            f.write(encoded)
+
+
+class KeyIndex(object):
+    """Read access to an index file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(str(path), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size + _FANOUT.size:
+                raise ValueError("Invalid key index: {}".format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, nlocations = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError("Invalid key index: {}".format(path))
+        self._fanout = _FANOUT.unpack_from(self._map, _HEADER.size)
+        self._digests_start = _HEADER.size + _FANOUT.size
+        self._records_start = \
+            self._digests_start + self._count * _DIGEST_SIZE
+        # the location table is tiny, read it right away
+        self._locations = []
+        self._stamps = {}
+        pos = self._records_start + self._count * _RECORD.size
+        for i in range(nlocations):
+            stamp, length = _LOCATION.unpack_from(self._map, pos)
+            pos += _LOCATION.size
+            name = self._map[pos:pos + length].decode('utf-8')
+            pos += length
+            self._locations.append(name)
+            self._stamps[name] = stamp
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._find(key_digest(key)) is not None
+
+    @property
+    def locations(self):
+        """Mapping of indexed location names to their stamps"""
+        return dict(self._stamps)
+
+    def _digest(self, i):
+        start = self._digests_start + i * _DIGEST_SIZE
+        return self._map[start:start + _DIGEST_SIZE]
+
+    def _entry(self, i):
+        location, _, offset, size = _RECORD.unpack_from(
+            self._map, self._records_start + i * _RECORD.size)
+        return KeyIndexEntry(self._locations[location], offset, size)
+
+    def _find(self, digest):
+        """Returns the position of the first record for a digest, or None"""
+        first = digest[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._digest(mid) < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._fanout[first] and self._digest(lo) == digest:
+            return lo
+        return None
+
+    def lookup(self, key):
+        """Returns a list of KeyIndexEntry for a key
+
+        The list is empty, if the key isn't indexed.
+        """
+        digest = key_digest(key)
+        i = self._find(digest)
+        if i is None:
+            return []
+        entries = []
+        while i < self._count and self._digest(i) == digest:
+            entries.append(self._entry(i))
+            i += 1
+        return entries
+
+    def _iter_records(self):
+        """Yield (digest, location number, offset, size) of all records"""
+        for i in range(self._count):
+            location, _, offset, size = _RECORD.unpack_from(
+                self._map, self._records_start + i * _RECORD.size)
+            yield self._digest(i), location, offset, size
+
+    def iter_entries(self):
+        """Yield (digest, KeyIndexEntry) of all records"""
+        for digest, location, offset, size in self._iter_records():
+            yield digest, KeyIndexEntry(
+                self._locations[location], offset, size)
@@ -0,0 +1,366 @@
+"""Machine-local cache of annex objects retrieved from RIA stores
+
+Clones on the same machine that retrieve the same keys from a store can
+share a cache directory. Keys are looked up in the cache before they are
+retrieved from a store, and added to it after they were retrieved. Only
+keys of hashing backends are cached, as only they identify their content.
+
+Cached objects are delivered as hardlinks where possible, as reflinks on
+file systems that support them, and copied otherwise. Cached objects are
+write-protected, as are objects in an annex, but a clone with unlocked files
+in `annex.thin` mode could still modify shared content. Hence, only keys
+whose checksum can be verified locally are cached, content is verified
+before it is added, and delivered copies are verified as well. An object
+that doesn't match its key is removed from the cache. Objects are added
+under a temporary name and moved into place, such that concurrent readers
+never see partial content. The cache is bounded by the total size of the
+objects it holds. Whenever an addition exceeds the bound, objects are
+evicted by the time they were last used, which is recorded as their
+modification time.
+
+Processes that retrieve the same key at the same time coordinate via a lock
+file next to the key's location in the cache: the process that creates the
+lock file retrieves the key, the others wait for it to appear in the cache.
+The holder of a lock refreshes the lock file's modification time while it
+retrieves the key. A lock is considered stale once it wasn't refreshed for
+a while, or if its holder on this machine is gone, and is removed by the
+next process that finds it.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from pathlib import Path
+
+from ria_remote.utils import (
+    get_key_hasher,
+    verify_key_content,
+)
+
+lgr = logging.getLogger('ria_remote.objectcache')
+
+# default bound of the total size of cached objects, in bytes
+OBJECT_CACHE_SIZE = 10 << 30
+
+# fraction of the bound a cache is reduced to by an eviction, such that
+# evictions don't happen with every addition
+EVICTION_TARGET = 0.9
+
+# prefix of the names of objects that are being added
+_TMP_PREFIX = '.tmp-'
+
+# prefix of the names of lock files of keys that are being retrieved
+_LOCK_PREFIX = '.lock-'
+
+# seconds after which a lock file that wasn't refreshed is stale
+LOCK_STALE_TIME = 120
+
+# seconds to wait for another process to retrieve a key, before retrieving
+# it independently
+LOCK_TIMEOUT = 1800
+
+# seconds between checks whether another process retrieved a key
+LOCK_POLL_INTERVAL = 0.5
+
+# ioctl request to clone a file's extents (Linux)
+_FICLONE = 0x40049409
+
+
+def is_cacheable(key):
+    """Whether a key's content can be cached, as it can be verified"""
+    return get_key_hasher(key) is not None
+
+
+def deliver(src, dst):
+    """Make `dst` a file with the content of `src`
+
+    `dst` is a hardlink to `src`, if possible, a reflink if the file system
+    supports it, or a copy. An existing `dst` is replaced.
+    """
+    src, dst = str(src), str(dst)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+class _Lock(object):
+    """A lock file, refreshed by a thread for as long as it is held"""
+
+    def __init__(self, path):
+        self.path = path
+        self._released = threading.Event()
+        self._thread = threading.Thread(target=self._refresh, daemon=True)
+        self._thread.start()
+
+    def _refresh(self):
+        while not self._released.wait(LOCK_STALE_TIME / 4):
+            try:
+                os.utime(str(self.path))
+            except OSError as e:
+                lgr.debug("Failed to refresh %s: %s", self.path, e)
+
+    def release(self):
+        self._released.set()
+        self._thread.join()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            # removed as stale by someone else
+            pass
+
+
+def _is_stale(lock_path):
+    """Whether the holder of a lock file is gone"""
+    try:
+        age = time.time() - lock_path.stat().st_mtime
+        host, pid = lock_path.read_text().split()
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        # just created, not written yet
+        return age > LOCK_STALE_TIME
+    if age > LOCK_STALE_TIME:
+        return True
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+class ObjectCache(object):
+    """A directory of annex objects, shared by all users of the directory"""
+
+    def __init__(self, path, max_size=OBJECT_CACHE_SIZE):
+        """
+        Parameters
+        ----------
+        path : Path
+          Directory of the cache, created as needed.
+        max_size : int
+          Bound of the total size of cached objects, in bytes.
+        """
+        self.path = Path(path)
+        self.max_size = max_size
+        # total size of the cache, as far as we know, None until the cache
+        # was scanned
+        self._size = None
+
+    def key_path(self, key):
+        """Returns the location of a key in the cache"""
+        return self.path / hashlib.md5(key.encode()).hexdigest()[:3] / key
+
+    def get(self, key, dst):
+        """Deliver a cached key to `dst`
+
+        Returns
+        -------
+        bool
+          False, if the key isn't in the cache, or the cached content doesn't
+          match the key. Such content is removed from the cache.
+        """
+        if not is_cacheable(key):
+            return False
+        keypath = self.key_path(key)
+        try:
+            try:
+                # mark it recently used
+                os.utime(str(keypath))
+            except PermissionError:
+                # added by another user, it ages nevertheless
+                pass
+            deliver(keypath, dst)
+        except FileNotFoundError:
+            # not there (anymore)
+            return False
+        if not verify_key_content(key, dst):
+            lgr.warning("Removing %s from object cache, its content doesn't "
+                        "match the key", key)
+            # it may be a hardlink to the cached object, or a copy
+            os.unlink(str(dst))
+            try:
+                keypath.unlink()
+            except FileNotFoundError:
+                pass
+            return False
+        return True
+
+    def fetch(self, key, dst, retrieve):
+        """Deliver a key from the cache, or retrieve it and add it
+
+        Of all processes that fetch the same key at the same time, only one
+        retrieves it, unless the others run out of patience
+        (`LOCK_TIMEOUT`). Failures of the cache itself don't fail a fetch,
+        the key is retrieved then.
+
+        Parameters
+        ----------
+        key : str
+        dst : Path
+        retrieve : callable
+          Called with `dst`, must obtain the key's content there.
+        """
+        if not is_cacheable(key):
+            retrieve(dst)
+            return
+        deadline = time.time() + LOCK_TIMEOUT
+        while True:
+            if self._get(key, dst):
+                return
+            try:
+                lock = self._lock(key)
+            except OSError as e:
+                lgr.debug("Failed to lock %s in object cache: %s", key, e)
+                lock = None
+                deadline = 0
+            if lock is None and time.time() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                continue
+            try:
+                # it may have arrived in between
+                if lock is not None and self._get(key, dst):
+                    return
+                retrieve(dst)
+                try:
+                    self.put(key, dst)
+                except Exception as e:
+                    lgr.debug("Failed to add %s to object cache: %s", key, e)
+            finally:
+                if lock is not None:
+                    lock.release()
+            return
+
+    def _get(self, key, dst):
+        """Like `get()`, but failures of the cache mean a cache miss"""
+        try:
+            return self.get(key, dst)
+        except Exception as e:
+            lgr.debug("Failed to get %s from object cache: %s", key, e)
+            return False
+
+    def _lock(self, key):
+        """Lock a key for retrieval
+
+        Returns
+        -------
+        _Lock or None
+          None, if another process holds the lock.
+        """
+        keypath = self.key_path(key)
+        lock_path = keypath.parent / (_LOCK_PREFIX + key)
+        keypath.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(str(lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _is_stale(lock_path):
+                lgr.debug("Removing stale lock %s", lock_path)
+                try:
+                    lock_path.unlink()
+                except FileNotFoundError:
+                    pass
+            return None
+        with os.fdopen(fd, 'w') as f:
+            f.write('{} {}\n'.format(socket.gethostname(), os.getpid()))
+        return _Lock(lock_path)
+
+    def put(self, key, src):
+        """Add a key to the cache, unless it is there already
+
+        Content that doesn't match the key isn't added.
+        """
+        if not is_cacheable(key):
+            return
+        keypath = self.key_path(key)
+        if keypath.exists():
+            return
+        if not verify_key_content(key, src):
+            lgr.warning("Not adding %s to object cache, its content doesn't "
+                        "match the key", key)
+            return
+        keypath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = keypath.parent / '{}{}-{}'.format(
+            _TMP_PREFIX, os.getpid(), key)
+        try:
+            deliver(src, tmp_path)
+            # cached content is shared via hardlinks, guard it against
+            # modification in place
+            mode = tmp_path.stat().st_mode
+            os.chmod(str(tmp_path), mode & ~0o222)
+            # a key is never modified in place, the current time marks it
+            # as used just now
+            os.utime(str(tmp_path))
+            os.replace(str(tmp_path), str(keypath))
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._scan())
+        else:
+            self._size += keypath.stat().st_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def _scan(self):
+        """Yields (last use, size, path) of all cached objects"""
+        if not self.path.is_dir():
+            return
+        for hashdir in os.scandir(str(self.path)):
+            if not hashdir.is_dir():
+                continue
+            for entry in os.scandir(hashdir.path):
+                if entry.name.startswith((_TMP_PREFIX, _LOCK_PREFIX)):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # evicted by someone else
+                    continue
+                yield st.st_mtime, st.st_size, entry.path
+
+    def evict(self, target=None):
+        """Remove least recently used objects until the cache is small enough
+
+        Parameters
+        ----------
+        target : int, optional
+          Size to reduce the cache to, in bytes. By default, a fraction of
+          its bound (`EVICTION_TARGET`).
+        """
+        if target is None:
+            target = int(self.max_size * EVICTION_TARGET)
+        objects = sorted(self._scan())
+        size = sum(size for _, size, _ in objects)
+        start = time.time()
+        evicted = 0
+        for _, objsize, path in objects:
+            if size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= objsize
+            evicted += 1
+        lgr.debug("Evicted %i objects from %s in %.2f s",
+                  evicted, self.path, time.time() - start)
+        self._size = size
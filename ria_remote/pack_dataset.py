@@ -0,0 +1,269 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the datalad package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Pack the loose keys of a dataset in a RIA store into an archive, in place"""
+
+__docformat__ = 'restructuredtext'
+
+
+import logging
+import os.path as op
+import tempfile
+
+from datalad import cfg
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import (
+    get_status_dict,
+)
+from datalad.interface.utils import eval_results
+from datalad.support.param import Parameter
+from datalad.support.constraints import (
+    EnsureStr,
+)
+from datalad.utils import Path
+from datalad.dochelpers import (
+    exc_str,
+)
+from ria_remote.bloom import (
+    BLOOM_FILTER_FILENAME,
+    BLOOM_JOURNAL_FILENAME,
+)
+from ria_remote.keyindex import (
+    KEY_INDEX_FILENAME,
+    update_key_index,
+)
+from ria_remote.remote import (
+    LocalIO,
+    SSHRemoteIO,
+)
+from ria_remote.segments import SEGMENT_INDEX_FILENAME
+from ria_remote.sevenzip import SevenZipIndex
+from ria_remote.store_index import STORE_INDEX_FILENAME
+from ria_remote.utils import (
+    SHARD_CONFIG_FILENAME,
+    get_layout_locations,
+    verify_ria_url,
+)
+
+lgr = logging.getLogger('ria_remote.pack_dataset')
+
+
+@build_doc
+class PackDataset(Interface):
+    """Pack the loose keys of datasets in a RIA store into archives, in place.
+
+    Unlike `ria-export-archive`, which writes an archive from the annex of a
+    local clone, this command creates a dataset's archive
+    (``archives/archive.7z``) from the keys in the dataset's annex object
+    tree on the store itself, by running 7z on the store host. Content never
+    leaves the store.
+
+    The archive is written under a temporary name, and verified against the
+    index of its members: every packed key must be a member of the same
+    size. Only then it is moved into place, the store-wide key index (if the
+    store has one), the dataset's key index and Bloom filter are updated, and
+    the loose keys are removed from the object tree.
+
+    Datasets that have an archive already are left alone.
+    """
+    _params_ = dict(
+        store=Parameter(
+            args=("store",),
+            metavar="STORE",
+            doc="""the RIA store, either as a 'ria+ssh://' or 'ria+file://'
+            URL, or as a local path""",
+            constraints=EnsureStr()),
+        dsid=Parameter(
+            args=("dsid",),
+            metavar="DSID",
+            nargs="+",
+            doc="""ID of a dataset to pack""",
+            constraints=EnsureStr()),
+        keep_loose=Parameter(
+            args=("--keep-loose",),
+            action="store_true",
+            doc="""do not remove the loose keys after packing"""),
+    )
+
+    @staticmethod
+    @eval_results
+    def __call__(store, dsid, keep_loose=False):
+        res_kwargs = dict(
+            action="ria-pack-dataset",
+            logger=lgr,
+        )
+        if store.startswith('ria+'):
+            try:
+                host, base_path = verify_ria_url(store, cfg)
+            except ValueError as e:
+                yield get_status_dict(
+                    path=store,
+                    status='error',
+                    message=('invalid store URL: %s', exc_str(e)),
+                    **res_kwargs)
+                return
+        else:
+            host, base_path = None, store
+        base_path = Path(base_path) if host else Path(base_path).absolute()
+
+        io = SSHRemoteIO(host) if host else LocalIO()
+        store_index = None
+        try:
+            if not io.exists(base_path / 'ria-layout-version'):
+                yield get_status_dict(
+                    path=str(base_path),
+                    status='error',
+                    message='not a RIA store: no ria-layout-version file',
+                    **res_kwargs)
+                return
+            if io.exists(base_path / STORE_INDEX_FILENAME):
+                store_index = io.open_store_index(
+                    base_path / STORE_INDEX_FILENAME)
+                store_index.create_tables()
+            try:
+                for id_ in ([dsid] if isinstance(dsid, str) else dsid):
+                    yield _pack_dataset(
+                        io, base_path, id_, store_index, keep_loose,
+                        res_kwargs)
+            finally:
+                if store_index is not None:
+                    store_index.close()
+        finally:
+            if host:
+                io.close()
+
+
+def _pack_dataset(io, base_path, dsid, store_index, keep_loose, res_kwargs):
+    """Pack a single dataset
+
+    Returns
+    -------
+    dict
+      Result record.
+    """
+    dsdir, archive_dir, obj_dir = get_layout_locations(1, base_path, dsid)
+    archive = archive_dir / 'archive.7z'
+    res_kwargs = dict(res_kwargs, path=str(archive))
+    if not io.exists(dsdir / 'ria-layout-version'):
+        return get_status_dict(
+            status='error',
+            message=('no dataset %s in the store', dsid),
+            **res_kwargs)
+    for name in ('archive.7z', 'archive.zip', 'archive.tar',
+                 SEGMENT_INDEX_FILENAME, SHARD_CONFIG_FILENAME):
+        if io.exists(archive_dir / name):
+            return get_status_dict(
+                status='impossible',
+                message=('dataset has archives already: %s',
+                         str(archive_dir / name)),
+                **res_kwargs)
+
+    keys = io.list_loose_keys(obj_dir)
+    if not keys:
+        return get_status_dict(
+            status='notneeded',
+            message='no loose keys',
+            **res_kwargs)
+
+    tmp_archive = archive_dir / '.archive.7z.tmp'
+    try:
+        io.mkdir(archive_dir)
+        if io.exists(tmp_archive):
+            # leftover of an interrupted run, 7z would update it
+            io.remove(tmp_archive)
+        io.archive_directory(obj_dir, tmp_archive)
+        index = SevenZipIndex(
+            lambda offset, length: io.read_range(tmp_archive, offset, length))
+        for relpath, size in keys:
+            member = index.members.get(relpath)
+            if member is None or member.size != size:
+                raise ValueError(
+                    '{} is missing from the archive, or differs'.format(
+                        relpath))
+        io.rename(tmp_archive, archive)
+        stamp = index.size
+    except Exception as e:
+        if io.exists(tmp_archive):
+            io.remove(tmp_archive)
+        return get_status_dict(
+            status='error',
+            message=('packing failed: %s', exc_str(e)),
+            **res_kwargs)
+
+    location = str(archive.relative_to(dsdir))
+    if store_index is not None:
+        store_index.replace(
+            dsid,
+            [(op.basename(relpath), location, relpath, size)
+             for relpath, size in keys],
+            location=location)
+    try:
+        _update_dataset_indices(io, dsdir, keys, location, stamp)
+    except Exception as e:
+        # RIA remotes would consider keys missing from the Bloom filter gone
+        # once they aren't loose anymore
+        return get_status_dict(
+            status='error',
+            message=('failed to update the indices of the dataset, kept '
+                     'the loose keys: %s', exc_str(e)),
+            **res_kwargs)
+    if not keep_loose:
+        if store_index is not None:
+            store_index.drop_keys(
+                dsid, [op.basename(relpath) for relpath, _ in keys])
+        io.prune_keys(obj_dir, [relpath for relpath, _ in keys])
+    return get_status_dict(
+        status='ok',
+        type='file',
+        message=('%i keys%s', len(keys),
+                 '' if keep_loose else ', removed loose keys'),
+        **res_kwargs)
+
+
+def _update_dataset_indices(io, dsdir, keys, location=None, stamp=0):
+    """Record keys moved out of a dataset's object tree in its indices
+
+    RIA remotes don't look beyond the object tree for keys that the
+    dataset's Bloom filter rules out, hence the keys are added to the
+    filter's journal, if the dataset has a filter. If a location is given,
+    the keys are recorded in the dataset's key index for it as well.
+
+    Parameters
+    ----------
+    io : IOBase
+    dsdir : Path
+    keys : list
+      (path, size) of the keys relative to the dataset's annex object tree.
+    location : str, optional
+      Archive holding the keys, relative to `dsdir`.
+    stamp : int, optional
+      Size of the archive.
+    """
+    if io.exists(dsdir / BLOOM_FILTER_FILENAME):
+        io.write_file(
+            dsdir / BLOOM_JOURNAL_FILENAME,
+            ''.join(op.basename(relpath) + '\n' for relpath, _ in keys),
+            mode='a')
+    if location is None:
+        return
+    index_path = dsdir / KEY_INDEX_FILENAME
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp_path = Path(tmpdir) / KEY_INDEX_FILENAME
+        if io.exists(index_path):
+            io.get(index_path, tmp_path)
+        update_key_index(
+            tmp_path,
+            location,
+            [(op.basename(relpath), 0, size) for relpath, size in keys],
+            stamp=stamp)
+        tmp_index = index_path.with_name(index_path.name + '.tmp')
+        io.put(tmp_path, tmp_index)
+        io.rename(tmp_index, index_path)
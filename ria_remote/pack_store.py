@@ -0,0 +1,255 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the datalad package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Pack the keys of small datasets into archives shared across a RIA store"""
+
+__docformat__ = 'restructuredtext'
+
+
+import logging
+import os
+import os.path as op
+import re
+import tarfile
+
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import (
+    get_status_dict,
+)
+from datalad.interface.utils import eval_results
+from datalad.support.param import Parameter
+from datalad.support.constraints import (
+    EnsureInt,
+    EnsureStr,
+)
+from datalad.utils import Path
+from datalad.dochelpers import (
+    exc_str,
+)
+from ria_remote.pack_dataset import _update_dataset_indices
+from ria_remote.rebuild_index import _find_datasets
+from ria_remote.remote import LocalIO
+from ria_remote.store_index import (
+    STORE_INDEX_FILENAME,
+    StoreIndex,
+)
+from ria_remote.tarindex import (
+    iter_tar_entries,
+    write_tar_index,
+)
+from ria_remote.utils import (
+    PACKS_DIRNAME,
+    get_layout_locations,
+    iter_loose_keys,
+)
+
+lgr = logging.getLogger('ria_remote.pack_store')
+
+_PACK_NAME = re.compile(r'^pack-(\d{4,})\.tar$')
+
+
+@build_doc
+class PackStore(Interface):
+    """Pack the keys of small datasets into archives shared across a store.
+
+    Every dataset in a RIA store with a handful of keys takes a number of
+    directories and inodes, and an own archive per dataset would add a
+    further file with its own header. This command moves the loose keys of
+    all datasets with at most MAX_KEYS keys in their annex object tree into
+    uncompressed tar archives at the base path of the store
+    (``ria-packs/pack-0001.tar``, ...) that are shared by many datasets.
+    Members are named ``<dataset ID>/<annex object path>``, and each pack
+    comes with a sidecar index of member positions, such that keys can be
+    read from a pack by byte range.
+
+    The store-wide key index (see `ria-rebuild-index`) records which pack
+    holds a key of a dataset, and is required. RIA remotes consult it for
+    keys that a dataset neither has in its object tree nor in its own
+    archives. Loose keys are removed from the datasets only after a pack is
+    complete, indexed, and its content verified, and after they were added to
+    the Bloom filter of their dataset (if it has one).
+
+    RIA remotes refuse to remove keys that are in a pack.
+    """
+    _params_ = dict(
+        path=Parameter(
+            args=("path",),
+            metavar="PATH",
+            doc="""base path of the RIA store""",
+            constraints=EnsureStr()),
+        max_keys=Parameter(
+            args=("--max-keys",),
+            metavar="NKEYS",
+            doc="""datasets with at most this number of loose keys are
+            packed""",
+            constraints=EnsureInt()),
+        pack_size=Parameter(
+            args=("--pack-size",),
+            metavar="BYTES",
+            doc="""size of the keys put into a single pack, after which the
+            next pack is started. The keys of a dataset are never split
+            across packs, hence packs can be larger.""",
+            constraints=EnsureInt()),
+    )
+
+    @staticmethod
+    @eval_results
+    def __call__(path, max_keys=100, pack_size=1024 ** 3):
+        base_path = Path(path).absolute()
+        res_kwargs = dict(
+            action="ria-pack-store",
+            logger=lgr,
+        )
+        if not (base_path / 'ria-layout-version').exists():
+            yield get_status_dict(
+                path=str(base_path),
+                status='error',
+                message='not a RIA store: no ria-layout-version file',
+                **res_kwargs)
+            return
+        if not (base_path / STORE_INDEX_FILENAME).exists():
+            yield get_status_dict(
+                path=str(base_path),
+                status='impossible',
+                message='store has no key index, run ria-rebuild-index '
+                        'first',
+                **res_kwargs)
+            return
+
+        pack_dir = base_path / PACKS_DIRNAME
+        pack_dir.mkdir(exist_ok=True)
+        index = StoreIndex(base_path / STORE_INDEX_FILENAME)
+        index.create_tables()
+        try:
+            for batch in _plan_packs(base_path, max_keys, pack_size):
+                pack = _next_pack(pack_dir)
+                try:
+                    _write_pack(base_path, pack, batch)
+                except Exception as e:
+                    yield get_status_dict(
+                        path=str(pack),
+                        status='error',
+                        message=('failed to write pack: %s', exc_str(e)),
+                        **res_kwargs)
+                    return
+                location = '{}/{}'.format(PACKS_DIRNAME, pack.name)
+                for dsid, keys in batch:
+                    dsdir, _, obj_dir = get_layout_locations(
+                        1, base_path, dsid)
+                    try:
+                        # RIA remotes don't look beyond the object tree for
+                        # keys the Bloom filter rules out
+                        _update_dataset_indices(LocalIO(), dsdir, keys)
+                    except Exception as e:
+                        yield get_status_dict(
+                            path=str(dsdir),
+                            status='error',
+                            message=('failed to update the Bloom filter, '
+                                     'kept the loose keys: %s', exc_str(e)),
+                            **res_kwargs)
+                        continue
+                    index.replace(
+                        dsid,
+                        [(op.basename(relpath), location,
+                          '{}/{}'.format(dsid, relpath), size)
+                         for relpath, size in keys],
+                        location=location)
+                    # only drop the keys that were packed, others may have
+                    # been stored meanwhile
+                    index.drop_keys(
+                        dsid, [op.basename(relpath) for relpath, _ in keys])
+                    LocalIO().prune_keys(
+                        obj_dir, [relpath for relpath, _ in keys])
+                yield get_status_dict(
+                    path=str(pack),
+                    type='file',
+                    status='ok',
+                    message=('%i keys of %i datasets',
+                             sum(len(keys) for _, keys in batch),
+                             len(batch)),
+                    **res_kwargs)
+        finally:
+            index.close()
+
+
+def _plan_packs(base_path, max_keys, pack_size):
+    """Yield the datasets to put into one pack at a time
+
+    Yields
+    ------
+    list
+      (dsid, keys) of the datasets of a pack, with (path, size) of the
+      dataset's loose keys relative to its annex object tree.
+    """
+    batch = []
+    batch_size = 0
+    for dsid in _find_datasets(base_path):
+        obj_dir = get_layout_locations(1, base_path, dsid)[2]
+        keys = []
+        for key in iter_loose_keys(obj_dir):
+            keys.append(key)
+            if len(keys) > max_keys:
+                break
+        if not keys or len(keys) > max_keys:
+            continue
+        batch.append((dsid, sorted(keys)))
+        batch_size += sum(size for _, size in keys)
+        if batch_size >= pack_size:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def _next_pack(pack_dir):
+    """Returns the path of the pack to write next"""
+    numbers = [
+        int(m.group(1)) for m in
+        (_PACK_NAME.match(p.name) for p in pack_dir.iterdir()) if m]
+    return pack_dir / 'pack-{:04d}.tar'.format(max(numbers, default=0) + 1)
+
+
+def _write_pack(base_path, pack, batch):
+    """Write the keys of a batch of datasets into a new, indexed pack
+
+    The pack is written under a temporary name and only appears under its
+    final name once it is complete. The size of each member is verified
+    against the key it was created from.
+    """
+    tmp_pack = pack.with_name('.' + pack.name + '.tmp')
+    try:
+        with tarfile.open(
+                str(tmp_pack),
+                mode='w',
+                format=tarfile.PAX_FORMAT,
+                # keys shared via the content pool are hardlinks, but must
+                # be regular members to be read by byte range
+                dereference=True) as tf:
+            for dsid, keys in batch:
+                obj_dir = get_layout_locations(1, base_path, dsid)[2]
+                for relpath, size in keys:
+                    tf.add(str(obj_dir / relpath),
+                           arcname='{}/{}'.format(dsid, relpath),
+                           recursive=False)
+        expected = dict(
+            ('{}/{}'.format(dsid, relpath), size)
+            for dsid, keys in batch for relpath, size in keys)
+        packed = dict(
+            (name, size) for name, _, size in iter_tar_entries(tmp_pack))
+        if packed != expected:
+            raise RuntimeError(
+                'content of {} differs from the packed keys'.format(tmp_pack))
+        os.replace(str(tmp_pack), str(pack))
+    finally:
+        if tmp_pack.exists():
+            tmp_pack.unlink()
+    write_tar_index(pack)
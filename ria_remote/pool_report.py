@@ -0,0 +1,110 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the datalad package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Report on the shared content pool of a RIA store"""
+
+__docformat__ = 'restructuredtext'
+
+
+import logging
+
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import (
+    get_status_dict,
+)
+from datalad.interface.utils import eval_results
+from datalad.support.param import Parameter
+from datalad.support.constraints import (
+    EnsureStr,
+)
+from datalad.utils import Path
+from ria_remote.utils import (
+    CONTENT_POOL_DIRNAME,
+    iter_loose_keys,
+)
+
+lgr = logging.getLogger('ria_remote.pool_report')
+
+
+@build_doc
+class PoolReport(Interface):
+    """Report on the content pool of a RIA store.
+
+    A RIA store can have a content pool, a directory ``ria-content-pool`` at
+    its base path. It is created by the store's administrator. Once it
+    exists, RIA remotes hardlink every key they store into the pool. When a
+    key that is already in the pool is stored for another dataset, it is
+    hardlinked from the pool into the dataset's annex object tree, without
+    transferring any content. Only keys of hashing git-annex backends are
+    shared this way.
+
+    This command reports the number of bytes and inodes that are saved by
+    the pool, and the size of the keys that are only kept by the pool and
+    no longer by any dataset. These orphaned keys can be removed.
+    """
+    _params_ = dict(
+        path=Parameter(
+            args=("path",),
+            metavar="PATH",
+            doc="""base path of the RIA store""",
+            constraints=EnsureStr()),
+        prune=Parameter(
+            args=("--prune",),
+            doc="""remove orphaned keys from the pool""",
+            action="store_true"),
+    )
+
+    @staticmethod
+    @eval_results
+    def __call__(path, prune=False):
+        pool_dir = Path(path).absolute() / CONTENT_POOL_DIRNAME
+        res_kwargs = dict(
+            action="ria-pool-report",
+            path=str(pool_dir),
+            logger=lgr,
+        )
+        if not pool_dir.is_dir():
+            yield get_status_dict(
+                status='error',
+                message='store has no content pool',
+                **res_kwargs)
+            return
+
+        keys = saved_bytes = saved_inodes = 0
+        orphans = orphaned_bytes = 0
+        for relpath, size in iter_loose_keys(pool_dir):
+            keys += 1
+            keypath = pool_dir / relpath
+            nlink = keypath.stat().st_nlink
+            if nlink > 1:
+                # without the pool, each of the (nlink - 1) datasets would
+                # have an own copy
+                saved_bytes += (nlink - 2) * size
+                saved_inodes += nlink - 2
+                continue
+            orphans += 1
+            orphaned_bytes += size
+            if prune:
+                keypath.unlink()
+
+        yield get_status_dict(
+            status='ok',
+            message=(
+                "%i keys, saving %i bytes and %i inodes; "
+                "%i keys (%i bytes) only in the pool%s",
+                keys, saved_bytes, saved_inodes, orphans, orphaned_bytes,
+                ", removed" if prune else ""),
+            keys=keys,
+            saved_bytes=saved_bytes,
+            saved_inodes=saved_inodes,
+            orphaned_keys=orphans,
+            orphaned_bytes=orphaned_bytes,
+            **res_kwargs)
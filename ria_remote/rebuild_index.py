@@ -0,0 +1,307 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the datalad package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""(Re)build the key indices of a RIA store"""
+
+__docformat__ = 'restructuredtext'
+
+
+import logging
+import os.path as op
+from collections import defaultdict
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
+
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import (
+    get_status_dict,
+)
+from datalad.interface.utils import eval_results
+from datalad.support.param import Parameter
+from datalad.support.constraints import (
+    EnsureInt,
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.utils import Path
+from datalad.log import log_progress
+from datalad.dochelpers import (
+    exc_str,
+)
+from ria_remote.bloom import (
+    BLOOM_FILTER_FILENAME,
+    BLOOM_JOURNAL_FILENAME,
+    build_bloom_filter,
+    write_bloom_filter,
+)
+from ria_remote.keyindex import (
+    KEY_INDEX_FILENAME,
+    write_key_index,
+)
+from ria_remote.segments import (
+    SEGMENT_INDEX_FILENAME,
+    segment_number,
+)
+from ria_remote.tarindex import (
+    iter_tar_entries,
+    write_tar_index,
+)
+from ria_remote.store_index import (
+    LOOSE,
+    STORE_INDEX_FILENAME,
+    StoreIndex,
+)
+from ria_remote.utils import (
+    get_layout_locations,
+    ARCHIVE_SUFFIXES,
+    PACKS_DIRNAME,
+    iter_archive_members,
+    iter_loose_keys,
+)
+
+lgr = logging.getLogger('ria_remote.rebuild_index')
+
+
+@build_doc
+class RebuildStoreIndex(Interface):
+    """(Re)build the key indices of a RIA store.
+
+    A RIA store can carry an SQLite database at its base path
+    (``ria-store-index.sqlite``) that records which dataset holds which key,
+    and whether a key is a loose file in a dataset's annex object tree or a
+    member of one of its archives. Once the index exists, RIA remotes keep it
+    up-to-date whenever they store or remove keys, and `ria-export-archive`
+    records the content of any archive it exports into the store. RIA remotes
+    consult the index to locate keys without having to query archives.
+
+    In addition, each dataset in a store can carry a compact key index
+    (``ria-key-index`` in the dataset's directory) that lists the keys in its
+    archives, but not the ones in its annex object tree (RIA remotes store
+    and remove those without updating the index). RIA remotes with local
+    access to the store use it to find keys in archives in O(log n), without
+    loading it into memory. `ria-export-archive` updates it when exporting an
+    archive into the store.
+
+    Tar archives get their sidecar index of member positions
+    (``archive.tar.index``) rewritten, and datasets with archive segments
+    their merged segment index (``archives/segments.index``). Keys in the
+    packs of a store (see `ria-pack-store`) are recorded for the datasets
+    they belong to.
+
+    Lastly, a Bloom filter (``ria-bloom-filter`` in the dataset's directory)
+    lets RIA remotes answer presence queries for keys that a dataset
+    definitely doesn't hold, without looking for them. Keys stored afterwards
+    are appended to a journal file by RIA remotes.
+
+    This command creates these indices, or regenerates them from the actual
+    content of the store. It must be executed on a machine with local access
+    to the store. Datasets are scanned in parallel, which can speed up the
+    process substantially on parallel filesystems.
+    """
+    _params_ = dict(
+        path=Parameter(
+            args=("path",),
+            metavar="PATH",
+            doc="""base path of the RIA store""",
+            constraints=EnsureStr()),
+        jobs=Parameter(
+            args=("-J", "--jobs"),
+            metavar="NJOBS",
+            doc="""number of datasets to scan in parallel""",
+            constraints=EnsureInt() | EnsureNone()),
+    )
+
+    @staticmethod
+    @eval_results
+    def __call__(path, jobs=None):
+        base_path = Path(path).absolute()
+        res_kwargs = dict(
+            action="rebuild-ria-index",
+            logger=lgr,
+        )
+        if not (base_path / 'ria-layout-version').exists():
+            yield get_status_dict(
+                path=str(base_path),
+                status='error',
+                message='not a RIA store: no ria-layout-version file',
+                **res_kwargs)
+            return
+
+        dsids = list(_find_datasets(base_path))
+        pack_records = _scan_packs(base_path)
+        index = StoreIndex(base_path / STORE_INDEX_FILENAME)
+        index.create_tables()
+
+        log_progress(
+            lgr.info,
+            'riarebuildindex',
+            'Start rebuilding RIA store index %s', base_path,
+            total=len(dsids),
+            label='RIA index rebuild',
+            unit=' Datasets',
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=jobs or 1) as executor:
+                scans = {
+                    executor.submit(
+                        _scan_dataset, base_path, dsid,
+                        pack_records.get(dsid, [])): dsid
+                    for dsid in dsids
+                }
+                for scan in as_completed(scans):
+                    dsid = scans[scan]
+                    dsdir = get_layout_locations(1, base_path, dsid)[0]
+                    log_progress(
+                        lgr.info,
+                        'riarebuildindex',
+                        'Indexed dataset %s', dsid,
+                        update=1,
+                        increment=True)
+                    try:
+                        records = scan.result()
+                    except Exception as e:
+                        yield get_status_dict(
+                            path=str(dsdir),
+                            status='error',
+                            message=('failed to scan dataset: %s',
+                                     exc_str(e)),
+                            **res_kwargs)
+                        continue
+                    index.replace(dsid, records)
+                    yield get_status_dict(
+                        path=str(dsdir),
+                        status='ok',
+                        message=('%i keys', len(records)),
+                        **res_kwargs)
+            # datasets that are gone from the store
+            for dsid in set(index.datasets()).difference(dsids):
+                index.forget(dsid)
+        finally:
+            index.close()
+            log_progress(
+                lgr.info,
+                'riarebuildindex',
+                'Finished rebuilding RIA store index %s', base_path,
+            )
+        yield get_status_dict(
+            path=str(base_path / STORE_INDEX_FILENAME),
+            type='file',
+            status='ok',
+            **res_kwargs)
+
+
+def _find_datasets(base_path):
+    """Yield the IDs of all datasets in a store"""
+    for first in sorted(base_path.iterdir()):
+        if len(first.name) != 3 or not first.is_dir():
+            continue
+        for second in sorted(first.iterdir()):
+            if (second / 'ria-layout-version').exists():
+                yield first.name + second.name
+
+
+def _scan_packs(base_path):
+    """Index the packs of a store
+
+    Returns
+    -------
+    dict
+      Mapping of dataset IDs to (key, location, member, size) of their keys
+      in packs.
+    """
+    records = defaultdict(list)
+    pack_dir = base_path / PACKS_DIRNAME
+    if not pack_dir.is_dir():
+        return records
+    for pack in sorted(pack_dir.glob('pack-*.tar')):
+        write_tar_index(pack)
+        location = '{}/{}'.format(PACKS_DIRNAME, pack.name)
+        # members are <dsid>/<annex object path>
+        for member, _, size in iter_tar_entries(pack):
+            records[member.split('/', 1)[0]].append(
+                (op.basename(member), location, member, size))
+    return records
+
+
+def _scan_dataset(base_path, dsid, pack_records=()):
+    """Write the key index and the Bloom filter of a dataset
+
+    Parameters
+    ----------
+    base_path : Path
+    dsid : str
+    pack_records : list, optional
+      Records of the dataset's keys in packs of the store. They are
+      considered for the Bloom filter, but not for the dataset's key index,
+      which only describes the dataset directory.
+
+    Returns
+    -------
+    list
+      (key, location, member, size) of all keys of the dataset
+    """
+    dsdir, archive_dir, obj_dir = get_layout_locations(1, base_path, dsid)
+    # move the Bloom filter journal aside before scanning: remotes add keys
+    # to the journal after they are in place, hence any key in it is either
+    # found by the scan or recorded in a new journal
+    journal = dsdir / BLOOM_JOURNAL_FILENAME
+    rotated_journal = journal.with_name(journal.name + '.rebuild')
+    if journal.exists():
+        journal.rename(rotated_journal)
+    records = [
+        (op.basename(keypath), LOOSE, None, size)
+        for keypath, size in iter_loose_keys(obj_dir)
+    ]
+    stamps = {}
+    segment_records = []
+    segment_stamps = {}
+    if archive_dir.is_dir():
+        for archive in sorted(archive_dir.iterdir()):
+            if archive.suffix not in ARCHIVE_SUFFIXES:
+                continue
+            location = 'archives/{}'.format(archive.name)
+            stamps[location] = archive.stat().st_size
+            if archive.suffix == '.tar':
+                write_tar_index(archive)
+            members = [
+                (op.basename(member), member, size)
+                for member, size in iter_archive_members(archive)
+            ]
+            records.extend(
+                (key, location, member, size)
+                for key, member, size in members
+            )
+            if segment_number(archive.name) is not None:
+                segment_stamps[archive.name] = stamps[location]
+                segment_records.extend(
+                    (key, archive.name, 0, size)
+                    for key, _, size in members
+                )
+    if segment_stamps:
+        write_key_index(
+            archive_dir / SEGMENT_INDEX_FILENAME,
+            segment_records,
+            stamps=segment_stamps)
+    # loose keys come and go without the key index being updated
+    write_key_index(
+        dsdir / KEY_INDEX_FILENAME,
+        [(key, location, 0, size) for key, location, _, size in records
+         if location != LOOSE],
+        stamps=stamps)
+    records.extend(pack_records)
+    write_bloom_filter(
+        dsdir / BLOOM_FILTER_FILENAME,
+        build_bloom_filter(set(r[0] for r in records)))
+    if rotated_journal.exists():
+        rotated_journal.unlink()
+    return records
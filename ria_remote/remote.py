@@ -4,13 +4,77 @@ from annexremote import RemoteError
 from pathlib import (
     Path,
 )
+import os
 import shutil
 from shlex import quote as sh_quote
 import subprocess
 import logging
+import mmap
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
 from functools import wraps
+from ria_remote.foldercache import (
+    FOLDER_CACHE_SIZE,
+    FolderCache,
+)
+from ria_remote.governor import (
+    Governor,
+    get_state_dir,
+)
+from ria_remote.objectcache import (
+    OBJECT_CACHE_SIZE,
+    ObjectCache,
+)
+from ria_remote.replicas import (
+    Replica,
+    order_replicas,
+    parse_replicas,
+)
+from ria_remote.storestats import (
+    StoreStats,
+    get_stats_path,
+)
+from ria_remote.sevenzip import (
+    SevenZipIndex,
+    UnsupportedCoderError,
+)
+from ria_remote.tarindex import (
+    TarIndex,
+    tar_index_path,
+    tar_stamp,
+)
+from ria_remote.bloom import (
+    BLOOM_FILTER_FILENAME,
+    BLOOM_JOURNAL_FILENAME,
+    BloomFilter,
+)
+from ria_remote.keyindex import (
+    KEY_INDEX_FILENAME,
+    KeyIndex,
+)
+from ria_remote.segments import SEGMENT_INDEX_FILENAME
+from ria_remote.store_index import (
+    LOOSE,
+    STORE_INDEX_FILENAME,
+    RemoteStoreIndex,
+    StoreIndex,
+)
 from ria_remote.utils import (
+    CLAIMS_DIRNAME,
+    CONTENT_POOL_DIRNAME,
+    SHARD_CONFIG_FILENAME,
+    STORE_ROOTS_FILENAME,
+    get_key_size,
     get_layout_locations,
+    get_shard_name,
+    is_pack_location,
+    is_poolable,
+    iter_loose_keys,
+    parse_shard_config,
+    parse_store_roots,
     verify_ria_url,
 )
 
@@ -44,6 +108,19 @@ def _get_gitcfg(gitdir, key, cfgargs=None, regex=False):
         return None
 
 
+def _get_url_cfgs(gitdir):
+    """Returns the URL rewrite settings of a repository"""
+    # support URL rewrite without talking to a DataLad ConfigManager
+    # Q is why? Why not use the config manager?
+    url_cfgs = dict()
+    url_cfgs_raw = _get_gitcfg(gitdir, "^url.*", regex=True)
+    if url_cfgs_raw:
+        for line in url_cfgs_raw.splitlines():
+            k, v = line.split()
+            url_cfgs[k] = v
+    return url_cfgs
+
+
 def _get_datalad_id(gitdir):
     """Attempt to determine a DataLad dataset ID for a given repo
 
@@ -75,8 +152,122 @@ class RIARemoteError(RemoteError):
         super().__init__(msg.replace('\n', '\\n'))
 
 
+class PathStateCache(object):
+    """Per-session record of what is known about paths in a store
+
+    Known-existing directories and files are kept for `present_ttl`
+    seconds, known-absent paths for `absent_ttl` seconds, since other
+    clients may remove or create them at any time. The IO class owning a
+    cache is expected to update it with the outcome of its own write
+    operations. Once more than `max_entries` paths are known to exist, or
+    to be absent, those records are forgotten, and built up anew.
+    """
+
+    def __init__(self, absent_ttl=2.0, present_ttl=2.0, max_entries=100000):
+        self.absent_ttl = absent_ttl
+        self.present_ttl = present_ttl
+        self.max_entries = max_entries
+        # expiry times by path
+        self._dirs = dict()
+        self._present = dict()
+        # known-existing paths by their parent, to forget about subtrees
+        self._children = dict()
+        self._absent = dict()
+
+    def _is_known(self, known, path):
+        expires = known.get(path)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            self.invalidate(path)
+            return False
+        return True
+
+    def is_dir(self, path):
+        return self._is_known(self._dirs, path)
+
+    def is_present(self, path):
+        return self._is_known(self._present, path) \
+            or self._is_known(self._dirs, path)
+
+    def is_absent(self, path):
+        expires = self._absent.get(path)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._absent[path]
+            return False
+        return True
+
+    def _discard_absent(self, path):
+        # anything that contains an existing path exists too
+        if not self._absent:
+            return
+        for p in [path] + list(path.parents):
+            self._absent.pop(p, None)
+
+    def _add(self, known, path):
+        """Record an existing path, returns False if it was known already"""
+        fresh = self._is_known(known, path)
+        if not fresh and \
+                len(self._dirs) + len(self._present) >= self.max_entries:
+            self._dirs.clear()
+            self._present.clear()
+            self._children.clear()
+        known[path] = time.monotonic() + self.present_ttl
+        if fresh:
+            return False
+        if path.parent != path:
+            self._children.setdefault(path.parent, set()).add(path)
+        return True
+
+    def _add_parents(self, path):
+        # the parents of a known directory are known already
+        for p in path.parents:
+            if not self._add(self._dirs, p):
+                break
+
+    def add_dir(self, path):
+        self._discard_absent(path)
+        if self._add(self._dirs, path):
+            self._add_parents(path)
+
+    def add_present(self, path):
+        self._discard_absent(path)
+        if self._add(self._present, path):
+            self._add_parents(path)
+
+    def add_absent(self, path):
+        self.invalidate(path)
+        if len(self._absent) >= self.max_entries:
+            self._absent.clear()
+        self._absent[path] = time.monotonic() + self.absent_ttl
+
+    def invalidate(self, path):
+        """Forget everything known about `path` and anything underneath"""
+        siblings = self._children.get(path.parent)
+        if siblings:
+            siblings.discard(path)
+        stack = [path]
+        while stack:
+            p = stack.pop()
+            self._dirs.pop(p, None)
+            self._present.pop(p, None)
+            # only directories have children
+            stack.extend(self._children.pop(p, ()))
+        self._absent.pop(path, None)
+
+
 class IOBase(object):
     """Abstract class with the desired API for local/remote operations"""
+    def __init__(self, folder_cache_size=FOLDER_CACHE_SIZE):
+        # member positions by archive path (parsed 7z headers, tar
+        # indices), None for archives we can't read natively
+        self._archive_indices = dict()
+        # unpacked data of compressed 7z folders, reused for further
+        # members of the same folder
+        self.folder_cache = FolderCache(folder_cache_size)
+
     def mkdir(self, path):
         raise NotImplementedError
 
@@ -89,12 +280,204 @@ class IOBase(object):
     def rename(self, src, dst):
         raise NotImplementedError
 
+    def link(self, src, dst):
+        """Create a hardlink `dst` to `src`"""
+        raise NotImplementedError
+
+    def symlink(self, target, path):
+        """Create a symlink `path` to `target`
+
+        A link that exists already is fine, if it points to `target`
+        (another client might have created it meanwhile). Anything else at
+        `path` is an error.
+        """
+        raise NotImplementedError
+
     def remove(self, path):
         raise NotImplementedError
 
     def exists(self, path):
         raise NotImplementedError
 
+    def create_exclusive(self, path):
+        """Atomically create an empty file, unless it exists
+
+        Returns
+        -------
+        bool
+          False, if the file exists already.
+        """
+        raise NotImplementedError
+
+    def get_age(self, path):
+        """Returns the seconds since a file was modified, None if it's absent
+        """
+        raise NotImplementedError
+
+    def touch(self, path):
+        """Set the modification time of an existing file to now"""
+        raise NotImplementedError
+
+    def read_range(self, path, offset, length):
+        """Read a part of a file
+
+        Parameters
+        ----------
+        path : Path
+          Must be an absolute path
+        offset : int
+        length : int
+
+        Returns
+        -------
+        bytes
+        """
+        raise NotImplementedError
+
+    def get_range(self, path, offset, length, dst):
+        """Like `get`, but only obtain a part of a file"""
+        raise NotImplementedError
+
+    def list_loose_keys(self, obj_dir):
+        """Returns the keys in an annex object tree
+
+        Returns
+        -------
+        list
+          (path, size) of all key files, with paths relative to `obj_dir`.
+          Empty, if there is no such directory.
+        """
+        raise NotImplementedError
+
+    def prune_keys(self, obj_dir, relpaths):
+        """Remove key files from an annex object tree
+
+        Key and hash directories that become empty are removed too.
+        """
+        raise NotImplementedError
+
+    def archive_directory(self, path, archive):
+        """Write the content of a directory into an uncompressed 7z archive
+
+        Members are named by their path relative to `path`.
+        """
+        raise NotImplementedError
+
+    def _get_archive_stamp(self, archive_path):
+        """Returns a value that changes whenever an archive is modified"""
+        return None
+
+    def _get_7z_index(self, archive_path):
+        """Returns the SevenZipIndex of an archive, or None
+
+        The header of an archive is read and parsed only once per session
+        (unless the archive changes).
+        """
+        stamp = self._get_archive_stamp(archive_path)
+        cached = self._archive_indices.get(archive_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        try:
+            index = SevenZipIndex(
+                lambda offset, length: self.read_range(
+                    archive_path, offset, length))
+        except Exception as e:
+            lgr.debug("Cannot read 7z header of %s natively: %s",
+                      archive_path, e)
+            index = None
+        self._archive_indices[archive_path] = (stamp, index)
+        return index
+
+    def _locate_in_7z(self, archive_path, file_path):
+        """Returns the position of a member's content in a 7z archive
+
+        Returns
+        -------
+        (int, int) or None
+          Offset and size, or None if the archive has to be read by 7z.
+
+        Raises
+        ------
+        RIARemoteError
+          If the archive is known not to contain the member.
+        """
+        index = self._get_7z_index(archive_path)
+        if index is None:
+            return None
+        try:
+            return index.locate(str(file_path))
+        except KeyError:
+            raise RIARemoteError("{} is not in archive {}".format(
+                file_path, archive_path))
+
+    def _unpack_from_7z(self, archive_path, file_path, dst):
+        """Unpack a member of a compressed 7z archive without running 7z
+
+        Only the packed stream of the member's folder is read from the
+        archive, as far as needed, and unpacked locally. Unpacked folders
+        are kept in the folder cache for further members.
+
+        Returns
+        -------
+        bool
+          False, if the archive's header or coders can't be read natively,
+          and the archive has to be read by 7z.
+
+        Raises
+        ------
+        RIARemoteError
+          If the archive is known not to contain the member.
+        """
+        index = self._get_7z_index(archive_path)
+        if index is None:
+            return False
+        try:
+            member = index.members[str(file_path)]
+        except KeyError:
+            raise RIARemoteError("{} is not in archive {}".format(
+                file_path, archive_path))
+        try:
+            with open(str(dst), 'wb') as target_file:
+                if member.folder is not None:
+                    self.folder_cache.get_member(
+                        (archive_path, self._archive_indices[archive_path][0],
+                         member.folder),
+                        index.folders[member.folder],
+                        member,
+                        lambda offset, length: self.read_range(
+                            archive_path, offset, length),
+                        target_file)
+        except UnsupportedCoderError as e:
+            lgr.debug("Cannot unpack %s natively: %s", archive_path, e)
+            return False
+        return True
+
+    def _get_tar_index(self, archive_path):
+        """Returns the TarIndex of an uncompressed tar archive, or None"""
+        raise NotImplementedError
+
+    def _locate_in_tar(self, archive_path, file_path):
+        """Returns the position of a member's content in a tar archive
+
+        Returns
+        -------
+        (int, int) or None
+          Offset and size, or None if the archive has no usable index.
+
+        Raises
+        ------
+        RIARemoteError
+          If the archive is known not to contain the member.
+        """
+        index = self._get_tar_index(archive_path)
+        if index is None:
+            return None
+        try:
+            return index.locate(str(file_path))
+        except KeyError:
+            raise RIARemoteError("{} is not in archive {}".format(
+                file_path, archive_path))
+
     def get_from_archive(self, archive, src, dst):
         """Get a file from an archive
 
@@ -148,9 +531,84 @@ class IOBase(object):
 
         raise NotImplementedError
 
+    def open_key_index(self, path):
+        """Open a key index file (see `ria_remote.keyindex`)
+
+        Parameters
+        ----------
+        path : Path
+          Must be an absolute path
+
+        Returns
+        -------
+        KeyIndex
+        """
+        raise NotImplementedError
+
+    def open_store_index(self, path, readonly=False):
+        """Open the key index database of a store
+
+        Parameters
+        ----------
+        path : Path
+          Must be an absolute path
+        readonly : bool, optional
+          Open the database for queries only.
+
+        Returns
+        -------
+        StoreIndex
+        """
+        raise NotImplementedError
+
+
+class _MappedFile(object):
+    """Read-only file object on top of a memory map of a file"""
+
+    def __init__(self, path):
+        with open(str(path), 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=0):
+        self._map.seek(pos, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def read(self, n=-1):
+        return self._map.read(n)
+
+    def close(self):
+        self._map.close()
+
 
 class LocalIO(IOBase):
     """IO operation if the object tree is local (e.g. NFS-mounted)"""
+    def __init__(self, folder_cache_size=FOLDER_CACHE_SIZE):
+        super().__init__(folder_cache_size)
+        # open ZIP archives by path, their central directory is read only
+        # once per session (unless the archive changes)
+        self._zipfiles = dict()
+
+    def _get_zipfile(self, archive_path):
+        """Returns an open ZipFile, backed by a memory map of the archive"""
+        st = archive_path.stat()
+        stamp = (st.st_size, st.st_mtime_ns)
+        cached = self._zipfiles.get(archive_path)
+        if cached:
+            if cached[0] == stamp:
+                return cached[1]
+            cached[1].close()
+            cached[2].close()
+        mapped = _MappedFile(archive_path)
+        zf = zipfile.ZipFile(mapped)
+        self._zipfiles[archive_path] = (stamp, zf, mapped)
+        return zf
+
     def mkdir(self, path):
         path.mkdir(
             parents=True,
@@ -170,6 +628,20 @@ class LocalIO(IOBase):
         )
 
     def get_from_archive(self, archive, src, dst):
+        if archive.suffix == '.zip':
+            zf = self._get_zipfile(archive)
+            with zf.open(str(src)) as member, \
+                    open(dst, 'wb') as target_file:
+                shutil.copyfileobj(member, target_file)
+            return
+        located = self._locate_in_tar(archive, src) \
+            if archive.suffix == '.tar' else self._locate_in_7z(archive, src)
+        if located:
+            # stored verbatim, no need to run 7z
+            self.get_range(archive, located[0], located[1], dst)
+            return
+        if archive.suffix == '.7z' and self._unpack_from_7z(archive, src, dst):
+            return
         # this requires python 3.5
         with open(dst, 'wb') as target_file:
             subprocess.run([
@@ -181,6 +653,16 @@ class LocalIO(IOBase):
     def rename(self, src, dst):
         src.rename(dst)
 
+    def link(self, src, dst):
+        os.link(str(src), str(dst))
+
+    def symlink(self, target, path):
+        try:
+            os.symlink(str(target), str(path))
+        except FileExistsError:
+            if not path.is_symlink() or os.readlink(str(path)) != str(target):
+                raise
+
     def remove(self, path):
         path.unlink()
 
@@ -190,11 +672,124 @@ class LocalIO(IOBase):
     def exists(self, path):
         return path.exists()
 
+    def create_exclusive(self, path):
+        try:
+            os.close(os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def get_age(self, path):
+        try:
+            return time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def touch(self, path):
+        os.utime(str(path))
+
+    def list_loose_keys(self, obj_dir):
+        return list(iter_loose_keys(obj_dir))
+
+    def prune_keys(self, obj_dir, relpaths):
+        for relpath in relpaths:
+            keypath = obj_dir / relpath
+            keypath.unlink()
+            # key directory and two levels of hash directories
+            for parent in list(keypath.parents)[:3]:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+
+    def archive_directory(self, path, archive):
+        subprocess.run(
+            ['7z', 'a', '-t7z', '-mx0', str(archive), '.'],
+            cwd=str(path),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    def read_range(self, path, offset, length):
+        chunks = []
+        with open(str(path), 'rb') as f:
+            while length > 0:
+                chunk = os.pread(f.fileno(), min(length, 1 << 30), offset)
+                if not chunk:
+                    raise RIARemoteError("{} is truncated".format(path))
+                chunks.append(chunk)
+                offset += len(chunk)
+                length -= len(chunk)
+        return b''.join(chunks)
+
+    def get_range(self, path, offset, length, dst):
+        sendfile = getattr(os, 'sendfile', None)
+        with open(str(path), 'rb') as src_file, \
+                open(str(dst), 'wb') as target_file:
+            src_fd = src_file.fileno()
+            while length > 0:
+                if sendfile:
+                    try:
+                        # copies within the kernel
+                        n = sendfile(
+                            target_file.fileno(), src_fd, offset, length)
+                    except OSError:
+                        # not supported for files on this platform
+                        sendfile = None
+                        continue
+                else:
+                    n = target_file.write(
+                        os.pread(src_fd, min(length, 1 << 20), offset))
+                if not n:
+                    raise RIARemoteError("{} is truncated".format(path))
+                offset += n
+                length -= n
+
+    def _get_archive_stamp(self, archive_path):
+        st = archive_path.stat()
+        return st.st_size, st.st_mtime_ns
+
+    def _get_tar_index(self, archive_path):
+        stamp = self._get_archive_stamp(archive_path)
+        cached = self._archive_indices.get(archive_path)
+        if cached:
+            if cached[0] == stamp:
+                return cached[1]
+            cached[1].close()
+        index = None
+        sidecar = tar_index_path(archive_path)
+        if sidecar.exists():
+            try:
+                index = TarIndex.from_sidecar(
+                    self.open_key_index(sidecar), archive_path.name,
+                    tar_stamp(
+                        lambda offset, length: self.read_range(
+                            archive_path, offset, length),
+                        stamp[0]))
+            except ValueError as e:
+                lgr.debug("Cannot use %s: %s", sidecar, e)
+        if index is None:
+            # no (up-to-date) index, we can still read the archive itself
+            index = TarIndex.from_archive(archive_path)
+        self._archive_indices[archive_path] = (stamp, index)
+        return index
+
     def in_archive(self, archive_path, file_path):
         if not archive_path.exists():
             # no archive, not file
             return False
         loc = str(file_path)
+        if archive_path.suffix == '.zip':
+            try:
+                self._get_zipfile(archive_path).getinfo(loc)
+                return True
+            except KeyError:
+                return False
+        if archive_path.suffix == '.tar':
+            return loc in self._get_tar_index(archive_path)
+        index = self._get_7z_index(archive_path)
+        if index is not None:
+            return loc in index
         from datalad.cmd import Runner
         runner = Runner()
         # query 7z for the specific object location, keeps the output
@@ -217,6 +812,12 @@ class LocalIO(IOBase):
         with open(str(file_path), mode) as f:
             f.write(content)
 
+    def open_key_index(self, path):
+        return KeyIndex(path)
+
+    def open_store_index(self, path, readonly=False):
+        return StoreIndex(path, readonly=readonly)
+
 
 class SSHRemoteIO(IOBase):
     """IO operation if the object tree is SSH-accessible
@@ -228,15 +829,33 @@ class SSHRemoteIO(IOBase):
     REMOTE_CMD_FAIL = "ria-remote: end - fail"
     REMOTE_CMD_OK = "ria-remote: end - ok"
 
-    def __init__(self, host):
+    # commands to list and extract a particular archive member, by archive
+    # file name extension
+    ARCHIVE_LIST_CMDS = {'.7z': '7z l', '.zip': 'unzip -l', '.tar': 'tar -tf'}
+    ARCHIVE_EXTRACT_CMDS = {
+        '.7z': '7z x -so', '.zip': 'unzip -p', '.tar': 'tar -xOf'}
+
+    # number of paths passed to a single rm/rmdir call
+    PRUNE_BATCH_SIZE = 200
+
+    def __init__(self, host, client_decompress=False,
+                 folder_cache_size=FOLDER_CACHE_SIZE):
         """
         Parameters
         ----------
         host : str
           SSH-accessible host(name) to perform remote IO operations
           on.
+        client_decompress : bool
+          Whether to transfer members of compressed 7z archives as the
+          compressed data of their folder, and unpack them locally, rather
+          than running 7z on the remote end.
+        folder_cache_size : int
+          Bound of the unpacked data of compressed 7z folders kept for
+          further members, in bytes.
         """
-
+        super().__init__(folder_cache_size)
+        self.client_decompress = client_decompress
         from datalad.support.sshconnector import SSHManager
         # connection manager -- we don't have to keep it around, I think
         self.sshmanager = SSHManager()
@@ -247,6 +866,8 @@ class SSHRemoteIO(IOBase):
             use_remote_annex_bundle=False,
         )
         self.ssh.open()
+        # what we learned about the remote tree during this session
+        self.pathcache = PathStateCache()
         # open a remote shell
         cmd = ['ssh'] + self.ssh._ssh_args + [self.ssh.sshri.as_str()]
         self.shell = subprocess.Popen(cmd, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
@@ -269,6 +890,7 @@ class SSHRemoteIO(IOBase):
             # TODO: Theoretically terminate() can raise if not successful. How to deal with that?
             self.shell.terminate()
         self.sshmanager.close()
+        self.folder_cache.clear()
 
     def _append_end_markers(self, cmd):
         """Append end markers to remote command"""
@@ -354,10 +976,14 @@ class SSHRemoteIO(IOBase):
         return "".join(lines[:-1])
 
     def mkdir(self, path):
+        if self.pathcache.is_dir(path):
+            return
         self._run('mkdir -p {}'.format(sh_quote(str(path))))
+        self.pathcache.add_dir(path)
 
     def put(self, src, dst):
         self.ssh.put(str(src), str(dst))
+        self.pathcache.add_present(dst)
 
     def get(self, src, dst):
 
@@ -368,16 +994,6 @@ class SSHRemoteIO(IOBase):
 
         # TODO: see get_from_archive()
 
-        # TODO: Currently we will hang forever if the file isn't readable and it's supposed size is bigger than whatever
-        #       cat spits out on stdout. This is because we don't notice that cat has exited non-zero.
-        #       We could have end marker on stderr instead, but then we need to empty stderr beforehand to not act upon
-        #       output from earlier calls. This is a problem with blocking reading, since we need to make sure there's
-        #       actually something to read in any case.
-        cmd = 'cat {}'.format(str(src))
-        self.shell.stdin.write(cmd.encode())
-        self.shell.stdin.write(b"\n")
-        self.shell.stdin.flush()
-
         from os.path import basename
         key = basename(str(src))
         try:
@@ -390,41 +1006,204 @@ class SSHRemoteIO(IOBase):
             self.ssh.get(str(src), str(dst))
             return
 
-        with open(dst, 'wb') as target_file:
-            bytes_received = 0
-            while bytes_received < size:  # TODO: some additional abortion criteria? check stderr in addition?
-                c = self.shell.stdout.read1(1024)
-                # no idea yet, whether or not there's sth to gain by a sophisticated determination of how many bytes to
-                # read at once (like size - bytes_received)
-                if c:
-                    bytes_received += len(c)
-                    target_file.write(c)
+        # a file that is shorter than its key says fails, rather than
+        # leaving us waiting for more output forever
+        self.get_range(src, 0, size, dst)
 
     def rename(self, src, dst):
-        self._run('mv {} {}'.format(sh_quote(str(src)), sh_quote(str(dst))))
+        # check for failure, since we must not record a state that we
+        # didn't achieve
+        self._run('mv {} {}'.format(sh_quote(str(src)), sh_quote(str(dst))),
+                  check=True)
+        self.pathcache.add_absent(src)
+        self.pathcache.add_present(dst)
+
+    def link(self, src, dst):
+        self._run('ln {} {}'.format(sh_quote(str(src)), sh_quote(str(dst))),
+                  check=True)
+        self.pathcache.add_present(dst)
+
+    def symlink(self, target, path):
+        # -n: never create the link inside an existing link to a directory
+        self._run('ln -sn {target} {path} 2> /dev/null '
+                  '|| test "$(readlink {path})" = {target}'.format(
+                      target=sh_quote(str(target)),
+                      path=sh_quote(str(path))),
+                  check=True)
+        self.pathcache.add_present(path)
 
     def remove(self, path):
-        self._run('rm {}'.format(sh_quote(str(path))))
+        self._run('rm {}'.format(sh_quote(str(path))), check=True)
+        self.pathcache.add_absent(path)
 
     def remove_dir(self, path):
-        self._run('rmdir {}'.format(sh_quote(str(path))))
+        self._run('rmdir {}'.format(sh_quote(str(path))), check=True)
+        self.pathcache.add_absent(path)
+
+    def create_exclusive(self, path):
+        # with noclobber, the shell creates files with O_EXCL
+        try:
+            self._run('( set -C && : > {} ) 2> /dev/null'.format(
+                sh_quote(str(path))), check=True)
+        except RemoteCommandFailedError:
+            return False
+        return True
+
+    def get_age(self, path):
+        # evaluated on the remote end, unaffected by clock skew
+        out = self._run(
+            'if [ -e {path} ]; then '
+            'echo $(( $(date +%s) - $(stat -c %Y {path}) )); fi'.format(
+                path=sh_quote(str(path))),
+            no_output=False, check=True)
+        return int(out) if out.strip() else None
+
+    def touch(self, path):
+        self._run('touch -c {}'.format(sh_quote(str(path))), check=True)
+
+    def list_loose_keys(self, obj_dir):
+        out = self._run(
+            "if [ -d {path} ]; then find {path} -mindepth 4 -maxdepth 4 "
+            "-type f -printf '%P\\t%s\\n'; fi".format(
+                path=sh_quote(str(obj_dir))),
+            no_output=False, check=True)
+        return [
+            (relpath, int(size)) for relpath, size in
+            (line.rsplit('\t', 1) for line in out.splitlines())
+        ]
+
+    def prune_keys(self, obj_dir, relpaths):
+        relpaths = list(relpaths)
+        # a roundtrip per batch of keys, rather than per key
+        for i in range(0, len(relpaths), self.PRUNE_BATCH_SIZE):
+            batch = relpaths[i:i + self.PRUNE_BATCH_SIZE]
+            self._run(
+                '( cd {} && rm -f -- {} && '
+                'rmdir -p --ignore-fail-on-non-empty -- {} )'.format(
+                    sh_quote(str(obj_dir)),
+                    ' '.join(sh_quote(str(p)) for p in batch),
+                    ' '.join(sh_quote(str(Path(p).parent)) for p in batch)),
+                check=True)
+        self.pathcache.invalidate(obj_dir)
+
+    def archive_directory(self, path, archive):
+        self._run(
+            '( cd {} && 7z a -t7z -mx0 {} . > /dev/null )'.format(
+                sh_quote(str(path)), sh_quote(str(archive))),
+            check=True)
+        self.pathcache.add_present(archive)
 
     def exists(self, path):
+        if self.pathcache.is_present(path):
+            return True
+        if self.pathcache.is_absent(path):
+            return False
         try:
             self._run('test -e {}'.format(sh_quote(str(path))), check=True)
+            self.pathcache.add_present(path)
             return True
         except RemoteCommandFailedError:
+            self.pathcache.add_absent(path)
             return False
 
+    def _send_range(self, path, offset, length):
+        """Make the remote shell output exactly `length` bytes of a file
+
+        Output of a truncated file is padded with zeros, rather than leaving
+        us waiting for more output forever. The file's size is output first,
+        on a line of its own, such that truncation can be detected.
+
+        Returns
+        -------
+        int
+          Size of the file, -1 if it can't be read.
+        """
+        cmd = '{{ wc -c < {path}; }} 2> /dev/null || echo -1; ' \
+              '{{ tail -c +{start} {path} 2> /dev/null | head -c {length}; ' \
+              'head -c {length} /dev/zero; }} | head -c {length}\n'.format(
+                  start=offset + 1,
+                  path=sh_quote(str(path)),
+                  length=length)
+        self.shell.stdin.write(cmd.encode())
+        self.shell.stdin.flush()
+        line = self.shell.stdout.readline()
+        try:
+            return int(line)
+        except ValueError:
+            raise RIARemoteError(
+                "Unexpected output reading {}: {}".format(path, line))
+
+    @staticmethod
+    def _check_range(path, size, offset, length):
+        # called once the padded output is consumed, such that the shell is
+        # ready for the next command
+        if size < offset + length:
+            raise RIARemoteError("{} is truncated".format(path))
+
+    def read_range(self, path, offset, length):
+        if not length:
+            return b''
+        size = self._send_range(path, offset, length)
+        data = self.shell.stdout.read(length)
+        self._check_range(path, size, offset, length)
+        return data
+
+    def get_range(self, path, offset, length, dst):
+        with open(dst, 'wb') as target_file:
+            if not length:
+                return
+            size = self._send_range(path, offset, length)
+            bytes_received = 0
+            while bytes_received < length:
+                c = self.shell.stdout.read1(
+                    min(length - bytes_received, 1 << 16))
+                if not c:
+                    raise RIARemoteError(
+                        "Connection lost reading {}".format(path))
+                bytes_received += len(c)
+                target_file.write(c)
+        self._check_range(path, size, offset, length)
+
+    def _get_tar_index(self, archive_path):
+        cached = self._archive_indices.get(archive_path)
+        if cached:
+            return cached[1]
+        index = None
+        sidecar = tar_index_path(archive_path)
+        if self.exists(sidecar):
+            try:
+                size = int(self._run(
+                    'wc -c < {}'.format(sh_quote(str(archive_path))),
+                    no_output=False, check=True))
+                stamp = tar_stamp(
+                    lambda offset, length: self.read_range(
+                        archive_path, offset, length),
+                    size)
+                index = TarIndex.from_sidecar(
+                    self.open_key_index(sidecar), archive_path.name, stamp)
+            except Exception as e:
+                lgr.debug("Cannot use %s: %s", sidecar, e)
+        # without an index, tar is run on the remote end
+        self._archive_indices[archive_path] = (None, index)
+        return index
+
     def in_archive(self, archive_path, file_path):
 
         if not self.exists(archive_path):
             return False
 
         loc = str(file_path)
-        # query 7z for the specific object location, keeps the output
+        if archive_path.suffix in ('.7z', '.tar'):
+            index = self._get_tar_index(archive_path) \
+                if archive_path.suffix == '.tar' \
+                else self._get_7z_index(archive_path)
+            if index is not None:
+                return loc in index
+        # query for the specific object location, keeps the output
         # lean, even for big archives
-        cmd = '7z l {} {}'.format(str(archive_path), loc)
+        cmd = '{} {} {}'.format(
+            self.ARCHIVE_LIST_CMDS[archive_path.suffix],
+            str(archive_path), loc)
 
         # Note: Currently relies on file_path not showing up in case of failure
         # including non-existent archive. If need be could be more sophisticated
@@ -440,10 +1219,24 @@ class SSHRemoteIO(IOBase):
         if not self.exists(archive):
             raise RIARemoteError("archive {arc} does not exist.".format(arc=archive))
 
+        if archive.suffix in ('.7z', '.tar'):
+            located = self._locate_in_tar(archive, src) \
+                if archive.suffix == '.tar' \
+                else self._locate_in_7z(archive, src)
+            if located:
+                # stored verbatim, read it without running 7z
+                self.get_range(archive, located[0], located[1], dst)
+                return
+            if archive.suffix == '.7z' and self.client_decompress \
+                    and self._unpack_from_7z(archive, src, dst):
+                return
+
         # TODO: We probably need to check exitcode on stderr (via marker). If archive or content is missing we will
         #       otherwise hang forever waiting for stdout to fill `size`
 
-        cmd = '7z x -so {} {}\n'.format(str(archive), str(src))
+        cmd = '{} {} {}\n'.format(
+            self.ARCHIVE_EXTRACT_CMDS[archive.suffix],
+            str(archive), str(src))
         self.shell.stdin.write(cmd.encode())
         self.shell.stdin.flush()
 
@@ -489,6 +1282,23 @@ class SSHRemoteIO(IOBase):
             self._run(cmd, check=True)
         except RemoteCommandFailedError:
             raise RIARemoteError("Could not write to {}".format(str(file_path)))
+        self.pathcache.add_present(file_path)
+
+    def open_key_index(self, path):
+        # an index is small compared to what it describes, and looking up
+        # keys locally saves a roundtrip per key
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir) / path.name
+            self.get(path, tmp_path)
+            # memory-mapped, remains usable after the file is gone
+            return KeyIndex(tmp_path)
+
+    def open_store_index(self, path, readonly=False):
+        return RemoteStoreIndex(
+            path,
+            lambda cmd: self._run(cmd, no_output=False, check=True),
+            readonly=readonly,
+        )
 
 
 def handle_errors(func):
@@ -530,7 +1340,12 @@ class RIARemote(SpecialRemote):
     dataset_tree_version = '1'
     object_tree_version = '2'
     known_versions_objt = ['1', '2']
-    known_versions_dst = ['1']
+    known_versions_dst = ['1', '2']
+    # seconds after which a claim of an upload that wasn't refreshed is
+    # considered abandoned
+    upload_claim_timeout = 120
+    # seconds between checks whether a claimed upload completed
+    upload_claim_poll_interval = 2
 
     @handle_errors
     def __init__(self, annex):
@@ -545,16 +1360,56 @@ class RIARemote(SpecialRemote):
         self.read_only = False
         self.can_notify = None  # to be figured out later, since annex.protocol.extensions is not yet accessible
         self.force_write = None
+        # whether to unpack members of compressed archives locally
+        self.client_decompress = None
+        # bound of the unpacked data of archive folders kept per session
+        self.folder_cache_size = FOLDER_CACHE_SIZE
+        # machine-local cache of retrieved keys, if configured
+        self.object_cache = None
+        # limits of the transfers to the store host of all processes on
+        # this machine, if configured
+        self.max_transfers = None
+        self.max_bandwidth = None
+        self.governor = None
+        # measured latency and throughput of the store, loaded on first use
+        self._store_stats = None
+        # whether to record the cost derived from those in the git config
+        self.update_cost = None
+        # further locations of the store to read from, if configured
+        self.replica_spec = None
+        self.replicas = None
+        # size from which on keys are retrieved in parts from all replicas
+        self.split_size = None
         self.uuid = None
         self.ignore_remote_config = None
         self.remote_log_enabled = None
         self.remote_dataset_tree_version = None
         self.remote_object_tree_version = None
+        # roots of the store that datasets are assigned to, by dataset ID
+        # prefix (dataset tree version 2)
+        self.store_roots = []
+        # store-wide key index, if the store has one
+        self.store_index = None
+        # the dataset's key index, if there is one and we have local access
+        self.key_index = None
+        # the dataset's Bloom filter, loaded on first use (False if there
+        # is none)
+        self._bloom_filter = None
+        # keys the store index knows in archives of the dataset, loaded on
+        # first use (False if the index couldn't be queried)
+        self._archived_keys = None
 
         # for caching the remote's layout locations:
         self.remote_git_dir = None
         self.remote_archive_dir = None
         self.remote_obj_dir = None
+        self._archive_path = None
+        # the index of the dataset's archive segments, loaded on first use
+        # (False if there is none)
+        self._segment_index = None
+        # prefix length and format of the dataset's archive shards, loaded
+        # on first use (False if archives aren't sharded)
+        self._shard_config = None
 
     def _load_cfg(self, gitdir, name):
         # for now still accept the configs, if no ria-URL is known:
@@ -574,23 +1429,66 @@ class RIARemote(SpecialRemote):
         # whether to ignore config flags set at the remote end
         self.ignore_remote_config = _get_gitcfg(gitdir, 'annex.ria-remote.{}.ignore-remote-config'.format(name))
 
+        # whether to transfer compressed archive content and unpack it on
+        # this end, rather than on the store host
+        self.client_decompress = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.client-decompress'.format(name),
+            ['--bool']) == 'true'
+
+        folder_cache_size = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.folder-cache-size'.format(name),
+            ['--int'])
+        if folder_cache_size:
+            self.folder_cache_size = int(folder_cache_size)
+
+        # a directory to share retrieved keys with other clones on this
+        # machine
+        object_cache = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.object-cache'.format(name),
+            ['--path'])
+        if object_cache:
+            object_cache_size = _get_gitcfg(
+                gitdir, 'annex.ria-remote.{}.object-cache-size'.format(name),
+                ['--int'])
+            self.object_cache = ObjectCache(
+                object_cache,
+                int(object_cache_size) if object_cache_size
+                else OBJECT_CACHE_SIZE)
+
+        # mirrors of the store to read from
+        self.replica_spec = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.replicas'.format(name))
+        split_size = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.split-size'.format(name), ['--int'])
+        if split_size:
+            self.split_size = int(split_size)
+
+        max_transfers = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.max-transfers'.format(name),
+            ['--int'])
+        if max_transfers:
+            self.max_transfers = int(max_transfers)
+        max_bandwidth = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.max-bandwidth'.format(name),
+            ['--int'])
+        if max_bandwidth:
+            self.max_bandwidth = int(max_bandwidth)
+
+        # whether to keep git-annex' cost of the remote in line with the
+        # measured speed of the store
+        self.update_cost = _get_gitcfg(
+            gitdir, 'annex.ria-remote.{}.update-cost'.format(name),
+            ['--bool']) == 'true'
+
     def _verify_config(self, gitdir, fail_noid=True):
         # try loading all needed info from (git) config
         name = self.annex.getconfig('name')
         # get store url:
         self.ria_store_url = self.annex.getconfig('url')
         if self.ria_store_url:
-            # support URL rewrite without talking to a DataLad ConfigManager
-            # Q is why? Why not use the config manager?
-            url_cfgs = dict()
-            url_cfgs_raw = _get_gitcfg(gitdir, "^url.*", regex=True)
-            if url_cfgs_raw:
-                for line in url_cfgs_raw.splitlines():
-                    k, v = line.split()
-                    url_cfgs[k] = v
             self.storage_host, self.objtree_base_path = verify_ria_url(
                 self.ria_store_url,
-                url_cfgs,
+                _get_url_cfgs(gitdir),
             )
 
         # TODO duplicates call to `git-config` after RIA url rewrite
@@ -701,8 +1599,6 @@ class RIARemote(SpecialRemote):
 
         dataset_tree_version_file = \
             self.objtree_base_path / 'ria-layout-version'
-        object_tree_version_file = \
-            self.objtree_base_path / self.archive_id[:3] / self.archive_id[3:] / 'ria-layout-version'
 
         read_only_msg = "Setting remote to read-only usage in order to prevent damage by putting things into an " \
                         "unknown version of the target layout. You can overrule this by configuring " \
@@ -735,6 +1631,22 @@ class RIARemote(SpecialRemote):
                            "fix the structure on the remote end.")
                 self._set_read_only(read_only_msg)
 
+        if self.remote_dataset_tree_version == '2':
+            self._load_store_roots()
+        # the dataset's directory at the base path, which is a link to its
+        # directory in its root, if it has another one
+        default_dir = self.get_layout_locations(
+            self.objtree_base_path, self.archive_id)[0]
+        dataset_dir = self.get_layout_locations(
+            self.objtree_base_path, self.archive_id, self.store_roots)[0]
+        if dataset_dir != default_dir and not self.io.exists(dataset_dir) \
+                and self.io.exists(default_dir):
+            # the dataset predates the assignment of its root, it stays at
+            # the base path until it is moved
+            self.store_roots = []
+            dataset_dir = default_dir
+        object_tree_version_file = dataset_dir / 'ria-layout-version'
+
         # 2. check (annex) object tree version
         try:
             self.remote_object_tree_version = self._get_version_config(object_tree_version_file)
@@ -748,11 +1660,33 @@ class RIARemote(SpecialRemote):
                 # ensure we have a ds dir and simultaneously ensure the archives subdir
                 self.io.mkdir(object_tree_version_file.parent / 'archives')
                 self.io.write_file(object_tree_version_file, self.object_tree_version + '\n')
+                if dataset_dir != default_dir:
+                    # keep the dataset reachable at the base path, for
+                    # clone URLs and the maintenance commands of the store
+                    self.io.mkdir(default_dir.parent)
+                    self.io.symlink(dataset_dir, default_dir)
             else:
                 self._info("Remote doesn't report any object tree version. Consider upgrading git-annex-ria-remote or "
                            "fix the structure on the remote end.")
                 self._set_read_only(read_only_msg)
 
+    def _load_store_roots(self):
+        """Read the assignment of datasets to roots of the store"""
+        try:
+            content = self.io.read_file(
+                self.objtree_base_path / STORE_ROOTS_FILENAME)
+        except (RemoteError, FileNotFoundError):
+            # no further roots, all datasets are at the base path
+            self.store_roots = []
+            return
+        try:
+            self.store_roots = parse_store_roots(content)
+        except ValueError as e:
+            # we can't tell where the dataset is
+            raise RIARemoteError(
+                "{} of store at {}: {}".format(
+                    STORE_ROOTS_FILENAME, self.objtree_base_path, e))
+
     @handle_errors
     def prepare(self):
 
@@ -764,16 +1698,42 @@ class RIARemote(SpecialRemote):
         self._verify_config(gitdir)
 
         if self._local_io():
-            self.io = LocalIO()
+            self.io = self._open_io(None)
         elif self.storage_host:
-            self.io = SSHRemoteIO(self.storage_host)
-            from atexit import register
-            register(self.io.close)
+            self.io = self._open_io(self.storage_host)
         else:
             raise RIARemoteError(
                 "Local object tree base path does not exist, and no SSH host "
                 "configuration found.")
 
+        if self.max_transfers or self.max_bandwidth:
+            try:
+                self.governor = Governor(
+                    get_state_dir(self.storage_host or 'localhost'),
+                    max_transfers=self.max_transfers,
+                    max_bandwidth=self.max_bandwidth)
+            except Exception as e:
+                self._info("Cannot limit transfers: {}".format(e))
+
+        if self.replica_spec:
+            try:
+                self.replicas = [Replica(
+                    self.storage_host, self.objtree_base_path,
+                    lambda host: self.io, self._get_store_stats())] + [
+                    Replica(host, base_path, self._open_io)
+                    for host, base_path in parse_replicas(
+                        self.replica_spec, _get_url_cfgs(gitdir),
+                        self.objtree_base_path)
+                ]
+            except ValueError as e:
+                self._info("Cannot use replicas: {}".format(e))
+
+        if self.update_cost:
+            try:
+                self._update_cost(gitdir)
+            except Exception as e:
+                self._info("Cannot update cost: {}".format(e))
+
         # report active special remote configuration
         self.info = {
             'objtree_base_path': str(self.objtree_base_path),
@@ -785,7 +1745,118 @@ class RIARemote(SpecialRemote):
 
         # cache remote layout directories
         self.remote_git_dir, self.remote_archive_dir, self.remote_obj_dir = \
-            self.get_layout_locations(self.objtree_base_path, self.archive_id)
+            self.get_layout_locations(self.objtree_base_path, self.archive_id,
+                                      self.store_roots)
+
+        self._open_store_index()
+        if self._local_io():
+            key_index_path = self.remote_git_dir / KEY_INDEX_FILENAME
+            if key_index_path.exists():
+                try:
+                    self.key_index = KeyIndex(key_index_path)
+                except Exception as e:
+                    self._info("Cannot use key index {}: {}".format(
+                        key_index_path, e))
+
+    def _open_io(self, host):
+        """Returns an IO instance for a store on a host, or a local one"""
+        if not host:
+            return LocalIO(folder_cache_size=self.folder_cache_size)
+        io = SSHRemoteIO(
+            host,
+            client_decompress=self.client_decompress,
+            folder_cache_size=self.folder_cache_size)
+        from atexit import register
+        register(io.close)
+        return io
+
+    def _open_store_index(self):
+        """Use the store's key index, if there is one"""
+        index_path = self.objtree_base_path / STORE_INDEX_FILENAME
+        if not self.io.exists(index_path):
+            return
+        try:
+            # opening takes no lock, only updates do. A remote that doesn't
+            # write doesn't need to be able to write the index
+            index = self.io.open_store_index(
+                index_path, readonly=self.read_only)
+            if not index.has_tables():
+                # not (yet) created by ria-rebuild-index
+                index.close()
+                return
+            self.store_index = index
+        except Exception as e:
+            # the remote remains functional without it, but the index will
+            # get out of sync
+            self._info("Cannot use store index {}: {}".format(index_path, e))
+
+    def _get_bloom_filter(self):
+        """Returns the dataset's Bloom filter, or None if there is none
+
+        The filter is obtained from the store once per session.
+        """
+        if self._bloom_filter is None:
+            self._bloom_filter = False
+            filter_path = self.remote_git_dir / BLOOM_FILTER_FILENAME
+            journal_path = self.remote_git_dir / BLOOM_JOURNAL_FILENAME
+            if self.io.exists(filter_path):
+                try:
+                    with tempfile.TemporaryDirectory() as tmpdir:
+                        tmp_path = Path(tmpdir) / BLOOM_FILTER_FILENAME
+                        self.io.get(filter_path, tmp_path)
+                        bloom_filter = BloomFilter.from_bytes(
+                            tmp_path.read_bytes())
+                    if self.io.exists(journal_path):
+                        bloom_filter.update(
+                            self.io.read_file(journal_path).split())
+                    self._bloom_filter = bloom_filter
+                except Exception as e:
+                    self._info("Cannot use Bloom filter {}: {}".format(
+                        filter_path, e))
+        return self._bloom_filter or None
+
+    def _add_to_bloom_filter(self, key):
+        """Record a newly stored key for the dataset's Bloom filter"""
+        if not self.io.exists(self.remote_git_dir / BLOOM_FILTER_FILENAME):
+            return
+        try:
+            self.io.write_file(
+                self.remote_git_dir / BLOOM_JOURNAL_FILENAME,
+                key + '\n',
+                mode='a')
+        except Exception as e:
+            self._info("Failed to update Bloom filter journal: {}".format(e))
+        if self._bloom_filter:
+            self._bloom_filter.add(key)
+
+    def _get_archived_keys(self):
+        """Returns the keys the store index knows in archives or packs
+
+        The index is queried once per session, instead of once per key.
+
+        Returns
+        -------
+        set or None
+          None, if there is no usable store index.
+        """
+        if self._archived_keys is None:
+            self._archived_keys = False
+            if self.store_index:
+                try:
+                    self._archived_keys = self.store_index.archived(
+                        self.archive_id)
+                except Exception as e:
+                    self._info("Failed to query store index: {}".format(e))
+        return self._archived_keys or None
+
+    def _update_store_index(self, method, *args):
+        """Call a StoreIndex method for our dataset, if there is an index"""
+        if not self.store_index:
+            return
+        try:
+            getattr(self.store_index, method)(self.archive_id, *args)
+        except Exception as e:
+            self._info("Failed to update store index: {}".format(e))
 
     @handle_errors
     def transfer_store(self, key, filename):
@@ -803,6 +1874,24 @@ class RIARemote(SpecialRemote):
 
         self.io.mkdir(key_path.parent)
 
+        pool_key_path = self._get_pool_key_path(key)
+        if pool_key_path and self.io.exists(pool_key_path):
+            try:
+                # we know the content already, no need to transfer it
+                self.io.link(pool_key_path, key_path)
+                self._key_stored(key, filename)
+                return
+            except Exception as e:
+                lgr.debug("Failed to link %s from content pool: %s", key, e)
+
+        # parallel uploads of the same key, from this or any other client,
+        # are coordinated on the store. Only one of them transfers the
+        # content.
+        claim_path = self.remote_git_dir / CLAIMS_DIRNAME / key
+        if not self._claim_upload(claim_path, key_path):
+            # someone else uploaded it meanwhile, and updated the metadata
+            return
+
         # we need to copy to a temp location to let
         # checkpresent fail while the transfer is still in progress
         # and furthermore not interfere with administrative tasks in annex/objects
@@ -811,42 +1900,338 @@ class RIARemote(SpecialRemote):
         self.io.mkdir(transfer_dir)
         tmp_path = transfer_dir / key
 
-        if tmp_path.exists():
-            # Just in case - some parallel job could already be writing to it
-            # at least tell the conclusion, not just some obscure permission error
-            raise RIARemoteError('{}: upload already in progress'.format(filename))
         try:
-            self.io.put(filename, tmp_path)
+            with self._transfer(Path(filename).stat().st_size), \
+                    self._refreshing(claim_path):
+                self.io.put(filename, tmp_path)
             # copy done, atomic rename to actual target
             self.io.rename(tmp_path, key_path)
         except Exception as e:
             # whatever went wrong, we don't want to leave the transfer location blocked
-            self.io.remove(tmp_path)
+            if self.io.exists(tmp_path):
+                self.io.remove(tmp_path)
             raise e
+        finally:
+            try:
+                self.io.remove(claim_path)
+            except Exception as e:
+                # removed as abandoned by someone else
+                lgr.debug("Failed to release claim %s: %s", claim_path, e)
+        if pool_key_path:
+            try:
+                self.io.mkdir(pool_key_path.parent)
+                self.io.link(key_path, pool_key_path)
+            except Exception as e:
+                # most likely a parallel upload of the same key was faster
+                lgr.debug("Failed to add %s to content pool: %s", key, e)
+        self._key_stored(key, filename)
+
+    def _claim_upload(self, claim_path, key_path):
+        """Claim the upload of a key, or wait for someone else's upload
+
+        A claim is a file that is created atomically on the store. While
+        another client holds the claim of a key, we wait for the key to
+        show up. The holder of a claim refreshes its modification time
+        during the upload. A claim that wasn't refreshed for
+        `upload_claim_timeout` seconds is considered abandoned, and removed.
+
+        Returns
+        -------
+        bool
+          True, if we hold the claim now and need to upload the key. False,
+          if the key was uploaded by someone else.
+        """
+        self.io.mkdir(claim_path.parent)
+        waiting = False
+        while True:
+            if self.io.create_exclusive(claim_path):
+                if not self.io.exists(key_path):
+                    return True
+                # completed right before we claimed it
+                self.io.remove(claim_path)
+                return False
+            if self.io.exists(key_path):
+                return False
+            age = self.io.get_age(claim_path)
+            if age is not None and age > self.upload_claim_timeout:
+                self._info("Removing abandoned upload claim {}".format(
+                    claim_path))
+                try:
+                    self.io.remove(claim_path)
+                except Exception as e:
+                    # someone else was faster
+                    lgr.debug("Failed to remove %s: %s", claim_path, e)
+                continue
+            if not waiting:
+                self._info("Waiting for another upload of {}".format(
+                    key_path.name))
+                waiting = True
+            time.sleep(self.upload_claim_poll_interval)
+
+    @contextmanager
+    def _refreshing(self, claim_path):
+        """Context in which a thread keeps a claim from being abandoned"""
+        done = threading.Event()
+
+        def refresh():
+            # uploads don't use the shell of an SSH connection, hence this
+            # doesn't interfere with them
+            while not done.wait(self.upload_claim_timeout / 4):
+                try:
+                    self.io.touch(claim_path)
+                except Exception as e:
+                    lgr.debug("Failed to refresh %s: %s", claim_path, e)
+
+        thread = threading.Thread(target=refresh, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _key_stored(self, key, filename):
+        """Update store metadata after a key was put in place"""
+        self._update_store_index(
+            'record', key, LOOSE, None, Path(filename).stat().st_size)
+        self._add_to_bloom_filter(key)
+
+    def _get_pool_key_path(self, key):
+        """Returns the location of a key in the store's content pool
+
+        A pool is opt-in per store: it is only used once a store's
+        administrator created its directory. It must only be created for
+        stores whose datasets share access. Any client that knows a key
+        (e.g. a file's checksum) can store it without uploading content and
+        thereby obtain the content of any other dataset in the store, and
+        the pool directory itself holds the content of all datasets.
+
+        Returns
+        -------
+        Path or None
+          None, if the store has no content pool or the key can't be shared
+        """
+        pool_dir = self.objtree_base_path / CONTENT_POOL_DIRNAME
+        if not is_poolable(key) or not self.io.exists(pool_dir):
+            return None
+        return pool_dir / self.annex.dirhash(key) / key / key
 
     @handle_errors
     def transfer_retrieve(self, key, filename):
+        if self.object_cache:
+            # concurrent retrievals of the key by other clones on this
+            # machine are coordinated via the cache
+            self.object_cache.fetch(
+                key, filename, lambda dst: self._retrieve(key, dst))
+        else:
+            self._retrieve(key, filename)
+
+    @contextmanager
+    def _transfer(self, nbytes, stats=None):
+        """Context of a content transfer
+
+        The transfer starts within the configured limits, and its duration
+        is recorded in the measurements of the store, or those given.
+        """
+        if self.governor is None:
+            start = time.time()
+            yield
+        else:
+            with self.governor.transfer(nbytes):
+                start = time.time()
+                yield
+        try:
+            (stats or self._get_store_stats()).record(
+                nbytes, time.time() - start)
+        except Exception as e:
+            lgr.debug("Failed to record transfer statistics: %s", e)
+
+    def _get_store_stats(self):
+        """Returns the measurements of the store"""
+        if self._store_stats is None:
+            self._store_stats = StoreStats(get_stats_path(
+                self.storage_host, self.objtree_base_path))
+        return self._store_stats
+
+    def _retrieve(self, key, filename):
+        """Obtain a key from the store, or one of its replicas"""
+        nbytes = get_key_size(key)
+        if not self.replicas:
+            with self._transfer(nbytes):
+                self._retrieve_from(
+                    self.io, self.objtree_base_path, key, filename)
+            return
+        replicas = order_replicas(self.replicas, nbytes)
+        if self.split_size and nbytes and nbytes >= self.split_size:
+            try:
+                if self._retrieve_split(replicas, key, filename, nbytes):
+                    return
+            except Exception as e:
+                self._info("Failed to retrieve {} in parts: {}".format(
+                    key, e))
+                # replicas that failed a part are tried last
+                replicas = order_replicas(self.replicas, nbytes)
+        errors = []
+        for replica in replicas:
+            try:
+                with self._transfer(nbytes, replica.stats):
+                    self._retrieve_from(
+                        replica.io, replica.base_path, key, filename)
+            except Exception as e:
+                # fail over to the next one
+                replica.failed_at = time.time()
+                errors.append('{}: {}'.format(replica, e))
+                continue
+            replica.failed_at = None
+            return
+        raise RIARemoteError('Failed to retrieve {} from any replica: {}'.format(
+            key, errors))
+
+    def _get_base_location(self, path):
+        """Returns the location of a path at the base path of the store
+
+        Paths in the dataset's directory in another root of the store map
+        to its link at the base path, under which replicas have it, too.
+        """
+        if not self.store_roots:
+            return path
+        try:
+            relpath = path.relative_to(self.remote_git_dir)
+        except ValueError:
+            return path
+        return self.get_layout_locations(
+            self.objtree_base_path, self.archive_id)[0] / relpath
+
+    def _retrieve_from(self, io, base_path, key, filename):
+        """Obtain a key from a location of the store"""
+        def at(path):
+            # locations are determined for the primary
+            if base_path == self.objtree_base_path:
+                return path
+            return base_path / self._get_base_location(path).relative_to(
+                self.objtree_base_path)
+
         dsobj_dir, archive_path, key_path = self._get_obj_location(key)
-        abs_key_path = dsobj_dir / key_path
+        abs_key_path = at(dsobj_dir / key_path)
         # sadly we have no idea what type of source gave checkpresent->true
         # we can either repeat the checks, or just make two opportunistic
         # attempts (at most)
         try:
-            self.io.get(abs_key_path, filename)
+            io.get(abs_key_path, filename)
         except Exception as e1:
             # catch anything and keep it around for a potential re-raise
+            # keys of small datasets may have been moved into a pack of the
+            # store, which the dataset has no archive next to
+            pack = self._get_pack_member(key)
+            if pack is not None:
+                archive_path, key_path = pack
             try:
-                self.io.get_from_archive(archive_path, key_path, filename)
+                io.get_from_archive(at(archive_path), key_path, filename)
             except Exception as e2:
                 raise RIARemoteError('Failed to key: {}'.format([str(e1), str(e2)]))
 
+    def _retrieve_split(self, replicas, key, filename, nbytes):
+        """Retrieve a key file in parts from several replicas at once
+
+        Returns
+        -------
+        bool
+          False, if fewer than two healthy replicas have the key as a file.
+        """
+        dsobj_dir, _, key_path = self._get_obj_location(key)
+        sources = []
+        for replica in replicas:
+            if not replica.is_healthy():
+                continue
+            path = replica.translate(
+                self._get_base_location(dsobj_dir / key_path),
+                self.objtree_base_path)
+            if replica.io.exists(path):
+                sources.append((replica, path))
+        if len(sources) < 2:
+            return False
+        part_size = -(-nbytes // len(sources))
+        errors = []
+
+        def get_part(replica, path, offset, length, dst):
+            try:
+                with self._transfer(length, replica.stats):
+                    replica.io.get_range(path, offset, length, dst)
+            except Exception as e:
+                replica.failed_at = time.time()
+                errors.append('{}: {}'.format(replica, e))
+
+        with tempfile.TemporaryDirectory(
+                dir=str(Path(filename).parent)) as tmpdir:
+            parts = []
+            threads = []
+            # every replica has its own connection
+            for i, (replica, path) in enumerate(sources):
+                offset = i * part_size
+                if offset >= nbytes:
+                    break
+                parts.append(Path(tmpdir) / str(i))
+                threads.append(threading.Thread(
+                    target=get_part,
+                    args=(replica, path, offset,
+                          min(part_size, nbytes - offset), parts[-1])))
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise RIARemoteError(
+                    'Failed to retrieve parts: {}'.format(errors))
+            with open(str(filename), 'wb') as target_file:
+                for part in parts:
+                    with part.open('rb') as f:
+                        shutil.copyfileobj(f, target_file)
+        return True
+
+    def _get_pack_member(self, key):
+        """Returns the path of the store pack holding a key, and its member
+
+        Returns
+        -------
+        (Path, Path) or None
+          None, if the store index doesn't know of a pack with the key.
+        """
+        if not self.store_index:
+            return None
+        try:
+            locations = self.store_index.locate(self.archive_id, key)
+        except Exception as e:
+            self._info("Failed to query store index: {}".format(e))
+            return None
+        for location, member in locations:
+            if is_pack_location(location):
+                return self.objtree_base_path / location, Path(member)
+        return None
+
     @handle_errors
     def checkpresent(self, key):
         dsobj_dir, archive_path, key_path = self._get_obj_location(key)
         abs_key_path = dsobj_dir / key_path
+        archived_keys = self._get_archived_keys()
+        # archives are only ever changed along with the index, but loose
+        # files might have been removed by a client that doesn't maintain
+        # it. Either way, a key the index doesn't know about can still be
+        # there.
+        if archived_keys and key in archived_keys:
+            return True
+        bloom_filter = self._get_bloom_filter()
+        if bloom_filter is not None and key not in bloom_filter:
+            # not in any archive. But the filter was loaded at the start of
+            # the session, and clients predating the journal don't record
+            # keys they store, hence a loose file can still be there
+            return self.io.exists(abs_key_path)
         if self.io.exists(abs_key_path):
             # we have an actual file for this key
             return True
+        if self.key_index:
+            indexed = self._in_key_index(key, archive_path)
+            if indexed is not None:
+                return indexed
         # do not make a careful check whether an archive exists, because at
         # present this requires an additional SSH call for remote operations
         # which may be rather slow. Instead just try to run 7z on it and let
@@ -854,16 +2239,44 @@ class RIARemote(SpecialRemote):
         # TODO honor future 'archive-mode' flag
         return self.io.in_archive(archive_path, key_path)
 
+    def _in_key_index(self, key, archive_path):
+        """Look up whether a key is in an archive via the key index
+
+        Returns
+        -------
+        bool or None
+          None, if the index doesn't reliably describe the archive's content
+        """
+        location = str(archive_path.relative_to(self.remote_git_dir))
+        stamp = self.key_index.locations.get(location)
+        try:
+            if stamp is None or stamp != archive_path.stat().st_size:
+                # not indexed or modified since
+                return None
+        except FileNotFoundError:
+            return None
+        return any(e.location == location
+                   for e in self.key_index.lookup(key))
+
     @handle_errors
     def remove(self, key):
         if self.read_only:
             raise RIARemoteError("Remote was set to read-only. "
                                  "Configure 'ria-remote.<name>.force-write' to overrule this.")
 
+        pack_member = self._get_pack_member(key)
+        if pack_member:
+            # the key would remain present
+            raise RIARemoteError(
+                "{} is in store pack {}, keys can't be removed from "
+                "packs".format(key, pack_member[0]))
         dsobj_dir, archive_path, key_path = self._get_obj_location(key)
         key_path = dsobj_dir / key_path
         if self.io.exists(key_path):
             self.io.remove(key_path)
+        self._update_store_index('drop', key, LOOSE)
+        # Note: keys can't be removed from a Bloom filter, it continues to
+        # consider the key possibly present until it is regenerated
         key_dir = key_path
         # remove at most two levels of empty directories
         for level in range(2):
@@ -873,14 +2286,41 @@ class RIARemote(SpecialRemote):
             except Exception:
                 break
 
-    @handle_errors
-    def getcost(self):
+    def _get_default_cost(self):
         # 100 is cheap, 200 is expensive (all relative to Config/Cost.hs)
         # 100/200 are the defaults for local and remote operations in
         # git-annex
         # if we have the object tree locally, operations are cheap (100)
         # otherwise expensive (200)
-        return '100' if self._local_io() else '200'
+        return 100 if self._local_io() else 200
+
+    def _update_cost(self, gitdir):
+        """Record the cost derived from measurements of the store
+
+        git-annex asks for the cost of a remote once, and keeps it in
+        `remote.<name>.annex-cost`. Updating that setting makes git-annex
+        use the measured cost from its next run on.
+        """
+        cost = str(self._get_store_stats().get_cost(self._get_default_cost()))
+        key = 'remote.{}.annex-cost'.format(self.annex.getconfig('name'))
+        if _get_gitcfg(gitdir, key) == cost:
+            return
+        subprocess.run(
+            ['git', '--git-dir', gitdir, 'config', key, cost], check=True)
+
+    @handle_errors
+    def getcost(self):
+        # git-annex usually asks before PREPARE, when we don't know the store
+        # yet, and records the answer (see `_update_cost()`)
+        default = self._get_default_cost()
+        if self.objtree_base_path is None:
+            return str(default)
+        # once we have measured the store, the cost reflects how fast it is
+        try:
+            return str(self._get_store_stats().get_cost(default))
+        except Exception as e:
+            lgr.debug("Cannot use transfer statistics: %s", e)
+            return str(default)
 
     @handle_errors
     def whereis(self, key):
@@ -893,12 +2333,12 @@ class RIARemote(SpecialRemote):
         )
 
     @staticmethod
-    def get_layout_locations(base_path, dsid):
-        return get_layout_locations(1, base_path, dsid)
+    def get_layout_locations(base_path, dsid, roots=None):
+        return get_layout_locations(2 if roots else 1, base_path, dsid, roots)
 
     def _get_obj_location(self, key):
         # Note: Changes to this method may require an update of RIARemote._layout_version
-        # Note2: archive_path is always the same ATM. However, it might depend on `key` in the future.
+        # Note2: archive_path depends on `key`, if the dataset has archive segments.
         #        Therefore build the actual filename for the archive herein as opposed to `get_layout_locations`.
 
         # If we didn't recognize the remote layout version, we set to read-only and promised to at least try and read
@@ -910,5 +2350,62 @@ class RIARemote(SpecialRemote):
         # double 'key' is not a mistake, but needed to achieve the exact same
         # layout as the 'directory'-type special remote
         key_path = Path(key_dir) / key / key
-        archive_path = self.remote_archive_dir / 'archive.7z'
+        archive_path = self._get_segment_path(key) \
+            or self._get_shard_path(key) \
+            or self._get_archive_path()
         return self.remote_obj_dir, archive_path, key_path
+
+    def _get_shard_path(self, key):
+        """Returns the path of the archive shard for a key, or None"""
+        if self._shard_config is None:
+            self._shard_config = False
+            config_path = self.remote_archive_dir / SHARD_CONFIG_FILENAME
+            if self.io.exists(config_path):
+                try:
+                    self._shard_config = parse_shard_config(
+                        self.io.read_file(config_path))
+                except ValueError as e:
+                    self._info(str(e))
+        if not self._shard_config:
+            return None
+        return self.remote_archive_dir / get_shard_name(
+            key, *self._shard_config)
+
+    def _get_segment_index(self):
+        """Returns the index of the dataset's archive segments, or None
+
+        The index is obtained from the store once per session.
+        """
+        if self._segment_index is None:
+            self._segment_index = False
+            index_path = self.remote_archive_dir / SEGMENT_INDEX_FILENAME
+            if self.io.exists(index_path):
+                try:
+                    self._segment_index = self.io.open_key_index(index_path)
+                except Exception as e:
+                    self._info("Cannot use segment index {}: {}".format(
+                        index_path, e))
+        return self._segment_index or None
+
+    def _get_segment_path(self, key):
+        """Returns the path of the archive segment holding a key, or None"""
+        index = self._get_segment_index()
+        if index is None:
+            return None
+        entries = index.lookup(key)
+        return self.remote_archive_dir / entries[0].location \
+            if entries else None
+
+    def _get_archive_path(self):
+        """Returns the path of the dataset's archive, whether it exists or not
+
+        Tar and ZIP archives take precedence over a 7z archive, since they
+        can be read more efficiently.
+        """
+        if self._archive_path is None:
+            self._archive_path = self.remote_archive_dir / 'archive.7z'
+            for name in ('archive.tar', 'archive.zip'):
+                if self.io.exists(self.remote_archive_dir / name):
+                    self._archive_path = self.remote_archive_dir / name
+                    break
+        return self._archive_path
@@ -0,0 +1,437 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the datalad package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Repack the archives and loose keys of a dataset in a RIA store"""
+
+__docformat__ = 'restructuredtext'
+
+
+import logging
+import os
+import os.path as op
+import shutil
+import subprocess
+import tempfile
+import time
+from argparse import REMAINDER
+
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import (
+    get_status_dict,
+)
+from datalad.interface.utils import eval_results
+from datalad.support.param import Parameter
+from datalad.support.constraints import (
+    EnsureChoice,
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.utils import (
+    Path,
+    rmtree,
+)
+from datalad.log import log_progress
+from datalad.dochelpers import (
+    exc_str,
+)
+from ria_remote.export_archive import (
+    _export_7z,
+    _export_tar,
+    _export_zip,
+)
+from ria_remote.rebuild_index import _scan_dataset
+from ria_remote.remote import LocalIO
+from ria_remote.segments import (
+    SEGMENT_INDEX_FILENAME,
+    list_segments,
+)
+from ria_remote.store_index import (
+    STORE_INDEX_FILENAME,
+    StoreIndex,
+)
+from ria_remote.tarindex import tar_index_path
+from ria_remote.utils import (
+    SHARD_CONFIG_FILENAME,
+    get_layout_locations,
+    is_pack_location,
+    iter_archive_members,
+    iter_loose_keys,
+)
+
+lgr = logging.getLogger('ria_remote.repack')
+
+# directory in a dataset's archives directory to assemble a new archive in
+REPACK_DIRNAME = '.repack'
+
+
+@build_doc
+class RepackArchive(Interface):
+    """Repack the archives and loose keys of a dataset in a RIA store.
+
+    Keys can be removed from a dataset's annex object tree, but not from its
+    archive, and keys that are stored after an archive was exported remain
+    loose files. This command merges the members of all archives of a
+    dataset (``archives/archive.7z``, ``.zip``, or ``.tar``, and archive
+    segments) and its loose keys into a single new archive, and drops keys
+    that are not wanted anymore.
+
+    Keys to keep are read from a file with one key per line, for example the
+    output of ``git annex find --format='${key}\\n'`` in a clone of the
+    dataset. Without such a file, all keys are kept.
+
+    The new archive is written in a directory next to the archives
+    (``archives/.repack``), and verified against the list of kept keys.
+    Keys are read from the object tree and the current archives one at a
+    time, without extracting the archives. A new 7z archive is a copy of the
+    current 7z archive without the keys to drop, plus the other keys, of
+    which those in archives of other formats or segments are unpacked
+    first. Unless 7z options are given, the keys of the current 7z archive
+    keep their compression. Then the new archive replaces the dataset's
+    archive, previous segments and archives in other formats are removed,
+    as are the loose keys. Lastly, the dataset's key index and Bloom filter,
+    and the store-wide key index (if the store has one), are regenerated
+    for the dataset. If that fails, the result reports it, and
+    ``ria-rebuild-index`` regenerates them later.
+
+    This command must be executed on a machine with local access to the
+    store.
+    """
+    _params_ = dict(
+        path=Parameter(
+            args=("path",),
+            metavar="PATH",
+            doc="""base path of the RIA store""",
+            constraints=EnsureStr()),
+        dsid=Parameter(
+            args=("dsid",),
+            metavar="DSID",
+            doc="""ID of the dataset to repack""",
+            constraints=EnsureStr()),
+        keep=Parameter(
+            args=("--keep",),
+            metavar="FILE",
+            doc="""file with the keys to keep, one per line""",
+            constraints=EnsureStr() | EnsureNone()),
+        archive_format=Parameter(
+            args=("--format",),
+            dest="archive_format",
+            doc="""format of the new archive. By default, the format of the
+            dataset's current archive, or 7z""",
+            constraints=EnsureChoice('7z', 'zip', 'tar') | EnsureNone()),
+        dry_run=Parameter(
+            args=("--dry-run",),
+            action="store_true",
+            doc="""only report the number and size of the keys that would
+            be kept and dropped, and the estimated size of the new
+            archive"""),
+        opts=Parameter(
+            args=("opts",),
+            nargs=REMAINDER,
+            metavar="...",
+            doc="""options for 7z (see `ria-export-archive`)"""),
+    )
+
+    @staticmethod
+    @eval_results
+    def __call__(path, dsid, keep=None, archive_format=None, dry_run=False,
+                 opts=None):
+        base_path = Path(path).absolute()
+        dsdir, archive_dir, obj_dir = get_layout_locations(1, base_path, dsid)
+        res_kwargs = dict(
+            action="ria-repack-archive",
+            path=str(archive_dir),
+            logger=lgr,
+        )
+        if not (dsdir / 'ria-layout-version').exists():
+            yield get_status_dict(
+                status='error',
+                message=('no dataset %s in the store', dsid),
+                **res_kwargs)
+            return
+        if (archive_dir / SHARD_CONFIG_FILENAME).exists():
+            yield get_status_dict(
+                status='impossible',
+                message='sharded archives cannot be repacked',
+                **res_kwargs)
+            return
+
+        sources = [
+            archive_dir / name
+            for name in ('archive.tar', 'archive.zip', 'archive.7z')
+            if (archive_dir / name).exists()
+        ] + list_segments(archive_dir)
+        loose = list(iter_loose_keys(obj_dir))
+        if not sources and not loose:
+            yield get_status_dict(
+                status='notneeded',
+                message='no keys',
+                **res_kwargs)
+            return
+        if archive_format is None:
+            # the archive that RIA remotes prefer comes first
+            archive_format = sources[0].suffix[1:] if sources else '7z'
+        keep_keys = None
+        if keep is not None:
+            with open(keep) as f:
+                keep_keys = set(line.strip() for line in f if line.strip())
+
+        if dry_run:
+            yield get_status_dict(
+                status='ok',
+                **dict(_estimate(sources, loose, keep_keys), **res_kwargs))
+            return
+
+        archive = archive_dir / 'archive.{}'.format(archive_format)
+        workdir = archive_dir / REPACK_DIRNAME
+        start = time.time()
+        published = False
+        try:
+            if workdir.exists():
+                # leftover of an interrupted run
+                rmtree(str(workdir))
+            workdir.mkdir(parents=True)
+            # where to read each key from: an archive, or the object tree
+            members = dict()
+            for source in sources:
+                for relpath, size in iter_archive_members(source):
+                    members.setdefault(relpath, (source, size))
+            for relpath, size in loose:
+                members.setdefault(relpath, (None, size))
+            kept = dict(
+                (relpath, size) for relpath, (_, size) in members.items()
+                if keep_keys is None or op.basename(relpath) in keep_keys)
+            dropped = len(members) - len(kept)
+
+            new_archive = workdir / archive.name
+            log_progress(
+                lgr.info,
+                'riaarchiveexport',
+                'Start repacking RIA archive %s', archive,
+                total=len(kept),
+                label='RIA archive repack',
+                unit=' Keys',
+            )
+            try:
+                _repack(archive, new_archive, members, sorted(kept),
+                        obj_dir, workdir, opts)
+            finally:
+                log_progress(
+                    lgr.info,
+                    'riaarchiveexport',
+                    'Finished repacking RIA archive %s', archive,
+                )
+            if dict(iter_archive_members(new_archive)) != kept:
+                raise RuntimeError(
+                    'members of {} differ from the keys to keep'.format(
+                        new_archive))
+            _publish(new_archive, archive, sources)
+            published = True
+            # every loose key that we saw is in the new archive, or unwanted
+            LocalIO().prune_keys(obj_dir, [relpath for relpath, _ in loose])
+            _reindex_dataset(base_path, dsid)
+        except Exception as e:
+            yield get_status_dict(
+                status='error',
+                message=(
+                    'archive was replaced, but updating the dataset failed, '
+                    'run ria-rebuild-index: %s', exc_str(e))
+                if published else ('repacking failed: %s', exc_str(e)),
+                **dict(res_kwargs, path=str(archive))
+                if published else res_kwargs)
+            return
+        finally:
+            if workdir.exists():
+                rmtree(str(workdir))
+
+        duration = time.time() - start
+        size = archive.stat().st_size
+        yield get_status_dict(
+            type='file',
+            status='ok',
+            message=(
+                '%i keys (%i dropped), %i bytes in %.1f s (%.1f MB/s)',
+                len(kept), dropped, size, duration,
+                size / duration / 1e6 if duration else 0),
+            keys=len(kept),
+            dropped_keys=dropped,
+            bytes=size,
+            duration=duration,
+            **dict(res_kwargs, path=str(archive)))
+
+
+def _estimate(sources, loose, keep_keys):
+    """Returns result properties of a dry run"""
+    keys = dict(loose)
+    current = sum(size for _, size in loose)
+    for source in sources:
+        current += source.stat().st_size
+        keys.update(iter_archive_members(source))
+    kept = [size for relpath, size in keys.items()
+            if keep_keys is None or op.basename(relpath) in keep_keys]
+    return dict(
+        message=(
+            '%i keys, %i to keep (%i bytes), %i to drop; '
+            'currently %i bytes, estimated %i bytes after repacking '
+            '(uncompressed)',
+            len(keys), len(kept), sum(kept), len(keys) - len(kept),
+            current, sum(kept)),
+        keys=len(kept),
+        dropped_keys=len(keys) - len(kept),
+        current_bytes=current,
+        estimated_bytes=sum(kept),
+    )
+
+
+def _repack(archive, new_archive, members, relpaths, obj_dir, workdir, opts):
+    """Write keys into a new archive
+
+    Loose keys are read from the object tree, members of archives are
+    unpacked into `workdir` one at a time, as they are added. 7z reads all
+    files of an update at once, hence a new 7z archive starts out as a copy
+    of the current 7z archive, without the members to drop, and members of
+    other archives are unpacked all at once. Unless 7z options are given,
+    the members of the current 7z archive keep their compression.
+
+    Parameters
+    ----------
+    archive : Path
+      Archive to replace.
+    new_archive : Path
+    members : dict
+      Mapping of the relative paths of keys to (archive, size), archive is
+      None for loose keys.
+    relpaths : list
+      Keys to write.
+    obj_dir : Path
+    workdir : Path
+    opts : list or None
+      7z options.
+    """
+    io = LocalIO()
+    if new_archive.suffix == '.zip':
+        _export_zip(
+            new_archive,
+            _iter_keypaths(io, members, relpaths, obj_dir, workdir),
+            opts or ['-mx0'])
+        return
+    if new_archive.suffix == '.tar':
+        _export_tar(
+            new_archive,
+            _iter_keypaths(io, members, relpaths, obj_dir, workdir))
+        return
+    if archive.exists() and not opts:
+        present = set(relpath for relpath, _ in iter_archive_members(archive))
+        wanted = set(relpaths)
+        shutil.copyfile(str(archive), str(new_archive))
+        _delete_7z_members(new_archive, sorted(present - wanted))
+        relpaths = [relpath for relpath in relpaths if relpath not in present]
+    # updates rewrite the archive, two at most
+    loose = [obj_dir / relpath for relpath in relpaths
+             if members[relpath][0] is None]
+    if loose:
+        _export_7z(new_archive, obj_dir, loose, opts or ['-mx0'])
+    unpacked = workdir / 'members'
+    keypaths = []
+    for relpath in relpaths:
+        if members[relpath][0] is not None:
+            keypaths.append(_unpack(io, members[relpath][0], relpath, unpacked))
+    if keypaths:
+        _export_7z(new_archive, unpacked, keypaths, opts or ['-mx0'])
+
+
+def _iter_keypaths(io, members, relpaths, obj_dir, workdir):
+    """Yield the paths of key files, with members of archives unpacked
+
+    A member's file is removed once the next path is requested.
+    """
+    for relpath in relpaths:
+        if members[relpath][0] is None:
+            yield obj_dir / relpath
+            continue
+        keypath = _unpack(io, members[relpath][0], relpath, workdir)
+        try:
+            yield keypath
+        finally:
+            keypath.unlink()
+            # key directory and two levels of hash directories
+            for parent in list(keypath.parents)[:3]:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+
+
+def _unpack(io, archive, relpath, dst):
+    """Unpack an archive member to its relative path in `dst`"""
+    keypath = dst / relpath
+    keypath.parent.mkdir(parents=True, exist_ok=True)
+    io.get_from_archive(archive, Path(relpath), str(keypath))
+    return keypath
+
+
+def _delete_7z_members(archive, relpaths):
+    """Remove members from a 7z archive"""
+    if not relpaths:
+        return
+    with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', prefix='ria_archive',
+            suffix='.lst') as listfile:
+        listfile.write(''.join(relpath + '\n' for relpath in relpaths))
+        listfile.flush()
+        subprocess.run(
+            ['7z', 'd', '-scsUTF-8', '-spd', str(archive),
+             '@' + listfile.name],
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+
+def _publish(new_archive, archive, sources):
+    """Move a new archive into place, and remove the archives it replaces
+
+    The segment index goes before the segments, such that RIA remotes stop
+    looking for keys in segments before they are gone.
+    """
+    os.replace(str(new_archive), str(archive))
+    if archive.suffix == '.tar':
+        os.replace(str(tar_index_path(new_archive)),
+                   str(tar_index_path(archive)))
+    segment_index = archive.parent / SEGMENT_INDEX_FILENAME
+    if segment_index.exists():
+        segment_index.unlink()
+    for source in sources:
+        if source == archive:
+            continue
+        source.unlink()
+        if tar_index_path(source).exists():
+            tar_index_path(source).unlink()
+
+
+def _reindex_dataset(base_path, dsid):
+    """Regenerate the key index and Bloom filter of a dataset
+
+    The dataset's records in the store-wide key index are replaced too, if
+    the store has one, keeping records of keys in packs of the store.
+    """
+    index = StoreIndex(base_path / STORE_INDEX_FILENAME) \
+        if (base_path / STORE_INDEX_FILENAME).exists() else None
+    try:
+        if index is not None:
+            index.create_tables()
+        pack_records = [
+            r for r in index.keys(dsid) if is_pack_location(r[1])
+        ] if index is not None else []
+        records = _scan_dataset(base_path, dsid, pack_records)
+        if index is not None:
+            index.replace(dsid, records)
+    finally:
+        if index is not None:
+            index.close()
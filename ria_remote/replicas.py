@@ -0,0 +1,123 @@
+"""Read replicas of a RIA store
+
+A store can be mirrored to further hosts, or be accessible under other
+paths (e.g. a local mount of a mirror). A RIA remote can read keys from
+any of these replicas, while writes go to the store it is configured for,
+its primary. Replicas are tried in the order of their estimated transfer
+time, from the measurements of earlier transfers (see `storestats`).
+Replicas that weren't measured yet come first, such that they get
+measured. A replica that failed is only tried as a last resort for a
+while.
+"""
+
+import time
+from pathlib import Path
+
+from ria_remote.storestats import (
+    REFERENCE_SIZE,
+    StoreStats,
+    get_stats_path,
+)
+
+# seconds for which a replica that failed is tried only as a last resort
+RETRY_INTERVAL = 300
+
+
+def parse_replicas(spec, url_cfgs, base_path):
+    """Decode a list of replicas
+
+    Parameters
+    ----------
+    spec : str
+      Whitespace-separated SSH hosts, which serve the store at the same base
+      path as its primary, or 'ria+ssh://' and 'ria+file://' URLs.
+    url_cfgs : dict-like
+      Configuration settings for URL rewrites.
+    base_path : Path
+      Base path of the primary.
+
+    Returns
+    -------
+    list
+      (host, base path) of each replica, host is None for local ones.
+
+    Raises
+    ------
+    ValueError
+      For invalid URLs.
+    """
+    from ria_remote.utils import verify_ria_url
+    replicas = []
+    for item in spec.split():
+        if item.startswith('ria+'):
+            host, path = verify_ria_url(item, url_cfgs)
+            replicas.append((host, Path(path)))
+        else:
+            replicas.append((item, Path(base_path)))
+    return replicas
+
+
+class Replica(object):
+    """A location of a store to read from"""
+
+    def __init__(self, host, base_path, open_io, stats=None):
+        """
+        Parameters
+        ----------
+        host : str or None
+          SSH host, None for local access.
+        base_path : Path
+        open_io : callable
+          Called with the host, returns the IO instance to access the
+          replica with. Called on first use.
+        stats : StoreStats, optional
+          Measurements of the replica. By default, those of the machine's
+          shared state directory.
+        """
+        self.host = host
+        self.base_path = Path(base_path)
+        self._open_io = open_io
+        self._io = None
+        self.stats = stats if stats is not None \
+            else StoreStats(get_stats_path(host, base_path))
+        # time of the last failure, None if it didn't fail recently
+        self.failed_at = None
+
+    def __str__(self):
+        return '{}:{}'.format(self.host, self.base_path) if self.host \
+            else str(self.base_path)
+
+    @property
+    def io(self):
+        if self._io is None:
+            self._io = self._open_io(self.host)
+        return self._io
+
+    def translate(self, path, base_path):
+        """Returns the location on this replica of a path of another one"""
+        return self.base_path / Path(path).relative_to(base_path)
+
+    def is_healthy(self, now=None):
+        return self.failed_at is None or \
+            (now or time.time()) - self.failed_at > RETRY_INTERVAL
+
+
+def order_replicas(replicas, nbytes=None):
+    """Returns replicas in the order in which to read from them
+
+    Parameters
+    ----------
+    replicas : list
+    nbytes : int, optional
+      Size of the transfer.
+    """
+    now = time.time()
+
+    def rank(replica):
+        estimate = replica.stats.estimate(nbytes or REFERENCE_SIZE)
+        return -1 if estimate is None else estimate
+
+    return sorted(
+        (r for r in replicas if r.is_healthy(now)), key=rank) + sorted(
+        (r for r in replicas if not r.is_healthy(now)),
+        key=lambda r: r.failed_at)
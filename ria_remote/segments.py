@@ -0,0 +1,76 @@
+"""Incremental archive segments of a dataset in a RIA store
+
+Instead of updating a dataset's single archive, keys can be added to a
+store in numbered archive segments (``archives/archive-0001.7z``,
+``archives/archive-0002.7z``, ...). Each segment only holds keys that
+aren't in any previous one, and segments are never modified once written.
+
+A merged index in the archives directory (``archives/segments.index``, in
+the format of a key index, see `ria_remote.keyindex`) records which segment
+holds which key, such that RIA remotes can resolve the segment of a key
+without querying any archive.
+"""
+
+import os.path as op
+import re
+
+from ria_remote.keyindex import update_key_index
+from ria_remote.utils import (
+    ARCHIVE_SUFFIXES,
+    iter_archive_members,
+)
+
+# name of the merged index, placed in the archives directory of a dataset
+SEGMENT_INDEX_FILENAME = 'segments.index'
+
+_SEGMENT_NAME = re.compile(
+    r'^archive-(\d{4,})(' + '|'.join(re.escape(s) for s in ARCHIVE_SUFFIXES)
+    + r')$')
+
+
+def segment_name(number, archive_format):
+    """Returns the file name of a segment"""
+    return 'archive-{:04d}.{}'.format(number, archive_format)
+
+
+def segment_number(name):
+    """Returns the number of a segment, or None if `name` isn't one"""
+    match = _SEGMENT_NAME.match(name)
+    return int(match.group(1)) if match else None
+
+
+def list_segments(archive_dir):
+    """Returns the paths of the segments in an archives directory, in order
+    """
+    if not archive_dir.is_dir():
+        return []
+    return sorted(
+        (p for p in archive_dir.iterdir()
+         if segment_number(p.name) is not None),
+        key=lambda p: segment_number(p.name))
+
+
+def next_segment(archive_dir, archive_format):
+    """Returns the path of the segment to write next"""
+    segments = list_segments(archive_dir)
+    number = segment_number(segments[-1].name) + 1 if segments else 1
+    return archive_dir / segment_name(number, archive_format)
+
+
+def index_segment(segment, members=None):
+    """Record the keys of a segment in the merged index
+
+    Parameters
+    ----------
+    segment : Path
+    members : list, optional
+      (path, size) of the members of the segment, if they are known
+      already.
+    """
+    if members is None:
+        members = iter_archive_members(segment)
+    update_key_index(
+        segment.parent / SEGMENT_INDEX_FILENAME,
+        segment.name,
+        [(op.basename(member), 0, size) for member, size in members],
+        stamp=segment.stat().st_size)
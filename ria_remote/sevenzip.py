@@ -0,0 +1,569 @@
+"""Native reader for the headers of 7z archives
+
+A 7z archive consists of a signature header, the packed streams, and a
+header that describes the archive content. Files are stored as sub-streams
+of folders, and a folder is a chain of coders that unpacks one or more
+packed streams. This module parses the header (which is commonly LZMA
+compressed itself) without running 7z, and yields, for each archive
+member, the folder it is stored in and its position within the folder's
+unpacked data.
+
+For folders with the 'Copy' coder only, as created by ``7z -mx0``, the
+unpacked data is the packed stream. The content of their members sits
+verbatim in the archive and can be read from a known offset without
+running 7z. Members of folders that are compressed with LZMA or LZMA2 can
+be unpacked with the lzma module, from just the packed stream of their
+folder.
+
+See DOC/7zFormat.txt in the 7-Zip sources for a description of the format.
+"""
+
+from collections import namedtuple
+import lzma
+import struct
+import zlib
+
+SIGNATURE = b'7z\xbc\xaf\x27\x1c'
+# signature header, pack positions are relative to its end
+_START_HEADER = struct.Struct('<6sBBIQQI')
+
+# property IDs
+_END = 0x00
+_HEADER = 0x01
+_ARCHIVE_PROPERTIES = 0x02
+_ADDITIONAL_STREAMS_INFO = 0x03
+_MAIN_STREAMS_INFO = 0x04
+_FILES_INFO = 0x05
+_PACK_INFO = 0x06
+_UNPACK_INFO = 0x07
+_SUBSTREAMS_INFO = 0x08
+_SIZE = 0x09
+_CRC = 0x0A
+_FOLDER = 0x0B
+_CODERS_UNPACK_SIZE = 0x0C
+_NUM_UNPACK_STREAM = 0x0D
+_EMPTY_STREAM = 0x0E
+_EMPTY_FILE = 0x0F
+_NAME = 0x11
+_ENCODED_HEADER = 0x17
+
+# coder IDs
+COPY = b'\x00'
+_LZMA_FILTERS = {
+    b'\x03\x01\x01': lzma.FILTER_LZMA1,
+    b'\x21': lzma.FILTER_LZMA2,
+    b'\x03': lzma.FILTER_DELTA,
+    b'\x03\x03\x01\x03': lzma.FILTER_X86,
+    b'\x03\x03\x02\x05': lzma.FILTER_POWERPC,
+    b'\x03\x03\x04\x01': lzma.FILTER_IA64,
+    b'\x03\x03\x05\x01': lzma.FILTER_ARM,
+    b'\x03\x03\x07\x01': lzma.FILTER_ARMTHUMB,
+    b'\x03\x03\x08\x05': lzma.FILTER_SPARC,
+}
+
+Coder = namedtuple('Coder', ['method', 'num_in', 'num_out', 'properties'])
+# offset: absolute position of the folder's first packed stream in the
+#         archive
+# packed_size: total size of the folder's packed streams
+# size: size of the folder's unpacked data
+Folder = namedtuple(
+    'Folder', ['coders', 'bind_pairs', 'packed_streams', 'offset',
+               'packed_size', 'size'])
+# folder: index of the folder holding the member's content, None for empty
+#         files
+# offset: position of the member's content in the folder's unpacked data
+Member = namedtuple('Member', ['folder', 'offset', 'size'])
+
+# number of bytes of a packed stream that are read at once when unpacking a
+# single member, and the maximum size of unpacked chunks
+UNPACK_CHUNK_SIZE = 1 << 22
+
+
+class SevenZipError(ValueError):
+    pass
+
+
+class UnsupportedCoderError(SevenZipError):
+    pass
+
+
+class _Buffer(object):
+    """Reading of the primitive types of a 7z header"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n):
+        if self.pos + n > len(self.data):
+            raise SevenZipError("Truncated 7z header")
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def byte(self):
+        return self.read(1)[0]
+
+    def uint32(self):
+        return struct.unpack('<I', self.read(4))[0]
+
+    def number(self):
+        """Variable length integer, the number of leading 1 bits of the
+        first byte is the number of bytes that follow"""
+        first = self.byte()
+        mask = 0x80
+        value = 0
+        for i in range(8):
+            if not first & mask:
+                return value | ((first & (mask - 1)) << (8 * i))
+            value |= self.byte() << (8 * i)
+            mask >>= 1
+        return value
+
+    def bits(self, n):
+        data = self.read((n + 7) // 8)
+        return [bool(data[i // 8] & (0x80 >> (i % 8))) for i in range(n)]
+
+    def defined(self, n):
+        """Bit vector, preceded by an 'all are defined' flag"""
+        return [True] * n if self.byte() else self.bits(n)
+
+    def digests(self, n):
+        defined = self.defined(n)
+        return [self.uint32() if d else None for d in defined]
+
+    def expect(self, prop):
+        found = self.byte()
+        if found != prop:
+            raise SevenZipError(
+                "Unexpected property in 7z header: {:#x} instead of {:#x}"
+                .format(found, prop))
+
+
+def _read_folder(buf):
+    coders = []
+    for i in range(buf.number()):
+        flags = buf.byte()
+        if flags & 0x80:
+            raise SevenZipError("Alternative coder methods are not supported")
+        method = bytes(buf.read(flags & 0x0F))
+        num_in = num_out = 1
+        if flags & 0x10:
+            num_in = buf.number()
+            num_out = buf.number()
+        properties = bytes(buf.read(buf.number())) if flags & 0x20 else b''
+        coders.append(Coder(method, num_in, num_out, properties))
+    total_in = sum(c.num_in for c in coders)
+    total_out = sum(c.num_out for c in coders)
+    bind_pairs = [(buf.number(), buf.number()) for i in range(total_out - 1)]
+    num_packed = total_in - len(bind_pairs)
+    if num_packed == 1:
+        bound = set(i for i, _ in bind_pairs)
+        packed_streams = [i for i in range(total_in) if i not in bound]
+    else:
+        packed_streams = [buf.number() for i in range(num_packed)]
+    return coders, bind_pairs, packed_streams, total_out
+
+
+def _read_streams_info(buf, start):
+    """Parse a StreamsInfo structure
+
+    Returns
+    -------
+    (list, list)
+      Folders, and (folder index, offset, size, crc) of all sub-streams
+    """
+    pack_pos = 0
+    pack_sizes = []
+    raw_folders = []
+    unpack_sizes = []
+    folder_crcs = []
+    substreams = None
+    substream_sizes = None
+    substream_crcs = None
+
+    prop = buf.byte()
+    if prop == _PACK_INFO:
+        pack_pos = buf.number()
+        num_pack_streams = buf.number()
+        prop = buf.byte()
+        while prop != _END:
+            if prop == _SIZE:
+                pack_sizes = [buf.number() for i in range(num_pack_streams)]
+            elif prop == _CRC:
+                buf.digests(num_pack_streams)
+            else:
+                raise SevenZipError("Unexpected property in 7z pack info")
+            prop = buf.byte()
+        prop = buf.byte()
+    if prop == _UNPACK_INFO:
+        buf.expect(_FOLDER)
+        num_folders = buf.number()
+        if buf.byte():
+            raise SevenZipError("External 7z folders are not supported")
+        raw_folders = [_read_folder(buf) for i in range(num_folders)]
+        buf.expect(_CODERS_UNPACK_SIZE)
+        unpack_sizes = [
+            [buf.number() for i in range(f[3])] for f in raw_folders]
+        folder_crcs = [None] * num_folders
+        prop = buf.byte()
+        while prop != _END:
+            if prop == _CRC:
+                folder_crcs = buf.digests(num_folders)
+            else:
+                raise SevenZipError("Unexpected property in 7z unpack info")
+            prop = buf.byte()
+        prop = buf.byte()
+
+    folders = []
+    pack_index = 0
+    offset = start + pack_pos
+    for (coders, bind_pairs, packed_streams, _), sizes in zip(
+            raw_folders, unpack_sizes):
+        packed_size = sum(
+            pack_sizes[pack_index:pack_index + len(packed_streams)])
+        bound_out = set(o for _, o in bind_pairs)
+        main_size = [s for i, s in enumerate(sizes) if i not in bound_out][0]
+        folders.append(Folder(coders, bind_pairs, packed_streams, offset,
+                              packed_size, main_size))
+        pack_index += len(packed_streams)
+        offset += packed_size
+
+    if prop == _SUBSTREAMS_INFO:
+        substreams = [1] * len(folders)
+        prop = buf.byte()
+        if prop == _NUM_UNPACK_STREAM:
+            substreams = [buf.number() for f in folders]
+            prop = buf.byte()
+        substream_sizes = []
+        read_sizes = prop == _SIZE
+        for folder, n in zip(folders, substreams):
+            if not n:
+                continue
+            sizes = [buf.number() for i in range(n - 1)] if read_sizes \
+                else []
+            sizes.append(folder.size - sum(sizes))
+            substream_sizes.append(sizes)
+        if read_sizes:
+            prop = buf.byte()
+        # only sub-streams without a known CRC are listed
+        unknown = sum(
+            n for n, crc in zip(substreams, folder_crcs)
+            if not (n == 1 and crc is not None))
+        substream_crcs = [None] * unknown
+        while prop != _END:
+            if prop == _CRC:
+                substream_crcs = buf.digests(unknown)
+            else:
+                raise SevenZipError(
+                    "Unexpected property in 7z substreams info")
+            prop = buf.byte()
+        prop = buf.byte()
+    if prop != _END:
+        raise SevenZipError("Unexpected property in 7z streams info")
+
+    if substreams is None:
+        # one stream per folder
+        substreams = [1] * len(folders)
+        substream_sizes = [[f.size] for f in folders]
+        substream_crcs = []
+    streams = []
+    crcs = iter(substream_crcs)
+    sizes = iter(substream_sizes)
+    for i, (n, folder_crc) in enumerate(zip(substreams, folder_crcs)):
+        if not n:
+            continue
+        offset = 0
+        for size in next(sizes):
+            crc = folder_crc if n == 1 and folder_crc is not None \
+                else next(crcs, None)
+            streams.append((i, offset, size, crc))
+            offset += size
+    return folders, streams
+
+
+def _coder_filter(coder):
+    """Returns the lzma module filter spec of a coder, None for 'Copy'"""
+    if coder.method == COPY:
+        return None
+    filter_id = _LZMA_FILTERS.get(coder.method)
+    if filter_id is None or coder.num_in != 1 or coder.num_out != 1:
+        raise UnsupportedCoderError(
+            "Unsupported 7z coder: {}".format(coder.method.hex()))
+    props = coder.properties
+    if filter_id == lzma.FILTER_LZMA1:
+        d = props[0]
+        return dict(id=filter_id, lc=d % 9, lp=(d // 9) % 5, pb=d // 45,
+                    dict_size=struct.unpack('<I', props[1:5])[0])
+    if filter_id == lzma.FILTER_LZMA2:
+        bits = props[0] & 0x3F
+        dict_size = 0xFFFFFFFF if bits >= 40 \
+            else (2 | (bits & 1)) << (bits // 2 + 11)
+        return dict(id=filter_id, dict_size=dict_size)
+    if filter_id == lzma.FILTER_DELTA:
+        return dict(id=filter_id, dist=props[0] + 1)
+    return dict(id=filter_id)
+
+
+def folder_filters(folder):
+    """Returns the lzma module filter chain to unpack a folder
+
+    Returns
+    -------
+    list
+      Filter specs in the order they were applied when packing. The list
+      is empty for folders with 'Copy' coders only.
+
+    Raises
+    ------
+    UnsupportedCoderError
+      If the folder can't be unpacked with the lzma module.
+    """
+    if len(folder.packed_streams) != 1:
+        raise UnsupportedCoderError("Unsupported 7z coder chain")
+    # with single-stream coders, input and output stream indices equal
+    # the coder index. Follow the chain from the coder that produces the
+    # folder's data to the one reading the packed stream.
+    bound_out = dict((o, i) for i, o in folder.bind_pairs)
+    coder = [i for i in range(len(folder.coders)) if i not in bound_out]
+    filters = []
+    while True:
+        if len(coder) != 1:
+            raise UnsupportedCoderError("Unsupported 7z coder chain")
+        spec = _coder_filter(folder.coders[coder[0]])
+        if spec is not None:
+            filters.append(spec)
+        if coder[0] == folder.packed_streams[0]:
+            break
+        coder = [o for i, o in folder.bind_pairs if i == coder[0]]
+    if filters and filters[-1]['id'] not in (
+            lzma.FILTER_LZMA1, lzma.FILTER_LZMA2):
+        raise UnsupportedCoderError("Unsupported 7z coder chain")
+    return filters
+
+
+def is_stored(folder):
+    """Whether a folder's packed stream is its unpacked data"""
+    return all(c.method == COPY for c in folder.coders) \
+        and len(folder.packed_streams) == 1
+
+
+def unpack_folder(folder, data):
+    """Unpack the packed stream of a folder"""
+    filters = folder_filters(folder)
+    if filters:
+        data = lzma.LZMADecompressor(
+            format=lzma.FORMAT_RAW, filters=filters).decompress(data)
+    if len(data) < folder.size:
+        raise SevenZipError("Truncated 7z folder")
+    return data[:folder.size]
+
+
+def iter_unpacked(folder, read, chunk_size=UNPACK_CHUNK_SIZE):
+    """Unpack the packed stream of a folder incrementally
+
+    Parameters
+    ----------
+    folder : Folder
+    read : callable
+      Called with an offset and a length, must return that many bytes of
+      the archive starting at the offset.
+    chunk_size : int
+      Number of packed bytes to read at once, and maximum size of a yielded
+      chunk of unpacked data.
+
+    Yields
+    ------
+    bytes
+      Consecutive chunks of the folder's unpacked data. The packed stream
+      is read no further than the consumer asks for unpacked data.
+    """
+    filters = folder_filters(folder)
+    decompressor = lzma.LZMADecompressor(
+        format=lzma.FORMAT_RAW, filters=filters) if filters else None
+    packed = 0
+    unpacked = 0
+    while unpacked < folder.size:
+        if decompressor is not None and decompressor.eof:
+            raise SevenZipError("Truncated 7z folder")
+        if decompressor is None or decompressor.needs_input:
+            if packed >= folder.packed_size:
+                raise SevenZipError("Truncated 7z folder")
+            length = min(chunk_size, folder.packed_size - packed)
+            data = read(folder.offset + packed, length)
+            packed += length
+        else:
+            # output is pending from the previous input
+            data = b''
+        if decompressor is not None:
+            data = decompressor.decompress(data, max_length=chunk_size)
+        data = data[:folder.size - unpacked]
+        unpacked += len(data)
+        if data:
+            yield data
+
+
+def unpack_member(folder, member, read, out, chunk_size=UNPACK_CHUNK_SIZE):
+    """Unpack the content of a member from the packed stream of its folder
+
+    Only the part of the packed stream that precedes the end of the member
+    is read, and only a chunk of unpacked data is held in memory at a time.
+
+    Parameters
+    ----------
+    folder : Folder
+    member : Member
+    read : callable
+      See `iter_unpacked()`.
+    out : file object
+      The member's content is written to it.
+    chunk_size : int
+      See `iter_unpacked()`.
+    """
+    start = member.offset
+    end = member.offset + member.size
+    if start == end:
+        return
+    pos = 0
+    for chunk in iter_unpacked(folder, read, chunk_size):
+        if pos + len(chunk) > start:
+            out.write(chunk[max(0, start - pos):end - pos])
+        pos += len(chunk)
+        if pos >= end:
+            return
+    raise SevenZipError("Truncated 7z folder")
+
+
+class SevenZipIndex(object):
+    """Member table of a 7z archive
+
+    The archive is read via a callable, so that it can be used for local
+    archives as well as for archives on a remote host.
+    """
+
+    def __init__(self, read):
+        """
+        Parameters
+        ----------
+        read : callable
+          Called with an offset and a length, must return that many bytes
+          of the archive starting at the offset.
+        """
+        self.folders = []
+        self.members = dict()
+        # size of the archive, 7z writes the header at its end
+        self.size = None
+        self._parse(read)
+
+    def _parse(self, read):
+        start = read(0, _START_HEADER.size)
+        if len(start) < _START_HEADER.size:
+            raise SevenZipError("Not a 7z archive")
+        (signature, major, minor, start_crc, next_offset, next_size,
+         next_crc) = _START_HEADER.unpack(start)
+        if signature != SIGNATURE:
+            raise SevenZipError("Not a 7z archive")
+        # the CRC covers the location of the next header
+        if zlib.crc32(start[12:]) != start_crc:
+            raise SevenZipError("7z start header CRC mismatch")
+        self.size = _START_HEADER.size + next_offset + next_size
+        if not next_size:
+            # empty archive
+            return
+        data = read(_START_HEADER.size + next_offset, next_size)
+        if zlib.crc32(data) != next_crc:
+            raise SevenZipError("7z header CRC mismatch")
+        buf = _Buffer(data)
+        prop = buf.byte()
+        while prop == _ENCODED_HEADER:
+            # the actual header is packed like archive content
+            folders, streams = _read_streams_info(buf, _START_HEADER.size)
+            data = b''.join(
+                unpack_folder(f, read(f.offset, f.packed_size))
+                for f in folders)
+            buf = _Buffer(data)
+            prop = buf.byte()
+        if prop != _HEADER:
+            raise SevenZipError("Invalid 7z header")
+        self._read_header(buf)
+
+    def _read_header(self, buf):
+        streams = []
+        prop = buf.byte()
+        if prop == _ARCHIVE_PROPERTIES:
+            while buf.byte() != _END:
+                buf.read(buf.number())
+            prop = buf.byte()
+        if prop == _ADDITIONAL_STREAMS_INFO:
+            _read_streams_info(buf, _START_HEADER.size)
+            prop = buf.byte()
+        if prop == _MAIN_STREAMS_INFO:
+            self.folders, streams = _read_streams_info(
+                buf, _START_HEADER.size)
+            prop = buf.byte()
+        if prop == _FILES_INFO:
+            self._read_files_info(buf, streams)
+            prop = buf.byte()
+        if prop != _END:
+            raise SevenZipError("Unexpected property in 7z header")
+
+    def _read_files_info(self, buf, streams):
+        num_files = buf.number()
+        empty_stream = [False] * num_files
+        empty_file = []
+        names = []
+        while True:
+            prop = buf.byte()
+            if prop == _END:
+                break
+            size = buf.number()
+            if prop == _EMPTY_STREAM:
+                empty_stream = buf.bits(num_files)
+            elif prop == _EMPTY_FILE:
+                empty_file = buf.bits(sum(empty_stream))
+            elif prop == _NAME:
+                data = _Buffer(buf.read(size))
+                if data.byte():
+                    raise SevenZipError("External 7z names are not supported")
+                names = bytes(data.data[1:]).decode('utf-16-le').split('\0')
+            else:
+                buf.read(size)
+        if len(names) < num_files:
+            raise SevenZipError("7z header lacks file names")
+        streams = iter(streams)
+        empty_index = 0
+        for i in range(num_files):
+            name = names[i].replace('\\', '/')
+            if not empty_stream[i]:
+                folder, offset, size, _ = next(streams)
+                self.members[name] = Member(folder, offset, size)
+                continue
+            if empty_index < len(empty_file) and empty_file[empty_index]:
+                self.members[name] = Member(None, 0, 0)
+            # otherwise a directory
+            empty_index += 1
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def locate(self, name):
+        """Returns the position of a member's content in the archive
+
+        Returns
+        -------
+        (int, int) or None
+          Offset and size, or None if the member's content isn't stored
+          verbatim.
+
+        Raises
+        ------
+        KeyError
+          If there is no such member.
+        """
+        member = self.members[name]
+        if member.folder is None:
+            return 0, 0
+        folder = self.folders[member.folder]
+        if not is_stored(folder):
+            return None
+        return folder.offset + member.offset, member.size
@@ -0,0 +1,251 @@
+"""Store-wide index of the keys held by the datasets in a RIA store
+
+The index is an SQLite database at the root of a store. It is optional:
+clients maintain it whenever it exists, and `ria-rebuild-index` creates
+or regenerates it from the content of the store. Only commands that write
+the index create its tables, clients merely opening it take no lock.
+
+Each record states that a dataset holds a key at a particular location,
+which is either 'loose' (annex object tree of the dataset) or the path
+of an archive relative to the dataset directory, plus the archive member.
+Archives shared by the datasets of a store (see `ria-pack-store`) are
+recorded with their path relative to the base path of the store.
+"""
+
+import logging
+import sqlite3
+from shlex import quote as sh_quote
+from urllib.parse import quote
+
+lgr = logging.getLogger('ria_remote.store_index')
+
+# name of the index database file, placed at the base path of a store
+STORE_INDEX_FILENAME = 'ria-store-index.sqlite'
+
+# location label of keys in a dataset's annex object tree
+LOOSE = 'loose'
+
+# milliseconds to wait for a lock held by another client
+BUSY_TIMEOUT = 30000
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS keys ("
+    "key TEXT NOT NULL, "
+    "dsid TEXT NOT NULL, "
+    "location TEXT NOT NULL, "
+    "member TEXT, "
+    "size INTEGER, "
+    "PRIMARY KEY (dsid, key, location))",
+    "CREATE INDEX IF NOT EXISTS keys_by_key ON keys (key)",
+]
+
+
+class StoreIndex(object):
+    """Access to a store index via Python's sqlite3 module"""
+
+    def __init__(self, path, readonly=False):
+        """
+        Parameters
+        ----------
+        path : Path
+          Location of the index database. It is created if it does not
+          exist yet, unless `readonly` is set.
+        readonly : bool, optional
+          Open the database for queries only.
+        """
+        self.path = path
+        self._db = sqlite3.connect(
+            'file:{}{}'.format(
+                quote(str(path)), '?mode=ro' if readonly else ''),
+            uri=True,
+            timeout=BUSY_TIMEOUT / 1000,
+            # we handle transactions explicitly
+            isolation_level=None,
+        )
+
+    def close(self):
+        self._db.close()
+
+    def create_tables(self):
+        """Create the tables of the index, if they don't exist yet"""
+        self._transaction(_SCHEMA)
+
+    def has_tables(self):
+        """Returns whether the tables of the index exist"""
+        return bool(self._query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            ('keys',)))
+
+    def _query(self, sql, params=()):
+        return self._db.execute(sql, params).fetchall()
+
+    def _transaction(self, statements):
+        """Execute all (sql, params) or sql statements, or none"""
+        cur = self._db.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            for s in statements:
+                sql, params = (s, ()) if isinstance(s, str) else s
+                cur.execute(sql, params)
+        except Exception:
+            cur.execute('ROLLBACK')
+            raise
+        cur.execute('COMMIT')
+
+    def record(self, dsid, key, location=LOOSE, member=None, size=None):
+        """Record that a dataset holds a key at a location"""
+        self._transaction([_insert(dsid, key, location, member, size)])
+
+    def drop(self, dsid, key, location=LOOSE):
+        """Record that a dataset no longer holds a key at a location"""
+        self._transaction([(
+            "DELETE FROM keys WHERE dsid=? AND key=? AND location=?",
+            (dsid, key, location))])
+
+    def drop_keys(self, dsid, keys, location=LOOSE):
+        """Like `drop`, for any number of keys at once"""
+        self._transaction([(
+            "DELETE FROM keys WHERE dsid=? AND key=? AND location=?",
+            (dsid, key, location)) for key in keys])
+
+    def replace(self, dsid, records, location=None):
+        """Replace the records of a dataset
+
+        Parameters
+        ----------
+        dsid : str
+        records : iterable
+          (key, location, member, size) tuples
+        location : str, optional
+          If given, only records for this location are replaced.
+        """
+        if location is None:
+            statements = [("DELETE FROM keys WHERE dsid=?", (dsid,))]
+        else:
+            statements = [(
+                "DELETE FROM keys WHERE dsid=? AND location=?",
+                (dsid, location))]
+        statements.extend(
+            _insert(dsid, key, loc, member, size)
+            for key, loc, member, size in records)
+        self._transaction(statements)
+
+    def locate(self, dsid, key):
+        """Returns a list of (location, member) holding a key for a dataset"""
+        return [
+            (loc, member) for loc, member in self._query(
+                "SELECT location, member FROM keys WHERE dsid=? AND key=?",
+                (dsid, key))
+        ]
+
+    def find(self, key):
+        """Returns a list of (dsid, location, member, size) holding a key"""
+        return [r[:3] + (_int(r[3]),) for r in self._query(
+            "SELECT dsid, location, member, size FROM keys WHERE key=?",
+            (key,))]
+
+    def archived(self, dsid):
+        """Returns the set of keys a dataset holds anywhere but loose"""
+        return set(r[0] for r in self._query(
+            "SELECT DISTINCT key FROM keys WHERE dsid=? AND location!=?",
+            (dsid, LOOSE)))
+
+    def keys(self, dsid):
+        """Returns a list of (key, location, member, size) of a dataset"""
+        return [r[:3] + (_int(r[3]),) for r in self._query(
+            "SELECT key, location, member, size FROM keys WHERE dsid=? "
+            "ORDER BY key", (dsid,))]
+
+    def datasets(self):
+        """Returns the IDs of all datasets with records in the index"""
+        return [r[0] for r in self._query("SELECT DISTINCT dsid FROM keys")]
+
+    def forget(self, dsid):
+        """Remove all records of a dataset"""
+        self._transaction([("DELETE FROM keys WHERE dsid=?", (dsid,))])
+
+
+class RemoteStoreIndex(StoreIndex):
+    """Access to a store index via the sqlite3 executable on a remote host
+
+    Parameters are inlined as SQL literals, since the command line tool
+    offers no parameter binding. The tool is run with `-bail`, such that a
+    failing statement aborts it (and a transaction is never committed
+    partially) with a non-zero exit status.
+    """
+
+    def __init__(self, path, run, readonly=False):
+        """
+        Parameters
+        ----------
+        path : Path
+          Location of the index database on the remote host.
+        run : callable
+          Called with a shell command, must return the command's output
+          and raise if the command exits with a non-zero status (see
+          `SSHRemoteIO._run` with `check=True`).
+        readonly : bool, optional
+          Open the database for queries only.
+        """
+        self.path = path
+        self._run = run
+        self._readonly = readonly
+
+    def close(self):
+        pass
+
+    def _sqlite(self, sql):
+        # error messages go to stdout, to be part of the raised error
+        return self._run(
+            "sqlite3 -batch -bail{} -separator '\t' -cmd '.timeout {}' "
+            "{} {} 2>&1".format(
+                ' -readonly' if self._readonly else '',
+                BUSY_TIMEOUT,
+                sh_quote(str(self.path)),
+                sh_quote(sql)))
+
+    def _query(self, sql, params=()):
+        out = self._sqlite(_inline(sql, params))
+        return [
+            tuple(None if v == '' else v for v in line.split('\t'))
+            for line in out.splitlines()
+        ]
+
+    def _transaction(self, statements):
+        sql = ['BEGIN IMMEDIATE;']
+        for s in statements:
+            sql.append(_inline(*((s, ()) if isinstance(s, str) else s)) + ';')
+        sql.append('COMMIT;')
+        self._sqlite(' '.join(sql))
+
+
+def _insert(dsid, key, location, member, size):
+    return (
+        "INSERT OR REPLACE INTO keys (key, dsid, location, member, size) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (key, dsid, location, member, size))
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def _sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, int):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def _inline(sql, params):
+    """Replace '?' placeholders in `sql` with SQL literals of `params`"""
+    parts = sql.split('?')
+    if len(parts) != len(params) + 1:
+        raise ValueError(
+            "Parameter count mismatch for SQL statement: {}".format(sql))
+    out = [parts[0]]
+    for value, part in zip(params, parts[1:]):
+        out.append(_sql_literal(value))
+        out.append(part)
+    return ''.join(out)
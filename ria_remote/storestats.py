@@ -0,0 +1,111 @@
+"""Measured latency and throughput of RIA stores, for reporting a cost
+
+git-annex retrieves a key from the remote with the lowest cost that has it.
+Rather than a fixed cost for local and SSH-based stores, a RIA remote can
+report a cost derived from its own transfers to and from a store. Remotes
+on a machine share the measurements per store, in a JSON file in the
+machine-local state directory of RIA remotes.
+
+Transfers of small keys are dominated by latency, those of large keys by
+throughput. Both are tracked as exponentially weighted moving averages,
+and the cost reflects the estimated time to transfer a key of a reference
+size.
+"""
+
+from hashlib import md5
+import json
+import math
+import os
+import tempfile
+
+from ria_remote.utils import get_cache_dir
+
+# transfers of at most this many bytes update the latency
+LATENCY_SAMPLE_SIZE = 1 << 16
+
+# transfers of at least this many bytes update the throughput
+THROUGHPUT_SAMPLE_SIZE = 1 << 20
+
+# weight of a new measurement in the moving averages
+SAMPLE_WEIGHT = 0.2
+
+# size of a key whose transfer time determines the cost
+REFERENCE_SIZE = 1 << 20
+
+# the cost grows with the logarithm of the time to transfer a key of the
+# reference size, in units of this many seconds
+COST_TIME_UNIT = 0.01
+COST_PER_DOUBLING = 25
+
+# bounds of a reported cost; 100 is git-annex' cost of cheap remotes
+MIN_COST = 100
+MAX_COST = 400
+
+
+def get_stats_path(host, base_path):
+    """Returns the default location of the measurements of a store"""
+    store = '{}:{}'.format(host or '', base_path)
+    return get_cache_dir() / 'stats' / '{}.json'.format(
+        md5(store.encode()).hexdigest())
+
+
+class StoreStats(object):
+    """Moving averages of the latency and throughput of a store"""
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : Path
+          JSON file with the measurements, created as needed.
+        """
+        self.path = path
+        try:
+            stats = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            stats = {}
+        # seconds
+        self.latency = stats.get('latency')
+        # bytes per second
+        self.throughput = stats.get('throughput')
+
+    def record(self, nbytes, duration):
+        """Account for a transfer, and save the measurements"""
+        if nbytes is None or duration <= 0:
+            return
+        if nbytes <= LATENCY_SAMPLE_SIZE:
+            self.latency = _average(self.latency, duration)
+        elif nbytes >= THROUGHPUT_SAMPLE_SIZE:
+            self.throughput = _average(self.throughput, nbytes / duration)
+        else:
+            return
+        self.save()
+
+    def save(self):
+        """Write the measurements, replacing the file atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(latency=self.latency, throughput=self.throughput), f)
+        os.replace(tmp_path, str(self.path))
+
+    def estimate(self, nbytes):
+        """Returns the estimated seconds to transfer a key, or None"""
+        if self.latency is None and self.throughput is None:
+            return None
+        return (self.latency or 0) + \
+            (nbytes / self.throughput if self.throughput else 0)
+
+    def get_cost(self, default):
+        """Returns the cost of the store, `default` without measurements"""
+        seconds = self.estimate(REFERENCE_SIZE)
+        if seconds is None:
+            return default
+        cost = MIN_COST + COST_PER_DOUBLING * math.log2(
+            1 + seconds / COST_TIME_UNIT)
+        return int(min(MAX_COST, max(MIN_COST, round(cost))))
+
+
+def _average(average, sample):
+    return sample if average is None \
+        else (1 - SAMPLE_WEIGHT) * average + SAMPLE_WEIGHT * sample
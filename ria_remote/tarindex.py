@@ -0,0 +1,161 @@
+"""Uncompressed tar archives with a sidecar index of member positions
+
+The content of the members of an uncompressed tar archive sits verbatim in
+the archive. A sidecar file next to the archive (``archive.tar.index`` for
+``archive.tar``) records the position of each member's content, such that
+members can be read from the archive by byte range, without any tool that
+understands the tar format.
+
+The sidecar is a key index (see `ria_remote.keyindex`) of member paths
+(rather than keys), with the archive's file name as the only location. Its
+stamp allows for detecting an archive that was modified after the index
+was written.
+"""
+
+from hashlib import md5
+import struct
+import tarfile
+
+from ria_remote.keyindex import write_key_index
+
+TAR_INDEX_SUFFIX = '.index'
+
+
+def tar_index_path(archive):
+    """Returns the path of the sidecar index of an archive"""
+    return archive.with_name(archive.name + TAR_INDEX_SUFFIX)
+
+
+def tar_stamp(read, size):
+    """Returns a value that changes whenever a tar archive is modified
+
+    The size of a tar archive is a multiple of its record size, and often
+    stays the same when members are appended. Hence, the content of the
+    last record is considered in addition.
+
+    Parameters
+    ----------
+    read : callable
+      Called with an offset and a length, must return that many bytes of
+      the archive starting at the offset.
+    size : int
+      Size of the archive.
+    """
+    tail = read(max(0, size - tarfile.RECORDSIZE),
+                min(size, tarfile.RECORDSIZE))
+    digest = md5(str(size).encode() + tail).digest()
+    return struct.unpack('<Q', digest[:8])[0]
+
+
+def iter_tar_entries(archive):
+    """Yield the files contained in a tar archive
+
+    Parameters
+    ----------
+    archive : Path
+      Local, uncompressed tar archive.
+
+    Yields
+    ------
+    str, int, int
+      Path of a member relative to the root of the archive, the position
+      of its content in the archive, and its size.
+    """
+    with tarfile.open(str(archive), 'r:') as tf:
+        for info in tf:
+            if info.isfile():
+                yield info.name, info.offset_data, info.size
+
+
+def write_tar_index(archive):
+    """(Re)write the sidecar index of a tar archive"""
+    with open(str(archive), 'rb') as f:
+        def read(offset, length):
+            f.seek(offset)
+            return f.read(length)
+        stamp = tar_stamp(read, archive.stat().st_size)
+    write_key_index(
+        tar_index_path(archive),
+        ((name, archive.name, offset, size)
+         for name, offset, size in iter_tar_entries(archive)),
+        stamps={archive.name: stamp})
+
+
+class TarIndex(object):
+    """Positions of the content of the members of a tar archive"""
+
+    def __init__(self, members=None, key_index=None, location=None):
+        """
+        Parameters
+        ----------
+        members : dict, optional
+          Mapping of member paths to (offset, size).
+        key_index : KeyIndex, optional
+          Sidecar index to look up members in, instead of `members`.
+        location : str, optional
+          Location of the archive in `key_index`.
+        """
+        self._members = members
+        self._key_index = key_index
+        self._location = location
+
+    @classmethod
+    def from_archive(cls, archive):
+        """Read the member positions from a local archive itself"""
+        return cls(members=dict(
+            (name, (offset, size))
+            for name, offset, size in iter_tar_entries(archive)))
+
+    @classmethod
+    def from_sidecar(cls, key_index, archive_name, stamp):
+        """Use a sidecar index
+
+        Parameters
+        ----------
+        key_index : KeyIndex
+          The opened sidecar index.
+        archive_name : str
+        stamp : int
+          `tar_stamp` of the archive in its current state.
+
+        Returns
+        -------
+        TarIndex or None
+          None, if the index doesn't describe the archive in its current
+          state.
+        """
+        if key_index.locations.get(archive_name) != stamp:
+            key_index.close()
+            return None
+        return cls(key_index=key_index, location=archive_name)
+
+    def close(self):
+        if self._key_index is not None:
+            self._key_index.close()
+
+    def __contains__(self, name):
+        try:
+            self.locate(name)
+            return True
+        except KeyError:
+            return False
+
+    def locate(self, name):
+        """Returns the position of a member's content in the archive
+
+        Returns
+        -------
+        (int, int)
+          Offset and size.
+
+        Raises
+        ------
+        KeyError
+          If there is no such member.
+        """
+        if self._key_index is None:
+            return self._members[name]
+        for entry in self._key_index.lookup(name):
+            if entry.location == self._location:
+                return entry.offset, entry.size
+        raise KeyError(name)
@@ -1,10 +1,16 @@
+import os.path as op
 from pathlib import Path
 import shutil
 import subprocess
 import logging
+import zipfile
 from datalad.interface.results import annexjson2result
 from datalad.api import (
     create,
+    ria_pack_dataset,
+    ria_pack_store,
+    ria_rebuild_index,
+    ria_repack_archive,
 )
 
 from datalad.utils import (
@@ -13,15 +19,29 @@ from datalad.utils import (
 from datalad.tests.utils import (
     with_tempfile,
     assert_repo_status,
+    assert_result_count,
     assert_status,
     eq_,
     assert_raises
 )
 
 from datalad.support.exceptions import (
+    CommandError,
     IncompleteResultsError
 )
 
+from ria_remote.export_archive import (
+    _export_tar,
+    _export_zip,
+    _update_store_indices,
+)
+from ria_remote.bloom import (
+    BloomFilter,
+    write_bloom_filter,
+)
+from ria_remote.keyindex import KeyIndex
+from ria_remote.store_index import StoreIndex
+from ria_remote.tarindex import tar_index_path
 from ria_remote.tests.utils import (
     initremote,
     initexternalremote,
@@ -29,6 +49,10 @@ from ria_remote.tests.utils import (
     populate_dataset,
     get_all_files,
 )
+from ria_remote.utils import (
+    iter_archive_members,
+    iter_loose_keys,
+)
 
 
 @with_tempfile(mkdir=True)
@@ -72,6 +96,339 @@ def test_archive_layout(path, objtree, archivremote):
     eq_(len(ds.repo.whereis('one.txt')), len(whereis) + 1)
 
 
+@with_tempfile(mkdir=True)
+@with_tempfile()
+@with_tempfile()
+def test_zip_archive(path, objtree, archivremote):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+
+    whereis = ds.repo.whereis('one.txt')
+    targetpath = Path(archivremote) / ds.id[:3] / ds.id[3:] / 'archives'
+    targetpath.mkdir(parents=True)
+    assert_status(
+        'ok', ds.ria_export_archive(str(targetpath), archive_format='zip'))
+    assert (targetpath / 'archive.zip').exists()
+    initexternalremote(ds.repo, 'zip', 'ria', config={'base-path': archivremote})
+    ds.repo.fsck(remote='zip', fast=True)
+    eq_(len(ds.repo.whereis('one.txt')), len(whereis) + 1)
+    # content can be retrieved from the archive alone
+    shutil.rmtree(objtree)
+    ds.repo.fsck(remote='archive', fast=True)
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+@with_tempfile()
+def test_tar_archive(path, objtree, archivremote):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+
+    whereis = ds.repo.whereis('one.txt')
+    targetpath = Path(archivremote) / ds.id[:3] / ds.id[3:] / 'archives'
+    targetpath.mkdir(parents=True)
+    assert_status(
+        'ok', ds.ria_export_archive(str(targetpath), archive_format='tar'))
+    assert (targetpath / 'archive.tar').exists()
+    assert (targetpath / 'archive.tar.index').exists()
+    initexternalremote(ds.repo, 'tar', 'ria', config={'base-path': archivremote})
+    ds.repo.fsck(remote='tar', fast=True)
+    eq_(len(ds.repo.whereis('one.txt')), len(whereis) + 1)
+    # content can be retrieved from the archive alone
+    shutil.rmtree(objtree)
+    ds.repo.fsck(remote='archive', fast=True)
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+@with_tempfile()
+def test_incremental_archive(path, objtree, archivremote):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+
+    targetpath = Path(archivremote) / ds.id[:3] / ds.id[3:] / 'archives'
+    targetpath.mkdir(parents=True)
+    assert_status(
+        'ok',
+        ds.ria_export_archive(str(targetpath), incremental=True))
+    assert (targetpath / 'archive-0001.7z').exists()
+    # nothing new to archive
+    assert_status(
+        'notneeded',
+        ds.ria_export_archive(str(targetpath), incremental=True))
+
+    # new keys go into a new segment
+    (ds.pathobj / 'new.txt').write_text('new content')
+    ds.save()
+    ds.repo.copy_to('new.txt', 'archive')
+    assert_status(
+        'ok',
+        ds.ria_export_archive(str(targetpath), incremental=True))
+    assert (targetpath / 'archive-0002.7z').exists()
+    assert (targetpath / 'segments.index').exists()
+
+    initexternalremote(ds.repo, 'segments', 'ria',
+                       config={'base-path': archivremote})
+    ds.repo.fsck(remote='segments', fast=True)
+    # content can be retrieved from the segments alone
+    shutil.rmtree(objtree)
+    ds.repo.fsck(remote='archive', fast=True)
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+@with_tempfile()
+def test_sharded_archive(path, objtree, archivremote):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+
+    targetpath = Path(archivremote) / ds.id[:3] / ds.id[3:] / 'archives'
+    targetpath.mkdir(parents=True)
+    assert_status(
+        'ok',
+        ds.ria_export_archive(
+            str(targetpath), archive_format='tar', shard_prefix=1))
+    assert (targetpath / 'ria-archive-shards').exists()
+    assert_status(
+        'notneeded',
+        ds.ria_export_archive(
+            str(targetpath), archive_format='tar', shard_prefix=1))
+    # a dataset can't be sharded in two ways
+    assert_status(
+        'impossible',
+        ds.ria_export_archive(
+            str(targetpath), archive_format='tar', shard_prefix=2,
+            on_failure='ignore'))
+    # keys of a previous archive must not become unreachable
+    otherpath = Path(archivremote) / 'other' / 'archives'
+    otherpath.mkdir(parents=True)
+    with zipfile.ZipFile(str(otherpath / 'archive.zip'), 'w') as zf:
+        zf.writestr('ab/cd/OTHER/OTHER', 'content')
+    assert_status(
+        'impossible',
+        ds.ria_export_archive(
+            str(otherpath), archive_format='tar', shard_prefix=1,
+            on_failure='ignore'))
+    eq_(sorted(p.name for p in otherpath.iterdir()), ['archive.zip'])
+
+    initexternalremote(ds.repo, 'shards', 'ria',
+                       config={'base-path': archivremote})
+    ds.repo.fsck(remote='shards', fast=True)
+    # content can be retrieved from the shards alone
+    shutil.rmtree(objtree)
+    ds.repo.fsck(remote='archive', fast=True)
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+
+
+@with_tempfile(mkdir=True)
+def test_export_interrupted(path):
+    path = Path(path)
+    keypaths = []
+    for key in ('KEY1', 'KEY2'):
+        keypath = path / 'objects' / 'ab' / 'cd' / key / key
+        keypath.parent.mkdir(parents=True)
+        keypath.write_text(key)
+        keypaths.append(keypath)
+    missing = path / 'objects' / 'ab' / 'cd' / 'KEY3' / 'KEY3'
+    archive = path / 'archives' / 'archive.zip'
+    archive.parent.mkdir()
+    _export_zip(archive, keypaths[:1], ['-mx0'])
+    content = archive.read_bytes()
+    # a failing update leaves the archive as it was
+    assert_raises(
+        FileNotFoundError,
+        _export_zip, archive, [keypaths[1], missing], ['-mx0'])
+    eq_(archive.read_bytes(), content)
+    eq_([p.name for p in archive.parent.iterdir()], ['archive.zip'])
+    _export_zip(archive, keypaths, ['-mx0'])
+    eq_(sorted(m for m, _ in iter_archive_members(archive)),
+        ['ab/cd/KEY1/KEY1', 'ab/cd/KEY2/KEY2'])
+
+    archive = archive.with_name('archive.tar')
+    _export_tar(archive, keypaths[:1])
+    content = archive.read_bytes()
+    index = tar_index_path(archive).read_bytes()
+    assert_raises(
+        FileNotFoundError, _export_tar, archive, [keypaths[1], missing])
+    eq_(archive.read_bytes(), content)
+    eq_(tar_index_path(archive).read_bytes(), index)
+    eq_(sorted(p.name for p in archive.parent.iterdir()),
+        ['archive.tar', 'archive.tar.index', 'archive.zip'])
+    _export_tar(archive, keypaths)
+    eq_(sorted(m for m, _ in iter_archive_members(archive)),
+        ['ab/cd/KEY1/KEY1', 'ab/cd/KEY2/KEY2'])
+    with KeyIndex(tar_index_path(archive)) as sidecar:
+        eq_(len(sidecar), 2)
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile(mkdir=True)
+def test_update_store_indices(base_path, root):
+    base_path = Path(base_path)
+    (base_path / 'ria-layout-version').write_text('2\n')
+    index = StoreIndex(base_path / 'ria-store-index.sqlite')
+    index.create_tables()
+    for top, dsid, indexed in ((base_path, 'abc1', True),
+                               (Path(root), 'def2', False)):
+        dsdir = top / dsid[:3] / dsid[3:]
+        (dsdir / 'archives').mkdir(parents=True)
+        (dsdir / 'ria-layout-version').write_text('1\n')
+        archive = dsdir / 'archives' / 'archive.zip'
+        with zipfile.ZipFile(str(archive), 'w') as zf:
+            zf.writestr('ab/cd/KEY/KEY', 'content')
+        # the store of a dataset in another root is unknown
+        eq_(_update_store_indices(archive, dsid), indexed)
+        with KeyIndex(dsdir / 'ria-key-index') as key_index:
+            eq_(key_index.lookup('KEY')[0].location, 'archives/archive.zip')
+        eq_(len(index.keys(dsid)), int(indexed))
+    index.close()
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+def test_pack_store(path, objtree):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+
+    # packing relies on the store index
+    assert_status(
+        'impossible', ria_pack_store(objtree, on_failure='ignore'))
+    assert_status('ok', ria_rebuild_index(objtree))
+    dsdir = Path(objtree) / ds.id[:3] / ds.id[3:]
+    # a filter that lacks the keys, like ones stored by clients that don't
+    # maintain its journal
+    write_bloom_filter(
+        dsdir / 'ria-bloom-filter', BloomFilter.for_capacity(100))
+    # too many keys
+    assert_result_count(ria_pack_store(objtree, max_keys=1), 0)
+    assert_status('ok', ria_pack_store(objtree))
+    assert (Path(objtree) / 'ria-packs' / 'pack-0001.tar').exists()
+    eq_(list(iter_loose_keys(dsdir / 'annex' / 'objects')), [])
+
+    # content can be retrieved from the pack
+    assert_status(
+        'ok',
+        [annexjson2result(r, ds)
+         for r in ds.repo.fsck(remote='archive', fast=True)])
+    # but not removed from it
+    whereis = ds.repo.whereis('one.txt')
+    with swallow_logs(new_level=logging.ERROR):
+        assert_raises(
+            CommandError,
+            ds.repo._run_annex_command,
+            'drop',
+            annex_options=['--from', 'archive', '--force', 'one.txt'])
+    eq_(ds.repo.whereis('one.txt'), whereis)
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+    # and still after the index is rebuilt
+    assert_status('ok', ria_rebuild_index(objtree))
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+def test_pack_dataset(path, objtree):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+
+    assert_status('ok', ria_pack_dataset(objtree, ds.id))
+    dsdir = Path(objtree) / ds.id[:3] / ds.id[3:]
+    assert (dsdir / 'archives' / 'archive.7z').exists()
+    eq_(list(iter_loose_keys(dsdir / 'annex' / 'objects')), [])
+    # nothing to add to an existing archive
+    assert_status(
+        'impossible', ria_pack_dataset(objtree, ds.id, on_failure='ignore'))
+
+    # content can be retrieved from the archive
+    ds.repo.fsck(remote='archive', fast=True)
+    ds.drop('.')
+    assert_status('ok', ds.get('.'))
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+def test_pack_dataset_bloom_filter(path, objtree):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('.', 'archive')
+    dsdir = Path(objtree) / ds.id[:3] / ds.id[3:]
+    # a filter that lacks the keys, like ones stored by clients that don't
+    # maintain its journal
+    write_bloom_filter(
+        dsdir / 'ria-bloom-filter', BloomFilter.for_capacity(100))
+
+    assert_status('ok', ria_pack_dataset(objtree, ds.id))
+    keys = [op.basename(m) for m, _ in
+            iter_archive_members(dsdir / 'archives' / 'archive.7z')]
+    with KeyIndex(dsdir / 'ria-key-index') as index:
+        for key in keys:
+            eq_([e.location for e in index.lookup(key)],
+                ['archives/archive.7z'])
+    assert_status(
+        'ok',
+        [annexjson2result(r, ds)
+         for r in ds.repo.fsck(remote='archive', fast=True)])
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile()
+@with_tempfile()
+def test_repack_archive(path, objtree, keep):
+    ds = create(path)
+    setup_archive_remote(ds.repo, objtree)
+    populate_dataset(ds)
+    ds.save()
+    ds.repo.copy_to('one.txt', 'archive')
+    dsdir = Path(objtree) / ds.id[:3] / ds.id[3:]
+    assert_status(
+        'ok', ds.ria_export_archive(str(dsdir / 'archives'), incremental=True))
+    ds.repo.copy_to('.', 'archive')
+
+    # keep everything but one.txt
+    two = ds.repo.get_file_key(op.join('subdir', 'two'))
+    Path(keep).write_text(two + '\n')
+    res = ria_repack_archive(objtree, ds.id, keep=keep, dry_run=True)
+    assert_result_count(res, 1, status='ok', keys=1, dropped_keys=1)
+    assert (dsdir / 'archives' / 'archive-0001.7z').exists()
+
+    assert_status('ok', ria_repack_archive(objtree, ds.id, keep=keep))
+    archive = dsdir / 'archives' / 'archive.7z'
+    eq_(sorted(p.name for p in archive.parent.iterdir()), ['archive.7z'])
+    eq_([op.basename(m) for m, _ in iter_archive_members(archive)], [two])
+    eq_(list(iter_loose_keys(dsdir / 'annex' / 'objects')), [])
+    ds.drop('subdir')
+    assert_status('ok', ds.get('subdir'))
+
+
 @with_tempfile(mkdir=True)
 @with_tempfile()
 @with_tempfile()
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_in,
+    assert_raises,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.bloom import (
+    BloomFilter,
+    build_bloom_filter,
+    read_bloom_filter,
+    write_bloom_filter,
+)
+
+
+@with_tempfile
+def test_bloom_filter(path):
+    keys = ['MD5E-s{}--{:032x}'.format(i, i) for i in range(2000)]
+    bf = build_bloom_filter(keys[:1000], fp_rate=0.01)
+    # no false negatives
+    for k in keys[:1000]:
+        assert_in(k, bf)
+    # false positive rate is in the expected range, the filter is sized
+    # for twice the number of keys
+    false_positives = sum(k in bf for k in keys[1000:])
+    assert_true(false_positives < 50)
+
+    bf.add('new')
+    assert_in('new', bf)
+
+    write_bloom_filter(Path(path), bf)
+    loaded = read_bloom_filter(Path(path))
+    eq_((loaded.nbits, loaded.nhashes, loaded.bits),
+        (bf.nbits, bf.nhashes, bf.bits))
+    assert_raises(ValueError, BloomFilter.from_bytes, b'RIAXXXXX' + bytes(12))
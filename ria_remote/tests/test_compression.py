@@ -0,0 +1,46 @@
+from pathlib import Path
+import os
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_false,
+    assert_is_none,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.compression import (
+    byte_entropy,
+    is_compressible,
+    key_extension,
+)
+
+
+def test_key_extension():
+    eq_(key_extension('MD5E-s4--ba1f2511fc30423bdbb183fe33f3dd0f.txt'), 'txt')
+    eq_(key_extension('SHA256E-s9--0123abcd.nii.GZ'), 'gz')
+    assert_is_none(key_extension('MD5E-s4--ba1f2511fc30423bdbb183fe33f3dd0f'))
+    # backends without extensions
+    assert_is_none(key_extension('SHA256-s9--0123abcd'))
+    assert_is_none(key_extension('WORM-s9-m1--some.file.txt'))
+
+
+def test_byte_entropy():
+    eq_(byte_entropy(b'aaaa'), 0)
+    eq_(byte_entropy(b'abab'), 1)
+    eq_(byte_entropy(bytes(range(256))), 8)
+
+
+@with_tempfile(mkdir=True)
+def test_is_compressible(path):
+    path = Path(path)
+    text = path / 'MD5E-s1--abc.tsv'
+    text.write_text('a\tb\tc\n' * 10000)
+    assert_true(is_compressible(text))
+    random = path / 'SHA256-s1--abc'
+    random.write_bytes(os.urandom(100000))
+    assert_false(is_compressible(random))
+    # classified by extension, regardless of content
+    gzipped = path / 'MD5E-s1--abc.nii.gz'
+    gzipped.write_text('a\tb\tc\n' * 10000)
+    assert_false(is_compressible(gzipped))
@@ -0,0 +1,78 @@
+from io import BytesIO
+from pathlib import Path
+import subprocess
+
+from datalad.tests.utils import (
+    with_tree,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.foldercache import FolderCache
+from ria_remote.sevenzip import SevenZipIndex
+
+content = {
+    'ab': {'cd': {'KEY1': {'KEY1': 'content1' * 1000}}},
+    'ef': {'gh': {'KEY2': {'KEY2': 'content2' * 1000},
+                  'KEY3': {'KEY3': 'content3' * 1000}}},
+}
+
+
+def _get(cache, index, reader, name, key=0):
+    member = index.members[name]
+    out = BytesIO()
+    cache.get_member(
+        key, index.folders[member.folder], member, reader, out)
+    return out.getvalue()
+
+
+@with_tree(tree=content)
+def test_folder_cache(path):
+    path = Path(path)
+    archive = path / 'archive.7z'
+    subprocess.run(['7z', 'a', '-mx9', '-ms=on', str(archive), 'ab', 'ef'],
+                   cwd=str(path), check=True, stdout=subprocess.DEVNULL)
+    data = archive.read_bytes()
+    reads = []
+
+    def reader(offset, length):
+        reads.append(length)
+        return data[offset:offset + length]
+
+    index = SevenZipIndex(reader)
+    names = sorted(index.members)
+    # a single solid folder
+    eq_(len(index.folders), 1)
+    folder = index.folders[0]
+    reads.clear()
+
+    cache = FolderCache()
+    for name in names:
+        eq_(_get(cache, index, reader, name),
+            (path / name).read_bytes())
+    # the folder's packed stream was read once
+    eq_(sum(reads), folder.packed_size)
+    reads.clear()
+    # all members are served from the cache now, in any order
+    for name in reversed(names):
+        eq_(_get(cache, index, reader, name),
+            (path / name).read_bytes())
+    eq_(reads, [])
+    eq_(cache.size, folder.size)
+
+    # least recently used folders are evicted
+    cache = FolderCache(max_size=folder.size)
+    for key in (0, 1):
+        eq_(_get(cache, index, reader, names[-1], key),
+            (path / names[-1]).read_bytes())
+    eq_(list(cache._entries), [1])
+    eq_(cache.size, folder.size)
+    cache.clear()
+    eq_(cache.size, 0)
+
+    # folders that exceed the cache aren't kept
+    cache = FolderCache(max_size=folder.size - 1)
+    reads.clear()
+    eq_(_get(cache, index, reader, names[0]), (path / names[0]).read_bytes())
+    eq_(cache.size, 0)
+    assert_true(reads)
@@ -0,0 +1,69 @@
+import threading
+import time
+from pathlib import Path
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.governor import (
+    MIN_SAMPLE_SIZE,
+    Governor,
+)
+
+
+@with_tempfile(mkdir=True)
+def test_governor_concurrency(path):
+    governor = Governor(Path(path), max_transfers=2)
+    peak = []
+
+    def transfer():
+        with governor.transfer():
+            peak.append(governor.count_active())
+            time.sleep(0.3)
+
+    threads = [threading.Thread(target=transfer) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    eq_(len(peak), 5)
+    eq_(max(peak), 2)
+    eq_(governor.count_active(), 0)
+
+
+@with_tempfile(mkdir=True)
+def test_governor_bandwidth(path):
+    governor = Governor(Path(path), max_bandwidth=1000000)
+    start = time.time()
+    for _ in range(3):
+        with governor.transfer(100000):
+            pass
+    # the third transfer starts once the first two are paid for
+    assert_true(time.time() - start >= 0.2)
+
+
+@with_tempfile(mkdir=True)
+def test_governor_adapt(path):
+    governor = Governor(Path(path), max_transfers=8)
+    eq_(governor.get_limit(), 8)
+    with governor.transfer():
+        # fast transfers at full throughput
+        governor._adapt(MIN_SAMPLE_SIZE, 0.01)
+        eq_(governor.get_limit(), 8)
+        # throughput collapses, slots are closed
+        for _ in range(10):
+            governor._adapt(MIN_SAMPLE_SIZE, 10)
+            if governor.get_limit() < 8:
+                break
+        eq_(governor.get_limit(), 6)
+        # stable throughput, but slots to spare
+        governor._adapt(MIN_SAMPLE_SIZE, 10)
+        eq_(governor.get_limit(), 6)
+        # with all slots busy at stable throughput, slots are opened again
+        with governor._state() as state:
+            state['limit'] = 1
+        governor._adapt(MIN_SAMPLE_SIZE, 10)
+        eq_(governor.get_limit(), 2)
@@ -0,0 +1,186 @@
+from pathlib import Path
+import tarfile
+import os
+import time
+import zipfile
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_false,
+    assert_raises,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.remote import (
+    LocalIO,
+    PathStateCache,
+)
+from ria_remote.tarindex import (
+    tar_index_path,
+    write_tar_index,
+)
+
+
+def test_pathstatecache():
+    cache = PathStateCache(absent_ttl=0.2)
+    keyfile = Path('/store/abc/def/annex/objects/X1/Y2/KEY/KEY')
+
+    # nothing known yet
+    assert_false(cache.is_present(keyfile))
+    assert_false(cache.is_absent(keyfile))
+
+    cache.add_absent(keyfile)
+    assert_true(cache.is_absent(keyfile))
+    # negative knowledge expires
+    time.sleep(0.3)
+    assert_false(cache.is_absent(keyfile))
+
+    # storing a file implies its leading directories
+    cache.add_absent(keyfile.parent)
+    cache.add_present(keyfile)
+    assert_true(cache.is_present(keyfile))
+    assert_false(cache.is_absent(keyfile.parent))
+    assert_true(cache.is_dir(keyfile.parent))
+    assert_true(cache.is_dir(Path('/store/abc/def')))
+
+    # removing a directory forgets about everything underneath
+    cache.add_absent(keyfile.parent.parent)
+    assert_false(cache.is_present(keyfile))
+    assert_false(cache.is_dir(keyfile.parent))
+    assert_true(cache.is_absent(keyfile.parent.parent))
+    assert_true(cache.is_dir(Path('/store/abc/def')))
+
+    # removing a file forgets about that file only
+    other = keyfile.parent.parent / 'OTHER' / 'OTHER'
+    cache.add_present(keyfile)
+    cache.add_present(other)
+    cache.add_absent(keyfile)
+    assert_false(cache.is_present(keyfile))
+    assert_true(cache.is_present(other))
+    assert_true(cache.is_dir(keyfile.parent))
+
+    # positive knowledge expires too, another client may have removed it
+    cache = PathStateCache(present_ttl=0.2)
+    cache.add_present(keyfile)
+    assert_true(cache.is_present(keyfile))
+    time.sleep(0.3)
+    assert_false(cache.is_present(keyfile))
+    assert_false(cache.is_dir(keyfile.parent))
+
+    # the record is bounded
+    cache = PathStateCache(max_entries=10)
+    for i in range(20):
+        cache.add_present(Path('/store') / str(i))
+    assert_true(cache.is_present(Path('/store/19')))
+    assert_false(cache.is_present(Path('/store/0')))
+
+
+@with_tempfile(mkdir=True)
+def test_localio_zip(path):
+    path = Path(path)
+    archive = path / 'archive.zip'
+    member = Path('ab') / 'cd' / 'KEY' / 'KEY'
+    with zipfile.ZipFile(str(archive), 'w') as zf:
+        zf.writestr(str(member), 'content')
+    io = LocalIO()
+    assert_true(io.in_archive(archive, member))
+    assert_false(io.in_archive(archive, Path('ab') / 'cd' / 'OTHER' / 'OTHER'))
+    assert_false(io.in_archive(path / 'missing.zip', member))
+    io.get_from_archive(archive, member, path / 'out')
+    eq_((path / 'out').read_text(), 'content')
+
+    # an updated archive is picked up
+    with zipfile.ZipFile(str(archive), 'a',
+                         compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('ab/cd/NEW/NEW', 'new content')
+    assert_true(io.in_archive(archive, Path('ab') / 'cd' / 'NEW' / 'NEW'))
+    io.get_from_archive(archive, Path('ab') / 'cd' / 'NEW' / 'NEW', path / 'out')
+    eq_((path / 'out').read_text(), 'new content')
+
+
+@with_tempfile(mkdir=True)
+def test_localio_tar(path):
+    path = Path(path)
+    archive = path / 'archive.tar'
+    member = Path('ab') / 'cd' / 'KEY' / 'KEY'
+    (path / 'KEY').write_text('content')
+    with tarfile.open(str(archive), 'w') as tf:
+        tf.add(str(path / 'KEY'), arcname=str(member))
+    write_tar_index(archive)
+    assert_true(tar_index_path(archive).exists())
+    io = LocalIO()
+    assert_true(io.in_archive(archive, member))
+    assert_false(io.in_archive(archive, Path('ab') / 'cd' / 'OTHER' / 'OTHER'))
+    assert_false(io.in_archive(path / 'missing.tar', member))
+    io.get_from_archive(archive, member, path / 'out')
+    eq_((path / 'out').read_text(), 'content')
+
+    # members added after the index was written are found in the archive
+    (path / 'NEW').write_text('new content')
+    with tarfile.open(str(archive), 'a') as tf:
+        tf.add(str(path / 'NEW'), arcname='ab/cd/NEW/NEW')
+    assert_true(io.in_archive(archive, Path('ab') / 'cd' / 'NEW' / 'NEW'))
+    io.get_from_archive(archive, Path('ab') / 'cd' / 'NEW' / 'NEW', path / 'out')
+    eq_((path / 'out').read_text(), 'new content')
+
+
+@with_tempfile(mkdir=True)
+def test_localio_pack(path):
+    path = Path(path)
+    objdir = path / 'objects'
+    for key in ('KEY1', 'KEY2'):
+        keypath = objdir / 'ab' / 'cd' / key / key
+        keypath.parent.mkdir(parents=True)
+        keypath.write_text(key)
+    io = LocalIO()
+    eq_(sorted(io.list_loose_keys(objdir)),
+        [('ab/cd/KEY1/KEY1', 4), ('ab/cd/KEY2/KEY2', 4)])
+    eq_(io.list_loose_keys(path / 'missing'), [])
+
+    archive = path / 'archive.7z'
+    io.archive_directory(objdir, archive)
+    io.get_from_archive(archive, Path('ab/cd/KEY2/KEY2'), path / 'out')
+    eq_((path / 'out').read_text(), 'KEY2')
+
+    io.prune_keys(objdir, ['ab/cd/KEY1/KEY1'])
+    eq_(io.list_loose_keys(objdir), [('ab/cd/KEY2/KEY2', 4)])
+    io.prune_keys(objdir, ['ab/cd/KEY2/KEY2'])
+    # empty hash directories are gone too
+    eq_(list(objdir.iterdir()), [])
+
+
+@with_tempfile(mkdir=True)
+def test_localio_symlink(path):
+    path = Path(path)
+    target = path / 'target'
+    target.mkdir()
+    link = path / 'link'
+    io = LocalIO()
+    io.symlink(target, link)
+    # another client was first
+    io.symlink(target, link)
+    eq_(os.readlink(str(link)), str(target))
+    eq_(list(target.iterdir()), [])
+    other = path / 'other'
+    other.mkdir()
+    assert_raises(FileExistsError, io.symlink, other, link)
+    assert_raises(FileExistsError, io.symlink, target, other)
+
+
+@with_tempfile(mkdir=True)
+def test_localio_claim(path):
+    path = Path(path)
+    claim = path / 'claim'
+    io = LocalIO()
+    assert_true(io.get_age(claim) is None)
+    assert_true(io.create_exclusive(claim))
+    assert_false(io.create_exclusive(claim))
+    assert_true(0 <= io.get_age(claim) < 60)
+    # a refreshed claim is young again
+    os.utime(str(claim), (1, 1))
+    assert_true(io.get_age(claim) > 60)
+    io.touch(claim)
+    assert_true(0 <= io.get_age(claim) < 60)
+    io.remove(claim)
+    assert_true(io.create_exclusive(claim))
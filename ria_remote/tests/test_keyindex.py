@@ -0,0 +1,86 @@
+from pathlib import Path
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_in,
+    assert_not_in,
+    assert_raises,
+    eq_,
+)
+
+from ria_remote.keyindex import (
+    KeyIndex,
+    KeyIndexEntry,
+    update_key_index,
+    write_key_index,
+)
+
+
+@with_tempfile
+def test_key_index(path):
+    path = Path(path)
+    keys = ['MD5E-s{}--{:032x}.dat'.format(i, i) for i in range(1000)]
+    write_key_index(
+        path,
+        [(k, 'loose', 0, i) for i, k in enumerate(keys)]
+        + [(keys[0], 'archives/archive.7z', 512, 0)],
+        stamps={'archives/archive.7z': 1024, 'archives/other.7z': 10})
+    with KeyIndex(path) as index:
+        eq_(len(index), 1001)
+        for k in keys:
+            assert_in(k, index)
+        assert_not_in('MD5E-s1--unknown', index)
+        eq_(index.lookup('MD5E-s1--unknown'), [])
+        eq_(index.lookup(keys[3]), [KeyIndexEntry('loose', 0, 3)])
+        eq_(sorted(index.lookup(keys[0])),
+            [KeyIndexEntry('archives/archive.7z', 512, 0),
+             KeyIndexEntry('loose', 0, 0)])
+        eq_(index.locations,
+            {'loose': 0,
+             'archives/archive.7z': 1024,
+             'archives/other.7z': 10})
+
+    # replace the content of one location
+    update_key_index(path, 'archives/archive.7z', [(keys[5], 0, 5)], stamp=2)
+    with KeyIndex(path) as index:
+        eq_(len(index), 1001)
+        eq_(index.lookup(keys[0]), [KeyIndexEntry('loose', 0, 0)])
+        eq_(sorted(index.lookup(keys[5])),
+            [KeyIndexEntry('archives/archive.7z', 0, 5),
+             KeyIndexEntry('loose', 0, 5)])
+        eq_(index.locations['archives/archive.7z'], 2)
+
+    # records of a new location are merged with the present ones, whatever
+    # order they come in
+    update_key_index(
+        path, 'archives/new.zip',
+        [(k, 0, 1) for k in reversed(keys[:10])] + [(keys[0], 0, 1)],
+        stamp=3)
+    with KeyIndex(path) as index:
+        eq_(len(index), 1011)
+        eq_(sorted(index.lookup(keys[0])),
+            [KeyIndexEntry('archives/new.zip', 0, 1),
+             KeyIndexEntry('loose', 0, 0)])
+        eq_(index.lookup(keys[10]), [KeyIndexEntry('loose', 0, 10)])
+        eq_(index.locations,
+            {'loose': 0,
+             'archives/archive.7z': 2,
+             'archives/other.7z': 10,
+             'archives/new.zip': 3})
+        digests = [d for d, _ in index.iter_entries()]
+        eq_(digests, sorted(digests))
+
+
+@with_tempfile
+def test_key_index_create(path):
+    path = Path(path)
+    update_key_index(path, 'archives/archive.zip', [('KEY', 0, 1)], stamp=5)
+    with KeyIndex(path) as index:
+        eq_(index.lookup('KEY'), [KeyIndexEntry('archives/archive.zip', 0, 1)])
+        eq_(index.locations, {'archives/archive.zip': 5})
+
+
+@with_tempfile
+def test_key_index_invalid(path):
+    Path(path).write_bytes(b'garbage')
+    assert_raises(ValueError, KeyIndex, Path(path))
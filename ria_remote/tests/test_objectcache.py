@@ -0,0 +1,121 @@
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_false,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.objectcache import (
+    ObjectCache,
+    _LOCK_PREFIX,
+)
+
+KEY1 = 'MD5E-s8--7e55db001d319a94b0b713529a756623.txt'
+KEY2 = 'MD5E-s8--eea670f4ac941df71a3b5f268ebe3eac.txt'
+KEY3 = 'MD5E-s8--c96310e55d9677b978eae0dada47642c.txt'
+
+
+@with_tempfile(mkdir=True)
+def test_object_cache(path):
+    path = Path(path)
+    src = path / 'src'
+    src.write_text('content1')
+    cache = ObjectCache(path / 'cache', max_size=20)
+
+    assert_false(cache.get(KEY1, path / 'dst'))
+    cache.put(KEY1, src)
+    eq_(cache.key_path(KEY1).read_text(), 'content1')
+    assert_true(cache.get(KEY1, path / 'dst'))
+    eq_((path / 'dst').read_text(), 'content1')
+    # delivered as a hardlink on the same file system, replacing what was
+    # there
+    (path / 'dst2').write_text('partial')
+    assert_true(cache.get(KEY1, path / 'dst2'))
+    eq_((path / 'dst2').stat().st_ino, cache.key_path(KEY1).stat().st_ino)
+
+    # keys that don't identify their content aren't cached
+    cache.put('WORM-s8-m1--file', src)
+    assert_false(cache.get('WORM-s8-m1--file', path / 'dst'))
+
+    # the least recently used key is evicted, once the bound is exceeded
+    (path / KEY2).write_text('content2')
+    (path / KEY3).write_text('content3')
+    cache.put(KEY2, path / KEY2)
+    os.utime(str(cache.key_path(KEY1)), (1, 1))
+    os.utime(str(cache.key_path(KEY2)), (2, 2))
+    assert_true(cache.get(KEY1, path / 'dst'))
+    cache.put(KEY3, path / KEY3)
+    assert_false(cache.key_path(KEY2).exists())
+    assert_true(cache.key_path(KEY1).exists())
+    assert_true(cache.key_path(KEY3).exists())
+    eq_(cache._size, 16)
+
+
+@with_tempfile(mkdir=True)
+def test_object_cache_single_flight(path):
+    path = Path(path)
+    cache = ObjectCache(path / 'cache')
+    retrieved = []
+
+    def retrieve(dst):
+        retrieved.append(dst)
+        time.sleep(1)
+        dst.write_text('content1')
+
+    threads = [
+        threading.Thread(
+            target=cache.fetch, args=(KEY1, path / str(i), retrieve))
+        for i in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # retrieved once, delivered to everyone
+    eq_(len(retrieved), 1)
+    for i in range(5):
+        eq_((path / str(i)).read_text(), 'content1')
+    assert_false(list(cache.key_path(KEY1).parent.glob(_LOCK_PREFIX + '*')))
+
+    # a lock left behind by a process that is gone doesn't block anyone
+    lock_path = cache.key_path(KEY2).parent / (_LOCK_PREFIX + KEY2)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    # pids don't go that high
+    lock_path.write_text('{} {}\n'.format(socket.gethostname(), 1 << 30))
+    cache.fetch(KEY2, path / 'dst', lambda dst: dst.write_text('content2'))
+    eq_((path / 'dst').read_text(), 'content2')
+    assert_false(lock_path.exists())
+
+
+@with_tempfile(mkdir=True)
+def test_object_cache_verify(path):
+    path = Path(path)
+    cache = ObjectCache(path / 'cache')
+    (path / 'bad').write_text('content2')
+    # content that doesn't match isn't added
+    cache.put(KEY1, path / 'bad')
+    assert_false(cache.key_path(KEY1).exists())
+    # neither are chunks, which can't be verified
+    chunk = 'MD5-s16-S8-C1--7e55db001d319a94b0b713529a756623'
+    (path / 'chunk').write_text('content1')
+    cache.put(chunk, path / 'chunk')
+    assert_false(cache.key_path(chunk).exists())
+
+    # content that went bad in the cache is removed, and retrieved again
+    (path / 'src').write_text('content1')
+    cache.put(KEY1, path / 'src')
+    keypath = cache.key_path(KEY1)
+    os.chmod(str(keypath), 0o644)
+    keypath.write_text('content2')
+    assert_false(cache.get(KEY1, path / 'dst'))
+    assert_false(keypath.exists())
+    assert_false((path / 'dst').exists())
+    cache.fetch(KEY1, path / 'dst', lambda dst: dst.write_text('content1'))
+    eq_((path / 'dst').read_text(), 'content1')
+    eq_(keypath.read_text(), 'content1')
@@ -0,0 +1,52 @@
+from pathlib import Path
+import time
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_false,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.replicas import (
+    RETRY_INTERVAL,
+    Replica,
+    order_replicas,
+    parse_replicas,
+)
+from ria_remote.storestats import StoreStats
+
+
+def test_parse_replicas():
+    eq_(parse_replicas(
+        'mirror1 ria+ssh://mirror2/other/store ria+file:///mnt/store',
+        {}, Path('/store')),
+        [('mirror1', Path('/store')),
+         ('mirror2', Path('/other/store')),
+         (None, Path('/mnt/store'))])
+
+
+@with_tempfile(mkdir=True)
+def test_order_replicas(path):
+    path = Path(path)
+
+    def replica(name):
+        return Replica(name, Path('/store'), lambda host: None,
+                       StoreStats(path / name))
+
+    fast, slow, new = replica('fast'), replica('slow'), replica('new')
+    fast.stats.record(100, 0.01)
+    slow.stats.record(100, 1)
+    # unmeasured replicas come first, such that they get measured
+    eq_(order_replicas([slow, fast, new]), [new, fast, slow])
+
+    # failed replicas are a last resort for a while
+    new.failed_at = time.time()
+    assert_false(new.is_healthy())
+    eq_(order_replicas([slow, fast, new]), [fast, slow, new])
+    new.failed_at -= RETRY_INTERVAL + 1
+    assert_true(new.is_healthy())
+
+    eq_(fast.translate(Path('/primary/ab/cd'), Path('/primary')),
+        Path('/store/ab/cd'))
+    eq_(str(fast), 'fast:/store')
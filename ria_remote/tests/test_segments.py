@@ -0,0 +1,54 @@
+from pathlib import Path
+import zipfile
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_false,
+    assert_in,
+    assert_is_none,
+    eq_,
+)
+
+from ria_remote.keyindex import KeyIndex
+from ria_remote.segments import (
+    SEGMENT_INDEX_FILENAME,
+    index_segment,
+    list_segments,
+    next_segment,
+    segment_name,
+    segment_number,
+)
+
+
+def test_segment_names():
+    eq_(segment_name(1, '7z'), 'archive-0001.7z')
+    eq_(segment_number('archive-0001.7z'), 1)
+    eq_(segment_number('archive-12345.tar'), 12345)
+    assert_is_none(segment_number('archive.7z'))
+    assert_is_none(segment_number('archive-0001.tar.index'))
+    assert_is_none(segment_number(SEGMENT_INDEX_FILENAME))
+
+
+@with_tempfile(mkdir=True)
+def test_segments(path):
+    archive_dir = Path(path)
+    eq_(list_segments(archive_dir), [])
+    eq_(next_segment(archive_dir, 'zip'), archive_dir / 'archive-0001.zip')
+
+    for keys in (['KEY1', 'KEY2'], ['KEY3']):
+        segment = next_segment(archive_dir, 'zip')
+        with zipfile.ZipFile(str(segment), 'w') as zf:
+            for key in keys:
+                zf.writestr('ab/cd/{0}/{0}'.format(key), key)
+        index_segment(segment)
+    (archive_dir / 'archive.zip').touch()
+    eq_([p.name for p in list_segments(archive_dir)],
+        ['archive-0001.zip', 'archive-0002.zip'])
+    eq_(next_segment(archive_dir, '7z'), archive_dir / 'archive-0003.7z')
+
+    with KeyIndex(archive_dir / SEGMENT_INDEX_FILENAME) as index:
+        eq_(len(index), 3)
+        eq_(index.lookup('KEY2')[0].location, 'archive-0001.zip')
+        eq_(index.lookup('KEY3')[0].location, 'archive-0002.zip')
+        assert_false('KEY4' in index)
+        assert_in('archive-0002.zip', index.locations)
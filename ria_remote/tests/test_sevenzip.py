@@ -0,0 +1,112 @@
+from io import BytesIO
+from pathlib import Path
+import subprocess
+
+from datalad.tests.utils import (
+    with_tree,
+    assert_false,
+    assert_in,
+    assert_is_none,
+    assert_raises,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.remote import LocalIO
+from ria_remote.sevenzip import (
+    SevenZipIndex,
+    SevenZipError,
+    _Buffer,
+    unpack_folder,
+    unpack_member,
+)
+
+content = {
+    'ab': {'cd': {'KEY1': {'KEY1': 'content1'}}},
+    'ef': {'gh': {'KEY2': {'KEY2': 'content2' * 100},
+                  'KEY3': {'KEY3': ''}}},
+}
+members = {
+    'ab/cd/KEY1/KEY1': b'content1',
+    'ef/gh/KEY2/KEY2': b'content2' * 100,
+    'ef/gh/KEY3/KEY3': b'',
+}
+
+
+def _reader(path):
+    data = path.read_bytes()
+    return lambda offset, length: data[offset:offset + length]
+
+
+def test_number():
+    # one, two and nine byte encodings
+    buf = _Buffer(b'\x7f\x81\x02' + b'\xff' + b'\x01' * 8)
+    eq_(buf.number(), 0x7f)
+    eq_(buf.number(), 0x102)
+    eq_(buf.number(), 0x0101010101010101)
+    assert_raises(SevenZipError, buf.number)
+
+
+@with_tree(tree=content)
+def test_stored_archive(path):
+    path = Path(path)
+    archive = path / 'archive.7z'
+    subprocess.run(['7z', 'a', '-mx0', str(archive), 'ab', 'ef'],
+                   cwd=str(path), check=True, stdout=subprocess.DEVNULL)
+    index = SevenZipIndex(_reader(archive))
+    eq_(set(index.members), set(members))
+    eq_(index.size, archive.stat().st_size)
+    data = archive.read_bytes()
+    for name, expected in members.items():
+        offset, size = index.locate(name)
+        eq_(data[offset:offset + size], expected)
+    assert_raises(KeyError, index.locate, 'ab/cd/OTHER/OTHER')
+
+    io = LocalIO()
+    assert_true(io.in_archive(archive, Path('ef/gh/KEY2/KEY2')))
+    assert_false(io.in_archive(archive, Path('ef/gh/OTHER/OTHER')))
+    io.get_from_archive(archive, Path('ef/gh/KEY2/KEY2'), path / 'out')
+    eq_((path / 'out').read_bytes(), members['ef/gh/KEY2/KEY2'])
+
+
+@with_tree(tree=content)
+def test_compressed_archive(path):
+    path = Path(path)
+    archive = path / 'archive.7z'
+    subprocess.run(['7z', 'a', '-mx9', str(archive), 'ab', 'ef'],
+                   cwd=str(path), check=True, stdout=subprocess.DEVNULL)
+    index = SevenZipIndex(_reader(archive))
+    eq_(set(index.members), set(members))
+    data = archive.read_bytes()
+    for name, expected in members.items():
+        member = index.members[name]
+        if member.folder is None:
+            eq_(expected, b'')
+            continue
+        assert_is_none(index.locate(name))
+        folder = index.folders[member.folder]
+        unpacked = unpack_folder(
+            folder, data[folder.offset:folder.offset + folder.packed_size])
+        eq_(unpacked[member.offset:member.offset + member.size], expected)
+        # incrementally, reading the packed stream in tiny chunks
+        out = BytesIO()
+        unpack_member(folder, member, _reader(archive), out, chunk_size=7)
+        eq_(out.getvalue(), expected)
+
+    # unpacked on this end, as done for remote archives on request
+    io = LocalIO()
+    for name, expected in members.items():
+        assert_true(io._unpack_from_7z(archive, Path(name), path / 'out'))
+        eq_((path / 'out').read_bytes(), expected)
+
+    # and read without running 7z locally, too
+    io.get_from_archive(archive, Path('ab/cd/KEY1/KEY1'), path / 'out')
+    eq_((path / 'out').read_bytes(), b'content1')
+
+
+@with_tree(tree={'archive.7z': 'not an archive'})
+def test_invalid_archive(path):
+    path = Path(path)
+    with assert_raises(SevenZipError) as cm:
+        SevenZipIndex(_reader(path / 'archive.7z'))
+    assert_in('Not a 7z archive', str(cm.exception))
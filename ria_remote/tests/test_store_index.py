@@ -0,0 +1,106 @@
+import sqlite3
+import subprocess
+from pathlib import Path
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_false,
+    assert_raises,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.store_index import (
+    LOOSE,
+    RemoteStoreIndex,
+    StoreIndex,
+    _inline,
+)
+from ria_remote.utils import iter_loose_keys
+
+
+@with_tempfile
+def test_store_index(path):
+    index = StoreIndex(Path(path))
+    assert_false(index.has_tables())
+    index.create_tables()
+    assert_true(index.has_tables())
+    index.record('dsid1', 'KEY1', LOOSE, None, 10)
+    index.record('dsid2', 'KEY1', 'archives/archive.7z', 'ab/cd/KEY1/KEY1', 10)
+    eq_(index.locate('dsid1', 'KEY1'), [(LOOSE, None)])
+    eq_(index.archived('dsid1'), set())
+    eq_(index.archived('dsid2'), {'KEY1'})
+    eq_(sorted(index.find('KEY1')),
+        [('dsid1', LOOSE, None, 10),
+         ('dsid2', 'archives/archive.7z', 'ab/cd/KEY1/KEY1', 10)])
+    index.drop('dsid1', 'KEY1')
+    eq_(index.locate('dsid1', 'KEY1'), [])
+    index.close()
+
+    # records persist and can be replaced per dataset
+    index = StoreIndex(Path(path))
+    index.record('dsid2', 'KEY2', LOOSE, None, 5)
+    eq_([r[0] for r in index.keys('dsid2')], ['KEY1', 'KEY2'])
+    # replace the records of a location only
+    index.replace('dsid2', [('KEY3', LOOSE, None, 1)], location=LOOSE)
+    eq_(index.keys('dsid2'),
+        [('KEY1', 'archives/archive.7z', 'ab/cd/KEY1/KEY1', 10),
+         ('KEY3', LOOSE, None, 1)])
+    index.replace('dsid2', [('KEY3', LOOSE, None, 1)])
+    eq_(index.keys('dsid2'), [('KEY3', LOOSE, None, 1)])
+    eq_(index.datasets(), ['dsid2'])
+    index.record('dsid2', 'KEY4', LOOSE, None, 2)
+    index.drop_keys('dsid2', ['KEY3', 'KEY4'])
+    eq_(index.keys('dsid2'), [])
+    index.close()
+
+    # queries only
+    index = StoreIndex(Path(path), readonly=True)
+    eq_(index.datasets(), [])
+    assert_raises(
+        sqlite3.OperationalError, index.record, 'dsid2', 'KEY5', LOOSE)
+    index.close()
+
+
+@with_tempfile
+def test_remote_store_index(path):
+    def run(cmd):
+        return subprocess.run(
+            cmd, shell=True, check=True, stdout=subprocess.PIPE,
+            universal_newlines=True).stdout
+
+    index = RemoteStoreIndex(Path(path), run)
+    assert_false(index.has_tables())
+    index.create_tables()
+    index.record('dsid', 'KEY1', 'archives/archive.7z', 'ab/cd/KEY1/KEY1', 10)
+    eq_(index.keys('dsid'),
+        [('KEY1', 'archives/archive.7z', 'ab/cd/KEY1/KEY1', 10)])
+    # a failing statement fails the transaction as a whole
+    assert_raises(
+        subprocess.CalledProcessError, index._transaction,
+        [("DELETE FROM keys WHERE dsid=?", ('dsid',)),
+         "INSERT INTO nosuchtable VALUES (1)"])
+    eq_(index.archived('dsid'), {'KEY1'})
+    index = RemoteStoreIndex(Path(path), run, readonly=True)
+    eq_(index.archived('dsid'), {'KEY1'})
+    assert_raises(
+        subprocess.CalledProcessError, index.drop, 'dsid', 'KEY1',
+        'archives/archive.7z')
+
+
+def test_inline():
+    eq_(_inline("SELECT * FROM keys WHERE key=? AND size=? AND member=?",
+                ("it's", 5, None)),
+        "SELECT * FROM keys WHERE key='it''s' AND size=5 AND member=NULL")
+    assert_raises(ValueError, _inline, "key=?", ())
+
+
+@with_tempfile(mkdir=True)
+def test_iter_loose_keys(path):
+    objdir = Path(path)
+    keydir = objdir / 'Xy' / 'zZ' / 'KEY' / 'KEY'
+    keydir.parent.mkdir(parents=True)
+    keydir.write_text('content')
+    # some unrelated file at an unexpected level
+    (objdir / 'Xy' / 'stray').write_text('')
+    eq_(list(iter_loose_keys(objdir)), [('Xy/zZ/KEY/KEY', 7)])
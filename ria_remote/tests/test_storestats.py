@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from datalad.tests.utils import (
+    with_tempfile,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.storestats import (
+    MAX_COST,
+    MIN_COST,
+    StoreStats,
+)
+
+
+@with_tempfile(mkdir=True)
+def test_store_stats(path):
+    path = Path(path) / 'stats' / 'store.json'
+    stats = StoreStats(path)
+    # nothing measured yet
+    eq_(stats.get_cost(200), 200)
+
+    stats.record(1000, 0.001)
+    stats.record(10 << 20, 0.1)
+    eq_(stats.latency, 0.001)
+    eq_(stats.throughput, 100 << 20)
+    # a fast store is about as cheap as a local one
+    fast = stats.get_cost(200)
+    assert_true(MIN_COST <= fast < 150)
+    # measurements persist
+    eq_(StoreStats(path).get_cost(200), fast)
+
+    slow = StoreStats(path)
+    for _ in range(30):
+        slow.record(1000, 0.2)
+        slow.record(10 << 20, 10)
+    assert_true(fast < slow.get_cost(200) <= MAX_COST)
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+from datalad.tests.utils import (
+    assert_false,
+    assert_raises,
+    assert_true,
+    eq_,
+)
+
+from ria_remote.utils import (
+    format_shard_config,
+    get_key_size,
+    get_layout_locations,
+    get_shard_name,
+    is_poolable,
+    parse_shard_config,
+    parse_store_roots,
+)
+
+
+def test_is_poolable():
+    assert_true(is_poolable('MD5E-s4--ba1f2511fc30423bdbb183fe33f3dd0f.txt'))
+    assert_true(is_poolable('SHA256-s10--' + 64 * 'a'))
+    assert_false(is_poolable('WORM-s4-m1571000000--file.txt'))
+    assert_false(is_poolable('URL--http&c%%example.com%file'))
+    assert_false(is_poolable('VURL--http&c%%example.com%file'))
+
+
+def test_get_key_size():
+    eq_(get_key_size('MD5E-s4--ba1f2511fc30423bdbb183fe33f3dd0f.txt'), 4)
+    eq_(get_key_size('WORM-s4-m1571000000--file.txt'), 4)
+    # chunks
+    eq_(get_key_size('SHA256-s10-S4-C2--' + 64 * 'a'), 4)
+    # the last one is shorter
+    eq_(get_key_size('SHA256-s10-S4-C3--' + 64 * 'a'), 2)
+    eq_(get_key_size('SHA256-s8-S4-C2--' + 64 * 'a'), 4)
+    eq_(get_key_size('URL--http&c%%example.com%file'), None)
+
+
+def test_shards():
+    # git-annex' hashdirlower of this key is ff4/c57
+    key = 'MD5E-s4--ba1f2511fc30423bdbb183fe33f3dd0f'
+    eq_(get_shard_name(key, 2, '7z'), 'ff.7z')
+    eq_(get_shard_name(key, 3, 'tar'), 'ff4.tar')
+
+    eq_(parse_shard_config(format_shard_config(2, 'zip')), (2, 'zip'))
+    assert_raises(ValueError, parse_shard_config, '')
+    assert_raises(ValueError, parse_shard_config, '2 rar')
+    assert_raises(ValueError, parse_shard_config, 'two 7z')
+
+
+def test_store_roots():
+    roots = parse_store_roots(
+        '# datasets by ID prefix\n'
+        '\n'
+        '0 /vol0/store\n'
+        '01 /vol1/store\n')
+    eq_(roots, [('01', Path('/vol1/store')), ('0', Path('/vol0/store'))])
+    assert_raises(ValueError, parse_store_roots, 'a\n')
+    assert_raises(ValueError, parse_store_roots, 'a relative/path\n')
+
+    base = Path('/store')
+    eq_(get_layout_locations(2, base, '0123', roots)[0],
+        Path('/vol1/store/012/3'))
+    eq_(get_layout_locations(2, base, '0abc', roots)[2],
+        Path('/vol0/store/0ab/c/annex/objects'))
+    # no matching root
+    eq_(get_layout_locations(2, base, 'abcd', roots),
+        get_layout_locations(1, base, 'abcd'))
+    eq_(get_layout_locations(2, base, '0123'),
+        get_layout_locations(1, base, '0123'))
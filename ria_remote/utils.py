@@ -1,4 +1,80 @@
-def get_layout_locations(version, base_path, dsid):
+# name of the shared content pool directory at the base path of a store
+CONTENT_POOL_DIRNAME = 'ria-content-pool'
+
+# name of the directory with pack archives at the base path of a store
+PACKS_DIRNAME = 'ria-packs'
+
+# name of the directory in a dataset's directory with the claims of keys
+# that are being uploaded
+CLAIMS_DIRNAME = 'ria-upload-claims'
+
+# name of the file in a dataset's archives directory that declares
+# hash-prefix-sharded archives
+SHARD_CONFIG_FILENAME = 'ria-archive-shards'
+
+# name of the file at the base path of a store that assigns datasets to
+# further roots of the store, by dataset ID prefix (dataset tree version 2)
+STORE_ROOTS_FILENAME = 'ria-store-roots'
+
+# file name extensions of the supported archive formats
+ARCHIVE_SUFFIXES = ('.7z', '.zip', '.tar')
+
+# git-annex backends whose keys don't identify content
+_UNHASHED_BACKENDS = ('WORM', 'URL', 'VURL')
+
+
+def get_cache_dir():
+    """Returns the directory for machine-local state of RIA remotes"""
+    import os
+    from pathlib import Path
+    return Path(
+        os.environ.get('XDG_CACHE_HOME') or str(Path.home() / '.cache')
+    ) / 'ria-remote'
+
+
+def parse_store_roots(content):
+    """Decode the roots of a store, as recorded in its `STORE_ROOTS_FILENAME`
+
+    Every line holds a dataset ID prefix and the absolute path of the root
+    the directories of matching datasets are in, separated by whitespace.
+    Empty lines and lines starting with '#' are ignored.
+
+    Returns
+    -------
+    list
+      (prefix, Path) of each root, longest prefix first.
+
+    Raises
+    ------
+    ValueError
+      For malformed lines.
+    """
+    from pathlib import Path
+    roots = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 1)
+        if len(fields) != 2 or not Path(fields[1]).is_absolute():
+            raise ValueError("Invalid store root: {}".format(line))
+        roots.append((fields[0], Path(fields[1])))
+    return sorted(roots, key=lambda r: len(r[0]), reverse=True)
+
+
+def get_dataset_root(roots, base_path, dsid):
+    """Returns the root of a store a dataset's directory is in
+
+    The root with the longest prefix of the dataset ID, the base path if
+    none matches.
+    """
+    for prefix, root in roots:
+        if dsid.startswith(prefix):
+            return root
+    return base_path
+
+
+def get_layout_locations(version, base_path, dsid, roots=None):
     """Return dataset-related path in a RIA store
 
     Parameters
@@ -9,6 +85,8 @@ def get_layout_locations(version, base_path, dsid):
       Base path of the store.
     dsid : str
       Dataset ID
+    roots : list, optional
+      Roots of a store of version 2, as returned by `parse_store_roots()`.
 
     Returns
     -------
@@ -17,6 +95,10 @@ def get_layout_locations(version, base_path, dsid):
       the directory with archive files for the dataset, and the
       annex object directory are return in that order.
     """
+    if version == 2:
+        # version 1 beneath the dataset's root
+        base_path = get_dataset_root(roots or [], base_path, dsid)
+        version = 1
     if version == 1:
         dsgit_dir = base_path / dsid[:3] / dsid[3:]
         archive_dir = dsgit_dir / 'archives'
@@ -26,6 +108,116 @@ def get_layout_locations(version, base_path, dsid):
         raise ValueError("Unknown layout version: {}".format(version))
 
 
+def is_poolable(key):
+    """Whether a key identifies its content, and can be shared by datasets"""
+    return key.split('-', 1)[0] not in _UNHASHED_BACKENDS
+
+
+def get_key_hasher(key):
+    """Returns a hash object for the content of a key, and the expected digest
+
+    Returns
+    -------
+    (hash object, str) or None
+      None, if the key's content can't be verified locally: its backend
+      doesn't hash, or isn't supported, or the key is a chunk, whose content
+      isn't what the checksum is of.
+    """
+    import hashlib
+    fields, _, name = key.partition('--')
+    fields = fields.split('-')
+    backend = fields[0]
+    if any(f[:1] in 'SC' for f in fields[1:]):
+        return None
+    if backend.endswith('E'):
+        # the checksum is followed by the file name extension
+        backend = backend[:-1]
+        name = name.split('.', 1)[0]
+    if backend.startswith(('BLAKE2B', 'BLAKE2S')) and backend[7:].isdigit():
+        hasher = getattr(hashlib, backend[:7].lower())(
+            digest_size=int(backend[7:]) // 8)
+    else:
+        try:
+            hasher = hashlib.new(backend.lower())
+        except ValueError:
+            return None
+    return hasher, name
+
+
+def verify_key_content(key, path):
+    """Whether a file's content matches the checksum of a key
+
+    Returns
+    -------
+    bool or None
+      None, if the key's content can't be verified (see `get_key_hasher()`).
+    """
+    hasher = get_key_hasher(key)
+    if hasher is None:
+        return None
+    hasher, digest = hasher
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest() == digest
+
+
+def get_key_size(key):
+    """Returns the size of the content of a key (or key chunk), or None"""
+    fields = key.split('--', 1)[0].split('-')[1:]
+    sizes = dict(
+        (f[0], int(f[1:])) for f in fields
+        if f[:1] in 'sSC' and f[1:].isdigit())
+    size = sizes.get('s')
+    if size is None or 'S' not in sizes or 'C' not in sizes:
+        return size
+    # the last chunk holds the remainder
+    chunk_size = sizes['S']
+    return max(0, min(chunk_size, size - (sizes['C'] - 1) * chunk_size))
+
+
+def is_pack_location(location):
+    """Whether a store index location is a pack archive of the store
+
+    Unlike other archive locations, which are relative to a dataset's
+    directory, pack locations are relative to the base path of a store.
+    """
+    return location.startswith(PACKS_DIRNAME + '/')
+
+
+def get_shard_name(key, prefix_length, archive_format):
+    """Returns the file name of the archive shard that holds a key
+
+    Shards are named after the first characters of the hex digest of the
+    MD5 hash of a key, like the directories of the 'hashdirlower' layout
+    of git-annex. Hence, a shard name is the same on case-insensitive
+    filesystems.
+    """
+    from hashlib import md5
+    return '{}.{}'.format(
+        md5(key.encode('utf-8')).hexdigest()[:prefix_length],
+        archive_format)
+
+
+def format_shard_config(prefix_length, archive_format):
+    return '{} {}\n'.format(prefix_length, archive_format)
+
+
+def parse_shard_config(content):
+    """Returns the prefix length and archive format of a shard config
+
+    Raises
+    ------
+    ValueError
+      If the content isn't a valid shard config.
+    """
+    parts = content.split()
+    if len(parts) != 2 or not parts[0].isdigit() \
+            or '.' + parts[1] not in ARCHIVE_SUFFIXES:
+        raise ValueError("Invalid archive shard config: {!r}".format(content))
+    return int(parts[0]), parts[1]
+
+
 def verify_ria_url(url, cfg):
     """Verify and decode ria url
 
@@ -72,3 +264,117 @@ def verify_ria_url(url, cfg):
     return url_ri.hostname if protocol == 'ssh' else None, url_ri.path
 
 
+def iter_7z_members(archive):
+    """Yield the files contained in a 7z archive
+
+    Parameters
+    ----------
+    archive : Path
+      Local 7z archive.
+
+    Yields
+    ------
+    str, int
+      Path of a member relative to the root of the archive, and its size.
+    """
+    import subprocess
+    out = subprocess.check_output(
+        ['7z', 'l', '-slt', str(archive)],
+        universal_newlines=True,
+    )
+    # skip the description of the archive itself
+    out = out.partition('\n----------\n')[2]
+    for block in out.split('\n\n'):
+        props = dict(
+            line.split(' = ', 1)
+            for line in block.splitlines()
+            if ' = ' in line
+        )
+        if 'Path' not in props or props.get('Folder') == '+':
+            continue
+        yield props['Path'], int(props.get('Size') or 0)
+
+
+def iter_zip_members(archive):
+    """Yield the files contained in a ZIP archive
+
+    Parameters
+    ----------
+    archive : Path
+      Local ZIP archive.
+
+    Yields
+    ------
+    str, int
+      Path of a member relative to the root of the archive, and its size.
+    """
+    import zipfile
+    with zipfile.ZipFile(str(archive)) as zf:
+        for info in zf.infolist():
+            if not info.filename.endswith('/'):
+                yield info.filename, info.file_size
+
+
+def iter_archive_members(archive):
+    """Yield the files contained in an archive of any supported format
+
+    Parameters
+    ----------
+    archive : Path
+      Local archive.
+
+    Yields
+    ------
+    str, int
+      Path of a member relative to the root of the archive, and its size.
+    """
+    if archive.suffix == '.zip':
+        return iter_zip_members(archive)
+    elif archive.suffix == '.7z':
+        return iter_7z_members(archive)
+    elif archive.suffix == '.tar':
+        from ria_remote.tarindex import iter_tar_entries
+        return ((name, size) for name, _, size in iter_tar_entries(archive))
+    raise ValueError("Unsupported archive format: {}".format(archive))
+
+
+def iter_loose_keys(objdir):
+    """Yield the keys in an annex object tree of a RIA store
+
+    Parameters
+    ----------
+    objdir : Path
+      Annex object directory of a dataset in a RIA store, or the content
+      pool of a store, which has the same layout.
+
+    Yields
+    ------
+    str, int
+      Path of a key file relative to `objdir`, and its size.
+    """
+    import os
+    # <hashdir1>/<hashdir2>/<key>/<key>, all other content is ignored
+    for path in _scandirs(str(objdir), 3):
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        relpath = os.path.relpath(entry.path, str(objdir))
+                        yield relpath, entry.stat().st_size
+        except OSError:
+            continue
+
+
+def _scandirs(path, depth):
+    """Yield the directories `depth` levels below `path`"""
+    import os
+    if not depth:
+        yield path
+        return
+    try:
+        with os.scandir(path) as it:
+            subdirs = [e.path for e in it if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return
+    for subdir in subdirs:
+        yield from _scandirs(subdir, depth - 1)